@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# Benchmarks of the hot paths of swugenerator: newc checksum, sha256,
+# packing and extracting artifacts, template expansion, create and
+# sign. Results can be saved as a baseline and compared with a later
+# run, for example:
+#
+#   python benchmarks/run.py --save benchmarks/baselines/$(git rev-parse --short HEAD).json
+#   python benchmarks/run.py --compare benchmarks/baselines/<commit>.json
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import libconf
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=C0413
+import synthetic  # noqa: E402
+
+from swugenerator import main as swugenerator_main  # noqa: E402
+from swugenerator.artifact import Artifact  # noqa: E402
+from swugenerator.swu_file import SWUFile  # noqa: E402
+from swugenerator.template import Template  # noqa: E402
+
+KiB = 1 << 10
+MiB = 1 << 20
+GiB = 1 << 30
+
+PROFILES = {
+    "quick": {"sizes": [4 * KiB, MiB, 64 * MiB], "entries": [100, 1000]},
+    # 3G, newc cannot store files of 4G or more
+    "full": {"sizes": [4 * KiB, MiB, 64 * MiB, GiB, 3 * GiB], "entries": [1000, 5000]},
+}
+# parser and writer of each sw-description format
+FORMATS = {
+    "libconf": (libconf.loads, libconf.dumps),
+    "json": (json.loads, lambda conf: json.dumps(conf, indent=4)),
+}
+# artifacts of a create benchmark, one every COMPRESSED_EVERY is compressed
+CREATE_ARTIFACT_SIZE = 4 * KiB
+COMPRESSED_EVERY = 10
+
+
+def format_size(size):
+    for unit, factor in (("G", GiB), ("M", MiB), ("K", KiB)):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return str(size)
+
+
+def measure(run, repeat, setup=None):
+    """Return the run times of run(), setup() is called before each run and not timed"""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+class Runner:
+    def __init__(self, args, workdir):
+        self.args = args
+        self.workdir = Path(workdir)
+        self.datadir = Path(args.data_dir) if args.data_dir else self.workdir / "data"
+        self.datadir.mkdir(parents=True, exist_ok=True)
+        self.results = {}
+
+    def bench(self, name, run, nbytes=0, setup=None):
+        if self.args.filter and self.args.filter not in name:
+            return
+        times = measure(run, self.args.repeat, setup)
+        median = statistics.median(times)
+        result = {
+            "median": round(median, 6),
+            "min": round(min(times), 6),
+            "runs": len(times),
+            "bytes": nbytes,
+        }
+        if nbytes:
+            result["mb_per_s"] = round(nbytes / median / 1e6, 2)
+        self.results[name] = result
+        rate = f"{result['mb_per_s']:10.2f} MB/s" if nbytes else ""
+        print(f"{name:45s} {median:10.4f} s {rate}", flush=True)
+
+    def artifacts(self):
+        for kind in self.args.kinds:
+            for size in self.args.sizes:
+                path = self.datadir / f"{kind}-{format_size(size)}.bin"
+                synthetic.make_artifact(path, size, kind)
+                yield f"{kind}-{format_size(size)}", path, size
+
+    def run_artifact_benchmarks(self):
+        for label, path, size in self.artifacts():
+            self.bench(f"cpiocrc[{label}]", lambda: SWUFile(None).cpiocrc(path), size)
+            self.bench(
+                f"getsha256[{label}]", lambda: Artifact(str(path)).getsha256(), size
+            )
+            swu = self.workdir / f"{label}.swu"
+
+            def pack():
+                with open(swu, "wb") as f:
+                    cpio = SWUFile(f)
+                    cpio.addartifacttoswu(str(path))
+                    cpio.add_trailer()
+
+            self.bench(f"addartifacttoswu[{label}]", pack, size)
+            if not swu.exists():
+                pack()
+            dest = self.workdir / "extract"
+
+            def extract():
+                with open(swu, "rb") as f:
+                    SWUFile(f).extract(dest)
+
+            self.bench(
+                f"extract[{label}]",
+                extract,
+                size,
+                setup=lambda: shutil.rmtree(dest, ignore_errors=True),
+            )
+            swu.unlink(missing_ok=True)
+            shutil.rmtree(dest, ignore_errors=True)
+
+    def run_template_benchmarks(self, entries):
+        filenames = [f"image-{i:05d}.bin" for i in range(entries)]
+        swdesc = synthetic.make_swdescription(
+            self.workdir / f"sw-description-{entries}.in", filenames
+        )
+        with open(swdesc) as f:
+            lines = f.readlines()
+        confvars = {"VERSION": "1.0", "PRODUCT": "bench", "DEVICE": "mmcblk0"}
+        functions = {"swupdate_get_size": lambda parm: "4096"}
+        self.bench(f"template-compile[{entries}]", lambda: Template(lines))
+        template = Template(lines)
+        self.bench(
+            f"template-render[{entries}]", lambda: template.render(confvars, functions)
+        )
+
+    def run_format_benchmarks(self, entries):
+        """Parse and write the same sw-description in libconf and JSON format"""
+        filenames = [f"image-{i:05d}.bin" for i in range(entries)]
+        confvars = {"VERSION": "1.0", "PRODUCT": "bench", "DEVICE": "mmcblk0"}
+        functions = {"swupdate_get_size": lambda parm: "4096"}
+        for fmt, make in (
+            ("libconf", synthetic.make_swdescription),
+            ("json", synthetic.make_json_swdescription),
+        ):
+            path = make(
+                self.workdir / f"sw-description-{entries}.{fmt}",
+                filenames,
+                compressed=set(filenames[::COMPRESSED_EVERY]),
+            )
+            text = Template.load(str(path)).render(confvars, functions)
+            loads, dumps = FORMATS[fmt]
+            self.bench(f"parse-{fmt}[{entries}]", lambda: loads(text), len(text))
+            conf = loads(text)
+            self.bench(f"dump-{fmt}[{entries}]", lambda: dumps(conf))
+
+    def run_create_benchmarks(self, entries):
+        artdir = self.datadir / f"create-{entries}"
+        artdir.mkdir(exist_ok=True)
+        filenames = [f"image-{i:05d}.bin" for i in range(entries)]
+        for i, filename in enumerate(filenames):
+            synthetic.make_artifact(
+                artdir / filename, CREATE_ARTIFACT_SIZE, "compressible", seed=i
+            )
+        config = synthetic.make_config(self.workdir / "config")
+        nbytes = entries * CREATE_ARTIFACT_SIZE
+        # the libconf SWU is created last and signed below
+        for fmt, make in (
+            ("-json", synthetic.make_json_swdescription),
+            ("", synthetic.make_swdescription),
+        ):
+            swdesc = make(
+                self.workdir / f"sw-description-{entries}{fmt}.in",
+                filenames,
+                compressed=set(filenames[::COMPRESSED_EVERY]),
+            )
+            swu = self.workdir / f"create-{entries}{fmt}.swu"
+            create_args = [
+                "-s",
+                str(swdesc),
+                "-a",
+                str(artdir),
+                "-c",
+                str(config),
+                "-j",
+                str(self.args.jobs),
+                "-o",
+                str(swu),
+                "create",
+            ]
+            self.bench(
+                f"create{fmt}[{entries}]",
+                lambda: swugenerator_main.parse_args(list(create_args)),
+                nbytes,
+            )
+
+        key = self.signing_key()
+        if key is None:
+            return
+        if not swu.exists():
+            swugenerator_main.parse_args(list(create_args))
+        sign_args = [
+            "-k",
+            f"RSA,{key}",
+            "-o",
+            str(self.workdir / f"signed-{entries}.swu"),
+            "sign",
+            "-i",
+            str(swu),
+        ]
+        self.bench(
+            f"sign[{entries}]",
+            lambda: swugenerator_main.parse_args(list(sign_args)),
+            swu.stat().st_size,
+        )
+
+    def signing_key(self):
+        key = self.workdir / "private.pem"
+        if key.exists():
+            return key
+        if not shutil.which("openssl"):
+            print("openssl not found, skipping sign benchmarks", file=sys.stderr)
+            return None
+        subprocess.run(
+            ["openssl", "genrsa", "-out", str(key), "2048"],
+            check=True,
+            capture_output=True,
+        )
+        return key
+
+    def run(self):
+        self.run_artifact_benchmarks()
+        for entries in self.args.entries:
+            self.run_template_benchmarks(entries)
+            self.run_format_benchmarks(entries)
+            self.run_create_benchmarks(entries)
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(baseline, results, tolerance):
+    """Print current against baseline results, return the names of regressions"""
+    regressions = []
+    print(f"\n{'benchmark':45s} {'baseline':>10s} {'current':>10s} {'ratio':>7s}")
+    for name, result in results.items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        ratio = result["median"] / old["median"] if old["median"] else 1.0
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  SLOWER"
+            regressions.append(name)
+        elif ratio < 1 - tolerance:
+            flag = "  faster"
+        print(f"{name:45s} {old['median']:10.4f} {result['median']:10.4f} {ratio:7.2f}{flag}")
+    return regressions
+
+
+def parse_list(parse):
+    return lambda arg: [parse(item) for item in arg.split(",") if item]
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="swugenerator benchmarks")
+    parser.add_argument("--profile", choices=PROFILES, default="quick")
+    parser.add_argument(
+        "--sizes",
+        type=parse_list(swugenerator_main.parse_size),
+        help="comma separated artifact sizes, for example 4K,1M,2G",
+    )
+    parser.add_argument(
+        "--entries",
+        type=parse_list(int),
+        help="comma separated number of entries of the synthetic sw-descriptions",
+    )
+    parser.add_argument(
+        "--kinds",
+        type=parse_list(str),
+        default=list(synthetic.KINDS),
+        help="comma separated kinds of artifacts: " + ",".join(synthetic.KINDS),
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each benchmark")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="jobs for create")
+    parser.add_argument("--filter", help="run only benchmarks containing this string")
+    parser.add_argument(
+        "--data-dir", help="keep the synthetic artifacts here to reuse them across runs"
+    )
+    parser.add_argument("--save", type=Path, help="save the results as a baseline")
+    parser.add_argument("--compare", type=Path, help="baseline to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="relative slowdown reported as a regression, default 0.1",
+    )
+    args = parser.parse_args(args)
+    profile = PROFILES[args.profile]
+    args.sizes = args.sizes or profile["sizes"]
+    args.entries = args.entries or profile["entries"]
+    for kind in args.kinds:
+        if kind not in synthetic.KINDS:
+            parser.error(f"unknown kind {kind}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory(prefix="swugenerator-bench-") as workdir:
+        runner = Runner(args, workdir)
+        cwd = os.getcwd()
+        # create adds the current directory to the artifactory
+        os.chdir(workdir)
+        try:
+            runner.run()
+        finally:
+            os.chdir(cwd)
+
+    report = {"environment": environment(), "results": runner.results}
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, runner.results, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
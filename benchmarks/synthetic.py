@@ -0,0 +1,116 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# Deterministic synthetic inputs for the benchmarks: artifacts of a
+# given size and kind, and sw-description templates with many entries.
+# The same seed always produces the same bytes, so that results can be
+# compared between commits and machines.
+import hashlib
+import json
+import os
+
+KINDS = ("compressible", "incompressible", "sparse")
+BLOCK = 1 << 20
+# a block of data every SPARSE_STRIDE bytes, holes in between
+SPARSE_STRIDE = 64 << 20
+
+
+def _compressible_block(seed):
+    lines = []
+    size = 0
+    i = 0
+    while size < BLOCK:
+        line = f"{seed:04d} {i:08d} swupdate synthetic payload line, compresses well\n"
+        lines.append(line)
+        size += len(line)
+        i += 1
+    return "".join(lines).encode("ascii")[:BLOCK]
+
+
+def _random_block(seed, index, size=BLOCK):
+    return hashlib.shake_128(f"{seed}:{index}".encode("ascii")).digest(size)
+
+
+def make_artifact(path, size, kind, seed=0):
+    """Create path with size bytes of the given kind, unless it already exists"""
+    if kind not in KINDS:
+        raise ValueError(f"Unknown kind of artifact: {kind}")
+    if os.path.exists(path) and os.path.getsize(path) == size:
+        return path
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        if kind == "sparse":
+            f.truncate(size)
+            for offset in range(0, size, SPARSE_STRIDE):
+                f.seek(offset)
+                f.write(_random_block(seed, offset, min(4096, size - offset)))
+        elif kind == "compressible":
+            block = _compressible_block(seed)
+            for offset in range(0, size, BLOCK):
+                f.write(block[: size - offset])
+        else:
+            for index, offset in enumerate(range(0, size, BLOCK)):
+                f.write(_random_block(seed, index, min(BLOCK, size - offset)))
+    os.replace(tmp, path)
+    return path
+
+
+def make_swdescription(path, filenames, compressed=(), functions=True):
+    """Write a sw-description template with one image per filename.
+
+    Entries use @@VARIABLE@@ placeholders, filenames in compressed get
+    a compressed = "zlib" attribute and, with functions set, every entry
+    calls $swupdate_get_size().
+    """
+    lines = [
+        "software =\n",
+        "{\n",
+        '        version = "@@VERSION@@";\n',
+        '        description = "Synthetic update for @@PRODUCT@@";\n',
+        "        images: (\n",
+    ]
+    for i, filename in enumerate(filenames):
+        lines += [
+            "                {\n",
+            f'                        filename = "{filename}";\n',
+            f'                        device = "/dev/@@DEVICE@@p{i % 8 + 1}";\n',
+        ]
+        if filename in compressed:
+            lines.append('                        compressed = "zlib";\n')
+        if functions:
+            lines.append(
+                f'                        size = "$swupdate_get_size({filename})";\n'
+            )
+        lines.append("                }" + ("," if i < len(filenames) - 1 else "") + "\n")
+    lines += ["        );\n", "}\n"]
+    with open(path, "w") as f:
+        f.writelines(lines)
+    return path
+
+
+def make_json_swdescription(path, filenames, compressed=(), functions=True):
+    """Write the JSON equivalent of make_swdescription()"""
+    images = []
+    for i, filename in enumerate(filenames):
+        image = {"filename": filename, "device": f"/dev/@@DEVICE@@p{i % 8 + 1}"}
+        if filename in compressed:
+            image["compressed"] = "zlib"
+        if functions:
+            image["size"] = f"$swupdate_get_size({filename})"
+        images.append(image)
+    software = {
+        "version": "@@VERSION@@",
+        "description": "Synthetic update for @@PRODUCT@@",
+        "images": images,
+    }
+    with open(path, "w") as f:
+        json.dump({"software": software}, f, indent=8)
+        f.write("\n")
+    return path
+
+
+def make_config(path):
+    with open(path, "w") as f:
+        f.write('variables:\n{\n    VERSION = "1.0";\n    PRODUCT = "bench";\n    DEVICE = "mmcblk0";\n};\n')
+    return path
@@ -23,5 +23,8 @@ setup(
     install_requires=[
         "libconf~=2.0.1",
     ],
+    extras_require={
+        "fast": ["cryptography", "numpy", "zstandard"],
+    },
     python_requires=">=3.6",
 )
@@ -1,13 +1,138 @@
 # Copyright (C) 2022 Stefano Babic
 #
 # SPDX-License-Identifier: GPLv3
-import hashlib
+import logging
 import os
 import subprocess
+import threading
+from concurrent.futures import Future
+
+from swugenerator import encrypt
+from swugenerator.digest import digest_file
+
+
+class ArtifactIndex:
+    """Files of the artifactory directories, in search order.
+
+    Each directory is read once with os.scandir when the first lookup
+    happens, instead of probing every directory for every artifact.
+    As with a sequential search, the first directory containing a
+    file wins.
+    """
+
+    def __init__(self, dirs):
+        self.dirs = list(dirs)
+        self._names = None
+        # filename -> directory that satisfied the lookup
+        self.resolved = {}
+
+    def _scan(self):
+        names = {}
+        for libdir in self.dirs:
+            try:
+                with os.scandir(libdir) as it:
+                    for entry in it:
+                        if entry.name in names:
+                            continue
+                        # os.path.exists() is false for dangling symlinks
+                        if entry.is_symlink() and not os.path.exists(entry.path):
+                            continue
+                        names[entry.name] = libdir
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+        return names
+
+    def lookup(self, filename):
+        """Return the path of filename in the first directory containing it, or None"""
+        if os.path.dirname(filename) or os.path.isabs(filename):
+            # names with a directory part are not indexed
+            libdir = next(
+                (d for d in self.dirs if os.path.exists(os.path.join(d, filename))),
+                None,
+            )
+        else:
+            if self._names is None:
+                self._names = self._scan()
+            libdir = self._names.get(filename)
+        if libdir is None:
+            return None
+        if filename not in self.resolved:
+            logging.debug("Artifact %s found in %s", filename, libdir)
+            self.resolved[filename] = libdir
+        return os.path.join(libdir, filename)
+
+
+class ArtifactRegistry:
+    """Digests of the source files of a build, each computed at most once.
+
+    Template functions and entries referring to the same file share
+    the result, concurrent requests wait for a single computation.
+    """
+
+    def __init__(self, compute):
+        self._compute = compute
+        self._lock = threading.Lock()
+        self._digests = {}
+
+    def digest(self, path):
+        st = os.stat(path)
+        key = (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            future = self._digests.get(key)
+            owner = future is None
+            if owner:
+                future = self._digests[key] = Future()
+        if owner:
+            try:
+                future.set_result(self._compute(path))
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+        return future.result()
+
+
+class TransformMemo:
+    """Transformed artifacts shared by the SWUs built in one process.
+
+    An artifact is prepared once for each key, a source digest with the
+    settings of its transformations. Builds asking for a key being
+    prepared wait for it and share the result. Prepared files are moved
+    into directory, where they stay until all builds are done.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._artifacts = {}
+
+    def path(self, key, filename):
+        """Path of the prepared file for key, its basename is the name in the SWU"""
+        directory = os.path.join(self.directory, key)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, filename)
+
+    def get(self, key, prepare):
+        """Return the artifact for key and whether it was prepared by another build.
+
+        prepare() is called if key is new, it returns the Artifact
+        with its file already in directory.
+        """
+        with self._lock:
+            future = self._artifacts.get(key)
+            owner = future is None
+            if owner:
+                future = self._artifacts[key] = Future()
+        if owner:
+            try:
+                future.set_result(prepare())
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+        return future.result(), not owner
 
 
 class Artifact:
-    def __init__(self, filename: str) -> None:
+    def __init__(self, filename: str, digest_func=None) -> None:
         self.filename = filename
         self.newfilename = filename
         self.fullfilename = filename
@@ -15,36 +140,96 @@ class Artifact:
         self.sha256 = ""
         self.ivt = ""
         self.size = 0
+        self._digest = None
+        self._digest_key = None
+        self._digest_func = digest_func
+        # callable(write) producing the content when it is not staged in a file
+        self.stream = None
+        # (PreviousSWU, SWUEntry) holding the content
+        self.payload = None
 
     def exist(self):
         return os.path.exists(self.filename)
 
+    def digest(self):
+        """Return sha256, newc checksum and size of fullfilename.
+
+        The file is read only once, the result is kept until
+        fullfilename points to another file or the file changes.
+        For a streamed artifact the digest is known only if it was set,
+        for a payload of a previous SWU it is always set.
+        """
+        if self.stream or self.payload:
+            return self._digest
+        st = os.stat(self.fullfilename)
+        key = (self.fullfilename, st.st_size, st.st_mtime_ns)
+        if self._digest_key != key:
+            self._digest = (self._digest_func or digest_file)(self.fullfilename)
+            self._digest_key = key
+        return self._digest
+
+    def set_digest(self, digest):
+        """Store a digest computed while fullfilename was written"""
+        st = os.stat(self.fullfilename)
+        if st.st_size != digest.size:
+            raise ValueError(f"Digest does not match {self.fullfilename}")
+        self._digest = digest
+        self._digest_key = (self.fullfilename, st.st_size, st.st_mtime_ns)
+
+    def set_stream(self, stream, digest=None):
+        """Let stream(write) produce the content instead of fullfilename"""
+        self.stream = stream
+        self._digest = digest
+        self._digest_key = None
+
+    def set_payload(self, previous, entry, digest):
+        """Take the content from the payload of entry in a previous SWU"""
+        self.payload = (previous, entry)
+        self.newfilename = entry.name
+        self._digest = digest
+        self._digest_key = None
+
     def getsha256(self):
-        m = hashlib.sha256()
-        with open(os.path.join(self.fullfilename), "rb") as f:
-            while True:
-                data = f.read(1024)
-                if not data:
-                    break
-                m.update(data)
-            f.close()
-        self.sha256 = m.hexdigest()
+        self.sha256 = self.digest().sha256
         return self.sha256
 
-    def findfile(self, artifactdirs):
-        for libdir in artifactdirs:
-            fname = os.path.join(libdir, self.filename)
-            if os.path.exists(fname):
-                self.fullfilename = fname
-                self.sha256 = self.getsha256()
-                self.size = os.path.getsize(fname)
-                return True
-        return False
+    def findfile(self, artifactdirs, digest=True):
+        """Look up filename in a list of directories or an ArtifactIndex.
+
+        Without digest only the size is set, the file is not read.
+        """
+        if isinstance(artifactdirs, ArtifactIndex):
+            fname = artifactdirs.lookup(self.filename)
+        else:
+            fname = next(
+                (
+                    os.path.join(libdir, self.filename)
+                    for libdir in artifactdirs
+                    if os.path.exists(os.path.join(libdir, self.filename))
+                ),
+                None,
+            )
+        if fname is None:
+            return False
+        self.fullfilename = fname
+        if not digest:
+            self.size = os.path.getsize(fname)
+            return True
+        self.sha256 = self.getsha256()
+        self.size = self.digest().size
+        return True
 
     def getsize(self):
         return self.size
 
     def encrypt(self, out, key, iv):
+        """Encrypt fullfilename into out with AES-256-CBC.
+
+        Returns the digest of out when it is computed while encrypting,
+        None if openssl was used.
+        """
+        if encrypt.available():
+            return encrypt.encrypt_file(self.fullfilename, out, key, iv)
         enc_args = [
             "openssl",
             "enc",
@@ -56,3 +241,4 @@ class Artifact:
         ]
         enc_args += ["-K", key, "-iv", iv, "-nosalt"]
         subprocess.run(enc_args, check=True)
+        return None
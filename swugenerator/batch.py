@@ -0,0 +1,96 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# Builds several SWUs in one process. The jobs are read from a manifest
+# in libconf format:
+#
+#   jobs = (
+#       {
+#           sw-description = "board-a/sw-description.in";
+#           config = "board-a/config";
+#           output = "out/board-a.swu";
+#           artifactory = [ "board-a/images" ];
+#       },
+#       ...
+#   );
+#
+# config and artifactory are optional. Relative paths are taken from the
+# directory of the manifest.
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+import libconf
+
+
+class InvalidManifest(ValueError):
+    """Raised when a batch manifest cannot be used"""
+
+
+class BatchJob(NamedTuple):
+    sw_description: Path
+    output: Path
+    config: Optional[Path]
+    artifactory: List[Path]
+
+
+def load_manifest(filename: str) -> List[BatchJob]:
+    """Read the jobs of a batch manifest
+
+    Args:
+        filename (str): Path to the manifest
+
+    Raises:
+        InvalidManifest: If the manifest cannot be read or a job is incomplete
+
+    Returns:
+        List[BatchJob]: The jobs, in manifest order
+    """
+    base = Path(filename).resolve().parent
+    try:
+        with open(filename, "r", encoding="utf-8") as manifest_fd:
+            manifest = libconf.load(manifest_fd)
+    except (OSError, libconf.ConfigParseError) as error:
+        raise InvalidManifest(f"Failed to read manifest {filename}: {error}") from error
+
+    jobs = []
+    outputs = set()
+    for i, job in enumerate(manifest.get("jobs", ())):
+        if not isinstance(job, dict) or "sw-description" not in job or "output" not in job:
+            raise InvalidManifest(f"Job {i} in {filename} needs sw-description and output")
+        output = base / job["output"]
+        if output in outputs:
+            raise InvalidManifest(f"Job {i} in {filename} writes {output} again")
+        outputs.add(output)
+        config = job.get("config")
+        jobs.append(
+            BatchJob(
+                base / job["sw-description"],
+                output,
+                base / config if config else None,
+                [base / d for d in job.get("artifactory", [])],
+            )
+        )
+    if not jobs:
+        raise InvalidManifest(f"No jobs in {filename}")
+    return jobs
+
+
+def run_jobs(jobs: List[BatchJob], build, workers: int) -> None:
+    """Call build(job) for each job, up to workers at the same time
+
+    The first error is raised once all jobs are done.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [(job, pool.submit(build, job)) for job in jobs]
+        error = None
+        for job, future in futures:
+            try:
+                future.result()
+            except BaseException as e:  # pylint: disable=W0703
+                logging.critical("Cannot build %s: %s", job.output, e)
+                error = error or e
+    if error:
+        raise error
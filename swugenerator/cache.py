@@ -0,0 +1,206 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# Persistent caches to avoid repeating work across runs:
+#  - ArtifactCache is a content addressed store for transformed
+#    artifacts. Entries are keyed by the sha256 of the source and by
+#    the settings of the transformations (compression, zck, encryption),
+#    so that an unchanged artifact is not compressed or encrypted again.
+#  - DigestCache remembers the digests of files by their stat data,
+#    so that unchanged files are not hashed again.
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from swugenerator.digest import Digest
+
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024 * 1024
+
+
+@contextlib.contextmanager
+def _flock(lockfile, mode):
+    with open(lockfile, "a") as lock:
+        fcntl.flock(lock, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class ArtifactCache:
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = os.fspath(directory)
+        self.max_size = max_size
+        self.objects = os.path.join(self.directory, "objects")
+        os.makedirs(self.objects, exist_ok=True)
+        self.lockfile = os.path.join(self.directory, "lock")
+
+    @staticmethod
+    def key(source_sha256, transforms):
+        """Return the cache key of a source transformed with the given settings"""
+        desc = json.dumps({"source": source_sha256, **transforms}, sort_keys=True)
+        return hashlib.sha256(desc.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.objects, key[:2], key)
+
+    def get(self, key, dest):
+        """Put the cached payload for key at dest.
+
+        Returns the metadata stored with the payload or None on a miss.
+        """
+        path = self._path(key)
+        with _flock(self.lockfile, fcntl.LOCK_SH):
+            try:
+                with open(path + ".json", "r", encoding="utf-8") as f:
+                    metadata = json.load(f)
+                # Mark as recently used for the LRU eviction
+                os.utime(path)
+                shutil.copyfile(path, dest)
+            except (OSError, ValueError):
+                return None
+        logging.debug("Cache hit %s for %s", key, dest)
+        return metadata
+
+    def put(self, key, src, metadata):
+        """Store src and its metadata under key"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp)
+            with open(tmp + ".json", "w", encoding="utf-8") as f:
+                json.dump(metadata, f)
+            with _flock(self.lockfile, fcntl.LOCK_EX):
+                os.replace(tmp + ".json", path + ".json")
+                os.replace(tmp, path)
+                self._evict()
+        finally:
+            for leftover in (tmp, tmp + ".json"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(leftover)
+
+    def _evict(self):
+        """Drop least recently used payloads until the cache fits in max_size"""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.objects):
+            for name in files:
+                if name.endswith(".json") or name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, path))
+                total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            logging.debug("Cache evicts %s", path)
+            for leftover in (path + ".json", path):
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(leftover)
+            total -= size
+
+
+class DigestCache:
+    """Digests of files keyed by (path, device, inode, size, mtime_ns).
+
+    With a filename the cache is loaded from and saved to a JSON file,
+    otherwise it lives for a single run. A "<file>.sha256" sidecar
+    written by the build system is used, if allowed, instead of hashing
+    a file not yet in the cache. A sidecar carries no newc checksum,
+    it is then computed when the file is packed.
+    """
+
+    def __init__(self, filename=None, sidecars=False):
+        self.filename = os.fspath(filename) if filename else None
+        self.sidecars = sidecars
+        self.entries = {}
+        self._dirty = False
+        if self.filename:
+            self.entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.filename, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logging.warning("Ignoring corrupted digest cache %s", self.filename)
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    @staticmethod
+    def key(path, st):
+        return f"{os.path.realpath(path)}:{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+    @staticmethod
+    def _read_sidecar(path, st):
+        sidecar = os.fspath(path) + ".sha256"
+        try:
+            # a sidecar older than the file is stale
+            if os.stat(sidecar).st_mtime_ns < st.st_mtime_ns:
+                return None
+            with open(sidecar, "r", encoding="utf-8") as f:
+                # same format as sha256sum: "<hash>  <filename>"
+                fields = f.read(1024).split()
+        except OSError:
+            return None
+        if not fields or len(fields[0]) != 64:
+            return None
+        try:
+            bytes.fromhex(fields[0])
+        except ValueError:
+            return None
+        return fields[0].lower()
+
+    def digest(self, path, compute):
+        """Return the digest of path, calling compute(path) if unknown"""
+        st = os.stat(path)
+        key = self.key(path, st)
+        entry = self.entries.get(key)
+        if entry:
+            return Digest(*entry)
+        sha256 = self._read_sidecar(path, st) if self.sidecars else None
+        if sha256:
+            logging.debug("Using sha256 sidecar for %s", path)
+            digest = Digest(sha256, None, st.st_size)
+        else:
+            digest = compute(path)
+        self.entries[key] = list(digest)
+        self._dirty = True
+        return digest
+
+    def save(self):
+        """Merge the entries into the cache file, dropping the stale ones"""
+        if not self.filename or not self._dirty:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        with _flock(self.filename + ".lock", fcntl.LOCK_EX):
+            entries = self._load()
+            entries.update(self.entries)
+            for key in list(entries):
+                path = key.rsplit(":", 4)[0]
+                try:
+                    current = self.key(path, os.stat(path))
+                except OSError:
+                    current = None
+                if current != key:
+                    del entries[key]
+            tmp = f"{self.filename}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp, self.filename)
+        self._dirty = False
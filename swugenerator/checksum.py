@@ -0,0 +1,147 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# Backends for the "newc-crc" CPIO checksum. In spite of its name
+# it is the sum of all bytes of the file truncated to 32 bits.
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MASK = 0xFFFFFFFF
+
+# zlib.adler32 started with 0 returns the plain byte sum in the
+# lower 16 bits as long as it does not reach the adler modulus
+# (65521): 256 bytes sum up to 65280 at most.
+_ADLER_BLOCK = 256
+
+THREADED_MIN_SIZE = 256 * 1024 * 1024
+THREADED_CHUNK = 64 * 1024 * 1024
+
+
+class ChecksumBackendError(Exception):
+    pass
+
+
+def sum_reference(data):
+    """Byte by byte sum as done originally, kept as reference"""
+    crc = 0
+    for b in data:
+        crc += b
+    return crc
+
+
+def sum_stdlib(data):
+    view = memoryview(data)
+    adler32 = zlib.adler32
+    return sum(
+        adler32(view[i : i + _ADLER_BLOCK], 0) & 0xFFFF
+        for i in range(0, len(view), _ADLER_BLOCK)
+    )
+
+
+def sum_numpy(data):
+    return int(numpy.frombuffer(data, dtype=numpy.uint8).sum(dtype=numpy.uint64))
+
+
+BACKENDS = {
+    "python": sum_reference,
+    "stdlib": sum_stdlib,
+}
+if numpy is not None:
+    BACKENDS["numpy"] = sum_numpy
+
+_backend = BACKENDS.get("numpy", sum_stdlib)
+
+
+def self_check(func):
+    """Compare a backend with the reference implementation"""
+    sample = bytes(range(256)) * 33 + b"\xff" * 1031 + os.urandom(517)
+    for data in (b"", b"\x01", sample, sample[:255], sample[3:260]):
+        if func(data) != sum_reference(data):
+            return False
+    return True
+
+
+def set_backend(name):
+    global _backend
+    func = BACKENDS.get(name)
+    if func is None:
+        raise ChecksumBackendError(
+            f"Unknown checksum backend {name}, available: {', '.join(BACKENDS)}"
+        )
+    if not self_check(func):
+        raise ChecksumBackendError(f"Checksum backend {name} gives wrong results")
+    _backend = func
+
+
+def get_backend():
+    return _backend
+
+
+def _checksum_range(path, offset, length, bufsize, func=None):
+    func = func or _backend
+    crc = 0
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        while length > 0:
+            data = os.pread(fd, min(bufsize, length), offset)
+            if not data:
+                break
+            crc += func(data)
+            offset += len(data)
+            length -= len(data)
+    finally:
+        os.close(fd)
+    return crc
+
+
+def _checksum_range_in_process(backend, path, offset, length, bufsize):
+    # a spawned process starts with the default backend
+    return _checksum_range(path, offset, length, bufsize, BACKENDS[backend])
+
+
+def checksum_file(path, threads=None, bufsize=1024 * 1024):
+    """Return the newc checksum of a file.
+
+    Files larger than THREADED_MIN_SIZE are split in THREADED_CHUNK
+    sized ranges summed up in parallel, because the partial sums
+    can be simply added together. NumPy releases the GIL and sums the
+    ranges in threads, the other backends hold it and sum them in
+    separate processes.
+    """
+    size = os.path.getsize(path)
+    if threads is None:
+        threads = os.cpu_count() or 1
+    if threads < 2 or size < THREADED_MIN_SIZE:
+        return _checksum_range(path, 0, size, bufsize) & MASK
+
+    offsets = range(0, size, THREADED_CHUNK)
+    workers = min(threads, len(offsets))
+    if _backend is BACKENDS.get("numpy"):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parts = pool.map(
+                lambda offset: _checksum_range(path, offset, THREADED_CHUNK, bufsize),
+                offsets,
+            )
+            return sum(parts) & MASK
+
+    backend = next(name for name, func in BACKENDS.items() if func is _backend)
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        parts = pool.map(
+            _checksum_range_in_process,
+            [backend] * len(offsets),
+            [os.fspath(path)] * len(offsets),
+            offsets,
+            [THREADED_CHUNK] * len(offsets),
+            [bufsize] * len(offsets),
+        )
+        return sum(parts) & MASK
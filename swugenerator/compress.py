@@ -0,0 +1,145 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# In-process streaming compressors. They replace the external
+# gzip / xz / zstd tools when the Python module is available.
+import lzma
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from swugenerator.digest import Digester, get_buffer
+
+
+class Codec:
+    """Base class for a streaming compressor"""
+
+    name = None
+    # the most threads the compressor can use, None if unlimited
+    max_threads = 1
+    # estimated memory used by each compressor thread
+    memory_per_thread = 1 << 20
+
+    @staticmethod
+    def available():
+        return True
+
+    def compressobj(self, size=-1, threads=0):
+        """Return an object with compress() and flush() methods.
+
+        threads is only a hint, 0 lets the codec choose.
+        """
+        raise NotImplementedError
+
+    def decompressobj(self):
+        """Return an object with a decompress() method"""
+        raise NotImplementedError
+
+
+class ZlibCodec(Codec):
+    # gzip container with empty name and mtime, like "gzip -9 -n".
+    # --rsyncable cannot be reproduced with zlib.
+    name = "zlib"
+
+    def compressobj(self, size=-1, threads=0):
+        return zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def decompressobj(self):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+class XzCodec(Codec):
+    # Same preset and integrity check as the xz tool defaults
+    name = "xz"
+    memory_per_thread = 100 << 20
+
+    def compressobj(self, size=-1, threads=0):
+        return lzma.LZMACompressor(
+            format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64, preset=6
+        )
+
+    def decompressobj(self):
+        return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+
+
+class ZstdCodec(Codec):
+    # Default level of the zstd tool, threads=-1 is the same as -T0.
+    # The output does not depend on the number of threads.
+    name = "zstd"
+    max_threads = None
+    memory_per_thread = 32 << 20
+
+    @staticmethod
+    def available():
+        return zstandard is not None
+
+    def compressobj(self, size=-1, threads=0):
+        cctx = zstandard.ZstdCompressor(
+            level=3,
+            threads=threads or -1,
+            write_checksum=True,
+            write_content_size=True,
+        )
+        return cctx.compressobj(size=size)
+
+    def decompressobj(self):
+        return zstandard.ZstdDecompressor().decompressobj()
+
+
+CODECS = {codec.name: codec for codec in (ZlibCodec, XzCodec, ZstdCodec)}
+
+
+def get_codec(name):
+    """Return an in-process codec for name, None if it is not available"""
+    codec = CODECS.get(name)
+    if codec is None or not codec.available():
+        return None
+    return codec()
+
+
+def compress_to(codec, src, write, threads=0):
+    """Stream src through codec, passing the compressed data to write()"""
+    buf = get_buffer()
+    view = memoryview(buf)
+    with open(src, "rb", buffering=0) as fin:
+        size = os.fstat(fin.fileno()).st_size
+        compressor = codec.compressobj(size, threads)
+        while True:
+            n = fin.readinto(buf)
+            if not n:
+                break
+            data = compressor.compress(view[:n])
+            if data:
+                write(data)
+        data = compressor.flush()
+        if data:
+            write(data)
+
+
+def compress_file(codec, src, dst, threads=0):
+    """Compress src into dst in a single streaming pass.
+
+    Returns the digest of the compressed output, computed
+    while the data flows out of the compressor.
+    """
+    output = Digester()
+    with open(dst, "wb") as fout:
+
+        def write(data):
+            output.update(data)
+            fout.write(data)
+
+        compress_to(codec, src, write, threads)
+    return output.digest()
+
+
+def digest_compressed(codec, src, threads=0):
+    """Return the digest of the compressed src without storing it"""
+    output = Digester()
+    compress_to(codec, src, output.update, threads)
+    return output.digest()
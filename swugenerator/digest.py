@@ -0,0 +1,65 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# Single pass digest engine: an artifact is read once
+# to get its sha256, the newc checksum and its size.
+import hashlib
+import threading
+from typing import NamedTuple
+
+from swugenerator import checksum
+
+BUFSIZE = 1024 * 1024
+
+_buffers = threading.local()
+
+
+class Digest(NamedTuple):
+    sha256: str
+    checksum: int
+    size: int
+
+
+class Digester:
+    """Accumulates sha256, newc checksum and byte count of a stream"""
+
+    def __init__(self, sha256=True):
+        self._sha = hashlib.sha256() if sha256 else None
+        self._bytesum = checksum.get_backend()
+        self.checksum = 0
+        self.size = 0
+
+    def update(self, data):
+        if self._sha:
+            self._sha.update(data)
+        self.checksum = (self.checksum + self._bytesum(data)) & checksum.MASK
+        self.size += len(data)
+
+    def digest(self) -> Digest:
+        return Digest(
+            self._sha.hexdigest() if self._sha else "", self.checksum, self.size
+        )
+
+
+def get_buffer(bufsize=BUFSIZE):
+    """Return a per-thread buffer, reused across files to avoid reallocations"""
+    buf = getattr(_buffers, "buf", None)
+    if buf is None or len(buf) != bufsize:
+        buf = bytearray(bufsize)
+        _buffers.buf = buf
+    return buf
+
+
+def digest_file(path, sha256=True, bufsize=BUFSIZE) -> Digest:
+    """Read path once and return its sha256, newc checksum and size"""
+    digester = Digester(sha256)
+    buf = get_buffer(bufsize)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            digester.update(view[:n])
+    return digester.digest()
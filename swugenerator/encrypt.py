@@ -0,0 +1,83 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# In-process AES-256-CBC encryption, producing the same output as
+# "openssl enc -aes-256-cbc -K <key> -iv <iv> -nosalt": raw key and IV,
+# PKCS#7 padding and no salt header. It is used when the cryptography
+# module is available, otherwise openssl is called.
+try:
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    Cipher = None
+
+from swugenerator.digest import Digester, get_buffer
+
+
+def available():
+    return Cipher is not None
+
+
+def _cipher(key, iv):
+    key = bytes.fromhex(key)
+    iv = bytes.fromhex(iv)
+    if len(key) != 32 or len(iv) != 16:
+        raise ValueError("AES-256-CBC requires a 32 bytes key and a 16 bytes IV")
+    return Cipher(algorithms.AES(key), modes.CBC(iv))
+
+
+class AESEncryptor:
+    """Streaming AES-256-CBC encryptor with PKCS#7 padding"""
+
+    def __init__(self, key, iv):
+        """
+        :type key: hex string, 32 bytes
+        :type iv: hex string, 16 bytes
+        """
+        self._padder = padding.PKCS7(algorithms.AES.block_size).padder()
+        self._encryptor = _cipher(key, iv).encryptor()
+
+    def update(self, data):
+        return self._encryptor.update(self._padder.update(data))
+
+    def finalize(self):
+        return self._encryptor.update(self._padder.finalize()) + self._encryptor.finalize()
+
+
+class AESDecryptor:
+    """Streaming AES-256-CBC decryptor, the counterpart of AESEncryptor.
+
+    finalize() raises ValueError if the padding is wrong, which is
+    what a wrong key or IV usually produces.
+    """
+
+    def __init__(self, key, iv):
+        self._unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+        self._decryptor = _cipher(key, iv).decryptor()
+
+    def update(self, data):
+        return self._unpadder.update(self._decryptor.update(data))
+
+    def finalize(self):
+        return self._unpadder.update(self._decryptor.finalize()) + self._unpadder.finalize()
+
+
+def encrypt_file(src, dst, key, iv):
+    """Encrypt src into dst, returning the digest of the encrypted output"""
+    encryptor = AESEncryptor(key, iv)
+    output = Digester()
+    buf = get_buffer()
+    view = memoryview(buf)
+    with open(src, "rb", buffering=0) as fin, open(dst, "wb") as fout:
+        while True:
+            n = fin.readinto(buf)
+            if not n:
+                break
+            data = encryptor.update(view[:n])
+            output.update(data)
+            fout.write(data)
+        data = encryptor.finalize()
+        output.update(data)
+        fout.write(data)
+    return output.digest()
@@ -2,19 +2,79 @@
 #
 # SPDX-License-Identifier: GPLv3
 import codecs
+import contextlib
+import functools
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
 import re
 import shutil
 import secrets
 import subprocess
 import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from tempfile import TemporaryDirectory
 
 import libconf
 
+from swugenerator import checksum, encrypt, zchunk
 from swugenerator.swu_file import SWUFile
-from swugenerator.artifact import Artifact
+from swugenerator.artifact import Artifact, ArtifactIndex, ArtifactRegistry
+from swugenerator.cache import ArtifactCache, DigestCache
+from swugenerator.compress import (
+    compress_file,
+    compress_to,
+    digest_compressed,
+    get_codec,
+)
+from swugenerator.digest import Digest, digest_file
+from swugenerator.governor import NoSpaceException, TempBudget, check_free_space
+from swugenerator.plan import EXIT_NOT_FOUND, Estimate, Plan, PlanStep
+from swugenerator.scheduler import CoreScheduler
+from swugenerator.swdesc import SWDescription, is_json
+from swugenerator.template import Template, TemplateError
+
+PROCESS_DIGEST_MIN_SIZE = 16 * 1024 * 1024
+# estimated memory of each thread of the external compressors
+EXTERNAL_MEMORY_PER_THREAD = {"xz": 166 << 20, "zstd": 32 << 20, "zlib": 1 << 20}
+# The output of multithreaded xz and zstd does not depend on the
+# number of threads, "+" keeps xz multithreaded with one thread.
+COMPRESSOR_COMMANDS = {
+    "xz": ["xz", "-f", "-k", "-c", "-T+{threads}"],
+    "zlib": ["gzip", "-f", "-9", "-n", "-c", "--rsyncable"],
+    "zstd": ["zstd", "-z", "-k", "-T{threads}", "-f", "-c"],
+}
+# first xz accepting -T+N
+XZ_THREADS_VERSION = (5, 4, 0)
+
+
+@functools.lru_cache(maxsize=None)
+def xz_version():
+    """Version of the xz tool as a tuple, None if it cannot be run"""
+    try:
+        out = subprocess.run(
+            ["xz", "--version"], capture_output=True, text=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    m = re.search(r"(\d+)\.(\d+)\.(\d+)", out)
+    return tuple(int(n) for n in m.groups()) if m else None
+
+
+def threaded_xz():
+    """True if the xz tool can share the thread budget"""
+    return (xz_version() or (0,)) >= XZ_THREADS_VERSION
+
+
+def compressor_command(cmp):
+    """Command line of the external compressor for cmp, None if unknown"""
+    cmd = COMPRESSOR_COMMANDS.get(cmp)
+    if cmp == "xz" and not threaded_xz():
+        # older xz rejects "+N", it then runs single-threaded as by default
+        cmd = [arg for arg in cmd if not arg.startswith("-T")]
+    return cmd
 
 
 class SWUGenerator:
@@ -31,18 +91,51 @@ class SWUGenerator:
         no_compress=False,
         no_encrypt=False,
         no_ivt=False,
-        no_hash=False
+        no_hash=False,
+        jobs=1,
+        external_compressors=False,
+        cache=None,
+        digest_cache=None,
+        stream=False,
+        stats=None,
+        max_threads=None,
+        workdir=None,
+        temp_budget=None,
+        max_memory=None,
+        preserve_format=False,
+        memo=None,
+        pool=None,
+        scheduler=None,
+        registry=None,
+        previous=None,
+        dry_run=False,
     ):
         self.swdescription = template
         self.artifacts = []
-        self.out = open(out, "wb")
-        self.artifactory = dirs
+        # filename in sw-description -> Artifact, to find duplicates
+        self._artifacts_by_name = {}
+        # a dry run stops after the plan, nothing is written
+        self.dry_run = dry_run
+        self.out = open(os.devnull if dry_run else out, "wb")
+        self.outname = out
+        self.artifactory = ArtifactIndex(dirs)
+        # digests of source files, shared by template functions and entries
+        self.registry = registry or ArtifactRegistry(
+            lambda path: self.digest_cache.digest(path, self._compute_digest)
+        )
         self.cpiofile = SWUFile(self.out)
         self.vars = confvars
-        self.lines = []
         self.conf = libconf.AttrDict()
+        # rewrite sw-description in place instead of dumping self.conf
+        self.preserve_format = preserve_format
+        self.inplace = None
+        # JSON sw-description, known once the template is rendered
+        self.json = False
         self.filelist = []
-        self.temp = TemporaryDirectory()
+        if workdir:
+            os.makedirs(workdir, exist_ok=True)
+        self.temp = TemporaryDirectory(dir=workdir)
+        self.temp_budget = TempBudget(temp_budget)
         self.signtool = crypt
         self.aeskey = aeskey
         self.aesiv = firstiv
@@ -51,149 +144,456 @@ class SWUGenerator:
         self.noencrypt = no_encrypt
         self.noivt = no_ivt
         self.nohash = no_hash
+        self.jobs = jobs
+        self.external_compressors = external_compressors
+        self.cache = cache
+        self.digest_cache = digest_cache or DigestCache()
+        self.stream = stream and self.out.seekable()
+        self.seekable_out = self.out.seekable()
+        self._digest_pool = None
+        self.stats = stats
+        self.scheduler = scheduler or CoreScheduler(max_threads, max_memory)
+        # shared with the other SWUs of a batch
+        self.memo = memo
+        self.pool = pool
+        # PreviousSWU whose payloads can be reused
+        self.previous = previous
 
     @staticmethod
     def generate_iv():
         return secrets.token_hex(16)
 
-    def _read_swdesc(self):
-        with codecs.open(self.swdescription, "r") as f:
-            self.lines = f.readlines()
-            f.close()
+    def _stage(self, name, artifact=None, nbytes=0, external=False):
+        """Time a stage of the build when statistics are collected"""
+        if not self.stats:
+            return contextlib.nullcontext()
+        return self.stats.stage(name, artifact, nbytes, external)
+
+    def _in_temp(self, path):
+        return os.path.commonpath([self.temp.name, os.path.abspath(path)]) == self.temp.name
+
+    @contextlib.contextmanager
+    def _temp_space(self, nbytes, filename, streamable=False):
+        """Reserve nbytes in the work directory for a stage writing a file.
+
+        Yields False if the budget cannot hold them, or if the file system
+        cannot and the stage can do without the work directory.
+        """
+        try:
+            check_free_space(self.temp.name, nbytes)
+        except NoSpaceException as e:
+            if not streamable:
+                logging.critical("Not enough space to process %s: %s", filename, e)
+                sys.exit(1)
+            logging.info("Not enough space for %s in the work directory: %s", filename, e)
+            yield False
+            return
+        reserved = self.temp_budget.reserve(nbytes)
+        try:
+            yield reserved
+        finally:
+            if reserved:
+                self.temp_budget.release(nbytes)
+
+    def _replace_file(self, new, path):
+        """Let new point to path in the work directory, dropping the file it replaces"""
+        old = new.fullfilename
+        new.fullfilename = path
+        self.temp_budget.track(path)
+        if old != path and self._in_temp(old):
+            self.temp_budget.remove(old)
 
     def close(self):
+        if self.stats:
+            self.stats.sample_temp(self.temp.name)
+            self.stats.count("kernel_copy_bytes", self.cpiofile.kernel_copied)
+            self.stats.count("buffered_copy_bytes", self.cpiofile.buffered_copied)
+        if self._digest_pool:
+            self._digest_pool.shutdown()
         self.temp.cleanup()
+        self.digest_cache.save()
         self.cpiofile.add_trailer()
         self.out.close()
 
     def process_compressed_entry(self, entry, cmp, new):
-        cmds = {
-            "xz": ["xz", "-f", "-k", "-c"],
-            "zlib": ["gzip", "-f", "-9", "-n", "-c", "--rsyncable"],
-            "zstd": ["zstd", "-z", "-k", "-T0", "-f", "-c"],
-        }
-        cmd = cmds.get(cmp)
+        cmd = compressor_command(cmp)
         if not cmd:
             logging.critical("Wrong compression algorithm: %s", cmp)
             sys.exit(1)
 
+        nbytes = new.getsize()
+        streamable = self._streamable(entry, cmp)
+        with self._temp_space(nbytes, entry["filename"], streamable) as fits:
+            if not fits and streamable:
+                logging.info("No room in the work directory, streaming %s", entry["filename"])
+                self.stream_compressed_entry(cmp, new)
+                return
+            if not fits:
+                logging.warning("Work directory budget exceeded by %s", entry["filename"])
+            self._compress_to_temp(entry, cmp, new, cmd)
+
+    def _compress_to_temp(self, entry, cmp, new, cmd):
         new_path = os.path.join(self.temp.name, new.newfilename) + "." + cmp
         new.newfilename = new.newfilename + "." + cmp
 
-        cmd.extend([new.fullfilename, ">", new_path])
+        codec = self._codec(cmp)
+        nbytes = new.getsize()
+        if codec:
+            with self.scheduler.threads(
+                nbytes, codec.max_threads, codec.memory_per_thread
+            ) as threads:
+                with self._stage("compress", nbytes=nbytes):
+                    digest = compress_file(codec, new.fullfilename, new_path, threads)
+            self._replace_file(new, new_path)
+            new.set_digest(digest)
+            return
 
+        max_useful = None if any("{threads}" in arg for arg in cmd) else 1
+        memory = EXTERNAL_MEMORY_PER_THREAD.get(cmp, 0)
         try:
-            subprocess.run(" ".join(cmd), shell=True, check=True, text=True)
+            with self.scheduler.threads(nbytes, max_useful, memory) as threads:
+                cmd = [arg.format(threads=threads) for arg in cmd]
+                cmd.extend([new.fullfilename, ">", new_path])
+                with self._stage("compress", nbytes=nbytes, external=True):
+                    subprocess.run(" ".join(cmd), shell=True, check=True, text=True)
         except subprocess.CalledProcessError:
             logging.critical(
                 "Cannot compress %s with %s", entry["filename"], cmd
             )
             sys.exit(1)
 
-        new.fullfilename = new_path
+        self._replace_file(new, new_path)
+
+    def process_delta_entry(self, entry, new):
+        """Replace the artifact of entry with its zchunk header.
+
+        zck writes into the work directory only, every artifact has its
+        own output and several zck can run at once with --jobs.
+        """
+        zckfile = os.path.join(self.temp.name, new.newfilename + ".zck")
+        cmd = [
+            "zck",
+            "-u",
+            "--chunk-hash-type",
+            "sha256",
+            "--output",
+            zckfile,
+            new.fullfilename,
+        ]
+        try:
+            with self._temp_space(new.getsize(), entry["filename"]), self._stage(
+                "zck", nbytes=new.getsize(), external=True
+            ):
+                subprocess.run(cmd, check=True)
+        except (OSError, subprocess.CalledProcessError):
+            logging.critical("Cannot create ZCK %s with %s", entry["filename"], cmd)
+            sys.exit(1)
 
-    def process_entry(self, entry):
-        if "filename" not in entry:
-            return
-        new = None
-        for image in self.artifacts:
-            if image.filename == entry["filename"]:
-                new = image
-                break
-        if not new:
-            logging.debug("New artifact %s", entry["filename"])
-            new = Artifact(entry["filename"])
-            if not new.findfile(self.artifactory):
-                logging.critical("Artifact %s not found", entry["filename"])
-                sys.exit(22)
+        zckheaderfile = os.path.join(self.temp.name, new.newfilename)
+        try:
+            zchunk.extract_header(zckfile, zckheaderfile)
+        except zchunk.ZckFormatException as e:
+            logging.critical("Cannot extract ZCK Header %s: %s", entry["filename"], e)
+            sys.exit(1)
+        self._replace_file(new, zckheaderfile)
+
+    def _can_stream(self, entry, cmp):
+        return self.stream and self._streamable(entry, cmp)
+
+    def _streamable(self, entry, cmp):
+        return (
+            self.seekable_out
+            and not self._must_encrypt(entry)
+            and self._codec(cmp) is not None
+        )
+
+    def _codec(self, cmp):
+        """Return the in-process codec for cmp, None if the tool compresses it.
+
+        lzma compresses with one thread, an xz tool that can share the
+        thread budget is preferred. Its output does not depend on the
+        number of threads, but differs from the one of lzma.
+        """
+        if self.external_compressors or (cmp == "xz" and threaded_xz()):
+            return None
+        return get_codec(cmp)
+
+    def stream_compressed_entry(self, cmp, new):
+        """Compress new straight into the SWU when it is packed.
+
+        The sha256 of the output is needed for sw-description before the
+        artifact is packed, it is then computed by compressing once
+        without storing the result. The in-process codecs are
+        deterministic, the data streamed later is checked against it.
+        """
+        codec = get_codec(cmp)
+        src = new.fullfilename
+        new.newfilename = new.newfilename + "." + cmp
+        # an empty file gives the CPIO header the same metadata as a staged one
+        placeholder = os.path.join(self.temp.name, new.newfilename)
+        open(placeholder, "wb").close()
+        self._replace_file(new, placeholder)
+        size = new.getsize()
+
+        def stream(write):
+            with self.scheduler.threads(
+                size, codec.max_threads, codec.memory_per_thread
+            ) as threads:
+                compress_to(codec, src, write, threads)
+
+        digest = None
+        if not self.nohash:
+            with self.scheduler.threads(
+                size, codec.max_threads, codec.memory_per_thread
+            ) as threads:
+                with self._stage("compress", nbytes=size):
+                    digest = digest_compressed(codec, src, threads)
+        new.set_stream(stream, digest)
+
+    def _pack_stream(self, artifact):
+        writer = self.cpiofile.open_entry(
+            artifact.fullfilename, os.stat(artifact.fullfilename)
+        )
+        with self._stage("compress", artifact.filename, artifact.getsize()):
+            artifact.stream(writer.write)
+        digest = writer.close()
+        if artifact.digest() is not None and artifact.digest() != digest:
+            logging.critical(
+                "%s changed while it was streamed into the SWU", artifact.filename
+            )
+            sys.exit(1)
 
-            new.newfilename = entry["filename"]
+    def _digest_file(self, path):
+        # Files in the work directory are new on each run,
+        # only the sources are worth to be remembered.
+        if self._in_temp(path):
+            return self._compute_digest(path)
+        return self.registry.digest(path)
+
+    def _compute_digest(self, path):
+        # Hashing holds the GIL with the pure Python checksum backends,
+        # large files are then digested in a separate process.
+        size = os.path.getsize(path)
+        with self._stage("hash", nbytes=size):
+            if self.jobs > 1 and size >= PROCESS_DIGEST_MIN_SIZE:
+                if checksum.get_backend() is not checksum.BACKENDS.get("numpy"):
+                    if not self._digest_pool:
+                        self._digest_pool = ProcessPoolExecutor(
+                            max_workers=self.jobs,
+                            mp_context=multiprocessing.get_context("spawn"),
+                        )
+                    return self._digest_pool.submit(digest_file, path).result()
+            return digest_file(path)
 
-            if not self.nocompress and (cmp := entry.get("compressed")):
+    def find_artifact(self, filename):
+        return self._artifacts_by_name.get(filename)
+
+    def add_artifact(self, artifact):
+        self.artifacts.append(artifact)
+        self._artifacts_by_name.setdefault(artifact.filename, artifact)
+
+    def prepare_artifact(self, entry):
+        """Look up the artifact of entry and apply the required transformations"""
+        with self._stage("prepare", entry["filename"]):
+            if self.memo:
+                new = self._prepare_shared(entry)
+            else:
+                new = self._prepare_artifact(entry)
+        if self.stats:
+            self.stats.sample_temp(self.temp.name)
+        return new
+
+    def _prepare_shared(self, entry):
+        """Prepare the artifact of entry once for all SWUs sharing self.memo"""
+        transforms = self._transforms(entry)
+        # a generated IV must not be shared, as with the cache
+        if not transforms or ("encrypted" in transforms and not self.noivt):
+            return self._prepare_artifact(entry)
+        source = Artifact(entry["filename"], self._digest_file)
+        if not source.findfile(self.artifactory, digest=False):
+            return self._prepare_artifact(entry)
+        key = ArtifactCache.key(
+            source.getsha256(), {"filename": entry["filename"], **transforms}
+        )
+
+        def prepare():
+            new = self._prepare_artifact(entry)
+            if self._in_temp(new.fullfilename):
+                # the digest is kept, the moved file is not hashed again
+                digest = new.digest()
+                path = self.memo.path(key, os.path.basename(new.fullfilename))
+                shutil.move(new.fullfilename, path)
+                self.temp_budget.forget(new.fullfilename)
+                new.fullfilename = path
+                if not new.stream:
+                    new.set_digest(digest)
+            return new
+
+        new, shared = self.memo.get(key, prepare)
+        if shared:
+            logging.debug("Artifact %s shared with another SWU", entry["filename"])
+            if new.ivt:
+                self._set_encrypted(entry, new, new.ivt)
+        return new
+
+    def _prepare_artifact(self, entry):
+        logging.debug("New artifact %s", entry["filename"])
+        new = Artifact(entry["filename"], self._digest_file)
+        with self._stage("find"):
+            # the source is hashed only if a lookup needs its sha256
+            found = new.findfile(self.artifactory, digest=False)
+        if not found:
+            logging.critical("Artifact %s not found", entry["filename"])
+            sys.exit(EXIT_NOT_FOUND)
+
+        new.newfilename = entry["filename"]
+
+        if self.previous and self._from_previous(entry, new):
+            logging.debug(
+                "Artifact %s taken from %s", entry["filename"], self.previous.filename
+            )
+            return new
+
+        cache_key = self._cache_key(entry, new)
+        if cache_key and self._from_cache(cache_key, entry, new):
+            logging.debug("Artifact %s taken from cache", entry["filename"])
+            return new
+
+        if not self.nocompress and (cmp := entry.get("compressed")):
+            if self._can_stream(entry, cmp):
+                self.stream_compressed_entry(cmp, new)
+            else:
                 self.process_compressed_entry(entry, cmp, new)
-            # compression cannot be used with delta, because it has own compressor
-            elif ("type" in entry) and entry["type"] == "delta":
-                cmd = [
-                    "zck",
-                    "-u",
-                    "--chunk-hash-type",
-                    "sha256",
-                   "--output",
-                    new.fullfilename + ".zck",
-                    new.fullfilename,
-                ]
-                try:
-                    subprocess.run(" ".join(cmd), shell=True, check=True, text=True)
-                except subprocess.CalledProcessError:
-                    logging.critical(
-                        "Cannot create ZCK %s with %s", entry["filename"], cmd
-                    )
-                    sys.exit(1)
-
-                # Now extract header
-                cmd = [
-                    "zck_read_header",
-                    "-v",
-                    new.fullfilename + ".zck",
-                ]
-                try:
-                    result =  subprocess.run(" ".join(cmd),
-                                             shell=True,
-                                             check=True,
-                                             capture_output=True,
-                                             text=True)
-                except subprocess.CalledProcessError:
-                    logging.critical(
-                        "Cannot extract ZCK Header %s with %s", entry["filename"], cmd
-                    )
-                    sys.exit(1)
-
-                found_header =  re.search(r"Header size: (\d+)", result.stdout)
-                header_size = int(found_header.group(1))
-                zckheaderfile = os.path.join(self.temp.name, new.newfilename)
-
-                with open(zckheaderfile, "wb") as zck:
-                    with open(new.fullfilename + ".zck", "rb") as tmpzck:
-                        while header_size:
-                            chunk = tmpzck.read(header_size)
-                            if not chunk:
-                                break
-                            zck.write(chunk)
-                            header_size -= len(chunk)
-                new.fullfilename = zckheaderfile
-
-            # Encrypt if required
-            if "encrypted" in entry and entry["encrypted"] is True and not self.noencrypt:
-                if not self.aeskey:
+        # compression cannot be used with delta, because it has own compressor
+        elif ("type" in entry) and entry["type"] == "delta":
+            self.process_delta_entry(entry, new)
+
+        # Encrypt if required
+        if self._must_encrypt(entry):
+            if not self.aeskey:
+                logging.critical(
+                    "%s must be encrypted, but no encryption key is given",
+                    entry["filename"],
+                )
+            if self.noivt:
+                if not self.aesiv:
                     logging.critical(
-                        "%s must be encrypted, but no encryption key is given",
+                        "%s must be encrypted, but no initialization vector is given",
                         entry["filename"],
                     )
-                if self.noivt:
-                    if not self.aesiv:
-                        logging.critical(
-                            "%s must be encrypted, but no initialization vector is given",
-                            entry["filename"],
-                        )
-                    iv = self.aesiv
-                else:
-                    iv = self.generate_iv()
-
-                new.newfilename = new.newfilename + "." + "enc"
-                new_path = os.path.join(self.temp.name, new.newfilename)
-                new.encrypt(new_path, self.aeskey, iv)
-                new.fullfilename = new_path
-                # recompute sha256, now for the encrypted file
-                entry["ivt"] = iv
-                new.ivt = iv
+                iv = self.aesiv
+            else:
+                iv = self.generate_iv()
+
+            new.newfilename = new.newfilename + "." + "enc"
+            new_path = os.path.join(self.temp.name, new.newfilename)
+            nbytes = os.path.getsize(new.fullfilename)
+            with self._temp_space(nbytes, entry["filename"]) as fits, self._stage(
+                "encrypt", nbytes=nbytes, external=not encrypt.available()
+            ):
+                if not fits:
+                    logging.warning("Work directory budget exceeded by %s", entry["filename"])
+                digest = new.encrypt(new_path, self.aeskey, iv)
+            self._replace_file(new, new_path)
+            if digest:
+                new.set_digest(digest)
+            self._set_encrypted(entry, new, iv)
+
+        # the digest of the final file is needed in any case for the CPIO header
+        digest = new.digest()
+        if cache_key and not new.stream:
+            self.cache.put(
+                cache_key,
+                new.fullfilename,
+                {"ivt": new.ivt, **digest._asdict()},
+            )
+        return new
 
-                entry.setdefault("properties", {}) \
-                    .update({ "decrypted-size": str(new.getsize()) })
-
-            self.artifacts.append(new)
-        else:
-            logging.debug("Artifact %s already stored", entry["filename"])
+    def _must_encrypt(self, entry):
+        return "encrypted" in entry and entry["encrypted"] is True and not self.noencrypt
 
+    @staticmethod
+    def _set_encrypted(entry, new, iv):
+        # sha256 is recomputed later, now for the encrypted file
+        entry["ivt"] = iv
+        new.ivt = iv
+
+        entry.setdefault("properties", {}) \
+            .update({ "decrypted-size": str(new.getsize()) })
+
+    def _transforms(self, entry):
+        """Settings of the transformations applied to the artifact of entry"""
+        transforms = {}
+        if not self.nocompress and (cmp := entry.get("compressed")):
+            inprocess = self._codec(cmp)
+            transforms["compressed"] = [cmp, "inprocess" if inprocess else "external"]
+        elif ("type" in entry) and entry["type"] == "delta":
+            transforms["delta"] = "zck -u --chunk-hash-type sha256"
+        if self._must_encrypt(entry) and self.aeskey:
+            transforms["encrypted"] = {
+                "key": hashlib.sha256(self.aeskey.encode("ascii")).hexdigest(),
+                "iv": self.aesiv if self.noivt else "random",
+            }
+        return transforms
+
+    def _cache_key(self, entry, new):
+        """Return the cache key for the artifact of entry, None if not cacheable"""
+        if not self.cache:
+            return None
+        transforms = self._transforms(entry)
+        if not transforms:
+            return None
+        # Reusing a randomly generated IV would defeat its purpose,
+        # only a fixed IV allows encrypted artifacts to be cached.
+        if "encrypted" in transforms and not self.noivt:
+            return None
+        return self.cache.key(new.getsha256(), transforms)
+
+    def _payload_name(self, entry):
+        """Name of the artifact of entry in the SWU"""
+        newfilename = entry["filename"]
+        if not self.nocompress and (cmp := entry.get("compressed")):
+            newfilename = newfilename + "." + cmp
+        if self._must_encrypt(entry):
+            newfilename = newfilename + ".enc"
+        return newfilename
+
+    def _from_previous(self, entry, new):
+        """Take the artifact of entry from the previous SWU if made from the same source"""
+        transforms = self._transforms(entry)
+        if not transforms or "delta" in transforms:
+            return False
+        # as with the cache, a generated IV is never reused
+        if "encrypted" in transforms and not self.noivt:
+            return False
+        cmp = transforms["compressed"][0] if "compressed" in transforms else None
+        iv = self.aesiv if "encrypted" in transforms else None
+        found = self.previous.find(self._payload_name(entry), new.digest(), cmp, iv)
+        if not found:
+            return False
+        payload, digest = found
+        new.set_payload(self.previous, payload, digest)
+        if iv:
+            self._set_encrypted(entry, new, iv)
+        return True
+
+    def _from_cache(self, cache_key, entry, new):
+        newfilename = self._payload_name(entry)
+        dest = os.path.join(self.temp.name, newfilename)
+        metadata = self.cache.get(cache_key, dest)
+        if not metadata:
+            return False
+        new.newfilename = newfilename
+        self._replace_file(new, dest)
+        new.set_digest(
+            Digest(metadata["sha256"], metadata["checksum"], metadata["size"])
+        )
+        if metadata["ivt"]:
+            self._set_encrypted(entry, new, metadata["ivt"])
+        return True
+
+    def finalize_entry(self, entry, new):
+        """Update entry in sw-description with the data of its artifact"""
         entry["filename"] = new.newfilename
         if not self.nohash:
             entry["sha256"] = new.getsha256()
@@ -203,61 +603,277 @@ class SWUGenerator:
             entry.setdefault("properties", {}) \
                  .update({ "decompressed-size": str(new.getsize()) })
 
+    def process_entry(self, entry):
+        if "filename" not in entry:
+            return
+        new = self.find_artifact(entry["filename"])
+        if not new:
+            new = self.prepare_artifact(entry)
+            self.add_artifact(new)
+        else:
+            logging.debug("Artifact %s already stored", entry["filename"])
+        self.finalize_entry(entry, new)
+
+    def process_entries(self):
+        if self.jobs <= 1 and not self.pool:
+            for entry in self.filelist:
+                self.process_entry(entry)
+            return
+
+        if self.pool:
+            self._process_entries(self.pool)
+            return
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            self._process_entries(pool)
+
+    def _process_entries(self, pool):
+        # Each artifact is prepared once, in parallel. Results are then
+        # applied in the original order, so that the CPIO layout and
+        # sw-description are the same as in a serial build.
+        pending = {}
+        for entry in self.filelist:
+            name = entry.get("filename")
+            if name is None or name in pending or self.find_artifact(name):
+                continue
+            pending[name] = pool.submit(self.prepare_artifact, entry)
+
+        for entry in self.filelist:
+            if "filename" not in entry:
+                continue
+            future = pending.pop(entry["filename"], None)
+            if future:
+                new = future.result()
+                self.add_artifact(new)
+            else:
+                new = self.find_artifact(entry["filename"])
+                logging.debug("Artifact %s already stored", entry["filename"])
+            self.finalize_entry(entry, new)
+
+    def plan(self, estimate=False):
+        """Check that the artifacts of all entries can be processed.
+
+        Nothing is transformed: the artifacts are looked up, and the
+        tools, keys and work directory space they need are checked.
+        With estimate the size and time of the transformations are
+        estimated from samples of each artifact.
+        """
+        plan = Plan()
+        planned = set()
+        # the most a single stage reserves in the work directory,
+        # and the most a stage that cannot stream instead must find free
+        largest = required = 0
+        for entry in self.filelist:
+            if entry["filename"] in planned:
+                continue
+            planned.add(entry["filename"])
+            step, reserved, staged, streamable = self._plan_entry(plan, entry, estimate)
+            plan.add(step)
+            largest = max(largest, reserved)
+            if not streamable:
+                required = max(required, reserved)
+            plan.temp_needed += staged
+        if self.encryptswdesc:
+            self._plan_encryption(plan, "sw-description", True)
+
+        plan.temp_needed += largest
+        plan.temp_free = shutil.disk_usage(self.temp.name).free
+        if required:
+            try:
+                check_free_space(self.temp.name, required)
+            except NoSpaceException as e:
+                plan.error(f"Not enough space in the work directory: {e}")
+        if estimate and plan.temp_needed > plan.temp_free:
+            plan.warning("The work directory may not hold all artifacts")
+        if self.temp_budget.limit and plan.temp_needed > self.temp_budget.limit:
+            plan.warning(
+                "The work directory budget is exceeded, "
+                "artifacts wait for each other or are streamed"
+            )
+        return plan
+
+    def _plan_entry(self, plan, entry, estimate):
+        """Return the PlanStep of entry, with the bytes its stages reserve
+        in the work directory, the bytes kept there until it is packed and
+        whether it is streamed into the SWU when they do not fit
+        """
+        name = entry["filename"]
+        output = self._payload_name(entry)
+        source = Artifact(name)
+        if not source.findfile(self.artifactory, digest=False):
+            plan.error(f"Artifact {name} not found", EXIT_NOT_FOUND)
+            return PlanStep(name, None, 0, [], output), 0, 0, False
+
+        size = source.getsize()
+        sizes = Estimate(source.fullfilename, size) if estimate else None
+        transforms = []
+        reserved = 0
+        streamed = False
+        cmp = None
+        if not self.nocompress and (cmp := entry.get("compressed")):
+            reserved = size
+            codec = get_codec(cmp)
+            if cmp not in COMPRESSOR_COMMANDS:
+                plan.error(f"Wrong compression algorithm {cmp} for {name}")
+            elif self._codec(cmp):
+                transforms.append(cmp)
+                streamed = self._can_stream(entry, cmp)
+            else:
+                tool = COMPRESSOR_COMMANDS[cmp][0]
+                transforms.append(f"{cmp} ({tool})")
+                if not shutil.which(tool):
+                    plan.error(f"{tool} is needed to compress {name}, but it is not found")
+                elif cmp == "xz" and xz_version() is None:
+                    plan.error("Cannot get the version of xz")
+                elif cmp == "xz" and xz_version() < XZ_THREADS_VERSION:
+                    version = ".".join(str(n) for n in xz_version())
+                    plan.warning(f"xz {version} does not accept -T+N, it compresses with one thread")
+            if sizes and codec:
+                sizes.compress(codec, self.scheduler.max_threads)
+            elif sizes:
+                sizes.unknown()
+        elif ("type" in entry) and entry["type"] == "delta":
+            reserved = size
+            transforms.append("zck")
+            if not shutil.which("zck"):
+                plan.error(f"zck is needed for the delta of {name}, but it is not found")
+            if sizes:
+                # only the zchunk header is packed, its size is not known
+                sizes.unknown()
+
+        if self._must_encrypt(entry):
+            transforms.append("aes-256-cbc" if self.noivt else "aes-256-cbc, new IV")
+            self._plan_encryption(plan, name, self.noivt)
+            if sizes:
+                if sizes.size is not None:
+                    reserved = max(reserved, sizes.size)
+                sizes.encrypt()
+            else:
+                reserved = max(reserved, size)
+
+        step = PlanStep(
+            name,
+            source.fullfilename,
+            size,
+            transforms,
+            output,
+            sizes.size if sizes else None,
+            sizes.seconds if sizes else None,
+        )
+        streamable = bool(cmp) and self._streamable(entry, cmp)
+        if not transforms or streamed:
+            return step, reserved if not streamed else 0, 0, streamable
+        staged = step.estimated_size if step.estimated_size is not None else size
+        return step, reserved, staged, streamable
+
+    def _plan_encryption(self, plan, name, fixed_iv):
+        """Check key, IV and tool to encrypt name"""
+        if not self.aeskey:
+            plan.error(f"{name} must be encrypted, but no encryption key is given")
+        elif not _is_hex(self.aeskey, 32):
+            plan.error("The encryption key must be 32 bytes in hexadecimal")
+        if fixed_iv:
+            if not self.aesiv:
+                plan.error(
+                    f"{name} must be encrypted, but no initialization vector is given"
+                )
+            elif not _is_hex(self.aesiv, 16):
+                plan.error("The initialization vector must be 16 bytes in hexadecimal")
+        if not encrypt.available() and not shutil.which("openssl"):
+            plan.error(f"openssl is needed to encrypt {name}, but it is not found")
+
     def find_files_in_swdesc(self, first):
+        """Collect the entries with a filename, libconf groups or JSON objects"""
         for n, val in first.items():
-            if isinstance(val, libconf.AttrDict):
+            if isinstance(val, dict):
                 self.find_files_in_swdesc(val)
-            elif isinstance(val, tuple):
-                for t in val:
-                    self.find_files_in_swdesc(t)
+            elif isinstance(val, tuple) or (self.json and isinstance(val, list)):
+                self._find_files_in_list(val)
             else:
                 logging.debug("%s = %s", n, val)
                 if n == "filename":
                     self.filelist.append(first)
 
+    def _find_files_in_list(self, items):
+        for item in items:
+            if isinstance(item, dict):
+                self.find_files_in_swdesc(item)
+            elif isinstance(item, (tuple, list)):
+                self._find_files_in_list(item)
+
     def save_swdescription(self, filename, contents):
         with codecs.open(filename, "w", "utf-8") as swd:
             swd.write(contents)
 
     def process(self):
-        self._read_swdesc()
-        self._expand_variables()
-        self._exec_functions()
+        try:
+            with self._stage("template"):
+                swdesc = Template.load(self.swdescription).render(
+                    self.vars, self.template_functions(), self.jobs
+                )
+        except TemplateError as e:
+            logging.critical("sw-description template: %s", e)
+            sys.exit(1)
+        with self._stage("parse"):
+            self.json = is_json(swdesc)
+            if self.json:
+                self.conf = json.loads(swdesc)
+            elif self.preserve_format:
+                self.inplace = SWDescription(swdesc)
+                self.conf = self.inplace.conf
+            else:
+                self.conf = libconf.loads(swdesc)
+            self.find_files_in_swdesc(self.conf["software"])
 
-        swdesc = ""
-        for line in self.lines:
-            swdesc = swdesc + line
-        self.conf = libconf.loads(swdesc)
-        self.find_files_in_swdesc(self.conf.software)
+        with self._stage("plan"):
+            plan = self.plan(estimate=self.dry_run)
+        if self.dry_run:
+            sys.stdout.write(f"{self.outname}:\n{plan.format()}")
+        else:
+            logging.info("Plan for %s: %s", self.outname, plan.summary())
+            logging.debug("Plan for %s:\n%s", self.outname, plan.format())
+        for message in plan.warnings:
+            logging.warning(message)
+        if plan.errors:
+            for message, _ in plan.errors:
+                logging.critical(message)
+            sys.exit(plan.exit_code())
+        if self.dry_run:
+            return
 
         sw = Artifact("sw-description")
         sw.fullfilename = os.path.join(self.temp.name, sw.filename)
-        self.artifacts.append(sw)
+        self.add_artifact(sw)
         if self.signtool:
             sig = Artifact("sw-description.sig")
             sig.fullfilename = os.path.join(self.temp.name, "sw-description.sig")
-            self.artifacts.append(sig)
-
-        for entry in self.filelist:
-            self.process_entry(entry)
+            self.add_artifact(sig)
 
-        swdesc = libconf.dumps(self.conf)
+        with self._stage("entries"):
+            self.process_entries()
 
-        # libconf mishandle special character if they are part
-        # of an attribute. This happens to the embedded-script
-        # and the script results to be in just one line.
-        # Reinsert \n and \t that was removed by libconf
-        swdesc = re.sub(r"\\n", "\n", swdesc)
-        swdesc = re.sub(r"\\t", "\t", swdesc)
+        with self._stage("swdesc"):
+            if self.json:
+                swdesc = json.dumps(self.conf, indent=4, ensure_ascii=False) + "\n"
+            elif self.inplace:
+                swdesc = self.inplace.dumps(self.filelist)
+            else:
+                swdesc = libconf.dumps(self.conf)
+                # libconf mishandle special character if they are part
+                # of an attribute. This happens to the embedded-script
+                # and the script results to be in just one line.
+                # Reinsert \n and \t that was removed by libconf
+                swdesc = re.sub(r"\\n", "\n", swdesc)
+                swdesc = re.sub(r"\\t", "\t", swdesc)
 
-        swdesc_filename = os.path.join(self.temp.name, sw.filename)
-        self.save_swdescription(swdesc_filename, swdesc)
+            swdesc_filename = os.path.join(self.temp.name, sw.filename)
+            self.save_swdescription(swdesc_filename, swdesc)
 
         if self.signtool:
             sw_desc_in = swdesc_filename
             sw_desc_out = os.path.join(self.temp.name, "sw-description.sig")
             self.signtool.prepare_cmd(sw_desc_in, sw_desc_out)
-            self.signtool.sign()
+            with self._stage("sign", external=True):
+                self.signtool.sign()
 
         # Encrypt sw-description if required
         if self.encryptswdesc:
@@ -273,63 +889,51 @@ class SWUGenerator:
             iv = self.aesiv
             sw.fullfilename = swdesc_filename
             swdesc_enc = swdesc_filename + ".enc"
-            sw.encrypt(swdesc_enc, self.aeskey, iv)
+            with self._stage("encrypt", sw.filename, external=not encrypt.available()):
+                digest = sw.encrypt(swdesc_enc, self.aeskey, iv)
             shutil.copyfile(swdesc_enc, sw.fullfilename)
+            if digest:
+                sw.set_digest(digest)
 
         for artifact in self.artifacts:
-            self.cpiofile.addartifacttoswu(artifact.fullfilename)
-
-    def _expand_variables(self):
-        write_lines = []
-        for line in self.lines:
-            while True:
-                m = re.match(
-                    r"^(?P<before_placeholder>.+)@@(?P<variable_name>\w+)@@(?P<after_placeholder>.+)$",
-                    line,
-                )
-                if m:
-                    variable_value = self.vars[m.group("variable_name")]
-                    line = (
-                        m.group("before_placeholder")
-                        + variable_value
-                        + m.group("after_placeholder")
-                    )
-                    continue
+            digest = artifact.digest()
+            with self._stage("pack", artifact.filename, digest.size if digest else 0):
+                if artifact.stream:
+                    self._pack_stream(artifact)
+                elif artifact.payload:
+                    previous, payload = artifact.payload
+                    previous.pack(self.cpiofile, payload)
                 else:
-                    break
-            write_lines.append(line)
-        self.lines = write_lines
-
-    def _exec_functions(self):
-        for index, line in enumerate(self.lines):
-            m = re.match(
-                r"^(?P<before_placeholder>.+)\$(?P<function_name>\w+)\((?P<parms>.+)\)(?P<after_placeholder>.+)$",
-                line,
-            )
-            if m:
-                fun = (
-                    "self." + m.group("function_name") + '("' + m.group("parms") + '")'
-                )
-                ret = eval(fun)
-                line = (
-                    m.group("before_placeholder")
-                    + ret
-                    + m.group("after_placeholder")
-                    + "\n"
-                )
-                self.lines[index] = line
+                    self.cpiofile.addartifacttoswu(artifact.fullfilename, digest)
+            # intermediates are not needed once they are in the SWU
+            if self._in_temp(artifact.fullfilename):
+                self.temp_budget.remove(artifact.fullfilename)
+
+    def template_functions(self):
+        """Functions that can be called from the template as $name(parameter)"""
+        return {
+            "swupdate_get_sha256": self.swupdate_get_sha256,
+            "swupdate_get_size": self.swupdate_get_size,
+        }
 
     def setenckey(self, k, iv):
         self.aeskey = k
         self.aesiv = iv
 
     def swupdate_get_sha256(self, filename):
-        a = Artifact(filename)
+        a = Artifact(filename, self._digest_file)
         if a.findfile(self.artifactory):
             return a.getsha256()
 
     def swupdate_get_size(self, filename):
-        a = Artifact(filename)
-        if a.findfile(self.artifactory):
+        a = Artifact(filename, self._digest_file)
+        if a.findfile(self.artifactory, digest=False):
             return str(a.getsize())
         return "0"
+
+
+def _is_hex(value, nbytes):
+    try:
+        return len(bytes.fromhex(value)) == nbytes
+    except ValueError:
+        return False
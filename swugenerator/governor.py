@@ -0,0 +1,89 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# Keeps the work directory within a byte budget and checks the free
+# space of its file system before files are written into it.
+import os
+import shutil
+import threading
+
+# kept free on the file system of the work directory
+FREE_SPACE_MARGIN = 64 << 20
+
+
+class NoSpaceException(Exception):
+    pass
+
+
+def check_free_space(directory, nbytes, margin=FREE_SPACE_MARGIN):
+    """Raise NoSpaceException if directory cannot hold nbytes more.
+
+    A margin is kept free as well. It is at most as large as nbytes,
+    so that small files are not refused because of it.
+    """
+    margin = min(margin, nbytes)
+    free = shutil.disk_usage(directory).free
+    if free < nbytes + margin:
+        raise NoSpaceException(
+            f"{nbytes} bytes and a margin of {margin} bytes needed in {directory}, "
+            f"only {free} free"
+        )
+
+
+class TempBudget:
+    """Bytes of the work directory shared by the artifacts being prepared.
+
+    Files kept for packing are tracked, stages about to write a file
+    reserve an estimate of its size first. A reservation exceeding the
+    budget waits while other stages are running, as they may free
+    space by replacing an intermediate file. If nothing else is running
+    the reservation is refused, the caller has to do without the work
+    directory or go beyond the budget.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self._cond = threading.Condition()
+        self._files = {}
+        self.held = 0
+        self.reserved = 0
+
+    def _fits(self, nbytes):
+        return self.limit is None or self.held + self.reserved + nbytes <= self.limit
+
+    def reserve(self, nbytes):
+        """Wait until nbytes fit in the budget, return False if they never will"""
+        with self._cond:
+            while not self._fits(nbytes) and self.reserved:
+                self._cond.wait()
+            if not self._fits(nbytes):
+                return False
+            self.reserved += nbytes
+            return True
+
+    def release(self, nbytes):
+        with self._cond:
+            self.reserved -= nbytes
+            self._cond.notify_all()
+
+    def track(self, path):
+        """Account for a file kept in the work directory"""
+        size = os.path.getsize(path)
+        with self._cond:
+            self.held += size - self._files.get(path, 0)
+            self._files[path] = size
+
+    def forget(self, path):
+        """Give back the space of a tracked file moved out of the work directory"""
+        with self._cond:
+            self.held -= self._files.pop(path, 0)
+            self._cond.notify_all()
+
+    def remove(self, path):
+        """Delete a tracked file and give its space back"""
+        self.forget(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -6,16 +6,25 @@
 # pylint: disable=C0114
 
 import argparse
+import copy
 import logging
 import os
 import sys
 import textwrap
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from typing import List, Optional, Tuple, Union
 
 import libconf
 
-from swugenerator import __about__, generator, signer
+from swugenerator import __about__, batch, generator, signer
+from swugenerator.artifact import ArtifactRegistry, TransformMemo
+from swugenerator.cache import DEFAULT_MAX_SIZE, ArtifactCache, DigestCache
+from swugenerator.digest import digest_file
+from swugenerator.reuse import PreviousSWU
+from swugenerator.scheduler import CoreScheduler
+from swugenerator.stats import Stats
 
 from swugenerator.swu_sign import SWUSignCMS, SWUSignCustom, SWUSignPKCS11, SWUSignRSA
 
@@ -172,15 +181,55 @@ def set_log_level(arg: str) -> str:
     return arg
 
 
-def create_swu(args: argparse.Namespace) -> None:
-    """Creates SWU archive from arguments passed to SWUGenerate
+def parse_jobs(arg: str) -> int:
+    """Parses number of parallel jobs, 0 means one job per CPU
 
     Args:
-        args (argparse.Namespace): Parsed arguments to generate SWU file with
+        arg (str): Number of jobs
+
+    Raises:
+        argparse.ArgumentTypeError: If arg is not a non negative number
+
+    Returns:
+        int: Number of jobs to run in parallel
     """
-    # Extract key and iv from encryption_key_file (Will default to '(None, None)')
-    key, init_vec = args.encryption_key_file
+    try:
+        jobs = int(arg)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"invalid number of jobs: {arg}") from error
+    if jobs < 0:
+        raise argparse.ArgumentTypeError(f"invalid number of jobs: {arg}")
+    return jobs or os.cpu_count() or 1
+
+
+def parse_size(arg: str) -> int:
+    """Parses a size in bytes with an optional K, M or G suffix
+
+    Args:
+        arg (str): Size, for example 512M or 10G
+
+    Raises:
+        argparse.ArgumentTypeError: If arg is not a valid size
 
+    Returns:
+        int: Size in bytes
+    """
+    multipliers = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    value = arg.strip().upper()
+    multiplier = multipliers.get(value[-1:], 1)
+    if value[-1:] in multipliers:
+        value = value[:-1]
+    try:
+        size = int(value) * multiplier
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"invalid size: {arg}") from error
+    if size < 0:
+        raise argparse.ArgumentTypeError(f"invalid size: {arg}")
+    return size
+
+
+def _prepare_create(args: argparse.Namespace) -> None:
+    """Completes the arguments shared by create and batch"""
     # Add current working directory to search path
     args.artifactory.append(Path(os.getcwd()))
 
@@ -188,12 +237,37 @@ def create_swu(args: argparse.Namespace) -> None:
     if hasattr(args, 'sign') and args.sign and isinstance(args.sign, str):
         args.sign = parse_signing_option(args.sign, args.engine, args.keyform)
 
-    swu = generator.SWUGenerator(
-        args.sw_description,
-        args.swu_file,
-        args.config,
-        args.artifactory,
-        args.sign,
+
+def _caches(args: argparse.Namespace) -> Tuple[Optional[ArtifactCache], DigestCache]:
+    """Creates the artifact and digest caches selected by the arguments"""
+    cache = None
+    digest_cache_file = args.digest_cache
+    if args.cache_dir:
+        cache = ArtifactCache(args.cache_dir, args.cache_max_size)
+        digest_cache_file = digest_cache_file or args.cache_dir / "digests.json"
+    return cache, DigestCache(digest_cache_file, args.sha256_sidecars)
+
+
+def _new_generator(
+    args: argparse.Namespace,
+    sw_description: Path,
+    swu_file: Path,
+    config: dict,
+    artifactory: List[Path],
+    sign,
+    cache: Optional[ArtifactCache],
+    digest_cache: DigestCache,
+    stats: Optional[Stats],
+    **shared,
+) -> generator.SWUGenerator:
+    # Extract key and iv from encryption_key_file (Will default to '(None, None)')
+    key, init_vec = args.encryption_key_file
+    return generator.SWUGenerator(
+        sw_description,
+        swu_file,
+        config,
+        artifactory,
+        sign,
         key,
         init_vec,
         args.encrypt_swdesc,
@@ -201,9 +275,123 @@ def create_swu(args: argparse.Namespace) -> None:
         args.no_encrypt,
         args.no_ivt,
         args.no_hash,
+        args.jobs,
+        args.external_compressors,
+        cache,
+        digest_cache,
+        args.stream,
+        stats,
+        args.max_threads,
+        args.workdir,
+        args.temp_budget,
+        args.max_memory,
+        args.preserve_format,
+        dry_run=args.dry_run,
+        **shared,
+    )
+
+
+def _previous_swu(args: argparse.Namespace) -> Optional[PreviousSWU]:
+    """Opens the SWU given with --reuse-from"""
+    if not args.reuse_from:
+        return None
+    key, init_vec = args.encryption_key_file
+    return PreviousSWU(args.reuse_from, key, init_vec)
+
+
+def _save_stats(args: argparse.Namespace, stats: Optional[Stats]) -> None:
+    if args.stats:
+        stats.save(args.stats)
+    if args.trace:
+        stats.save_trace(args.trace)
+
+
+def create_swu(args: argparse.Namespace) -> None:
+    """Creates SWU archive from arguments passed to SWUGenerate
+
+    Args:
+        args (argparse.Namespace): Parsed arguments to generate SWU file with
+    """
+    _prepare_create(args)
+    cache, digest_cache = _caches(args)
+    stats = Stats() if args.stats or args.trace else None
+    previous = _previous_swu(args)
+
+    swu = _new_generator(
+        args,
+        args.sw_description,
+        args.swu_file,
+        args.config,
+        args.artifactory,
+        args.sign,
+        cache,
+        digest_cache,
+        stats,
+        previous=previous,
     )
     swu.process()
     swu.close()
+    if previous:
+        previous.close()
+    _save_stats(args, stats)
+
+
+def batch_swu(args: argparse.Namespace) -> None:
+    """Creates the SWU archives listed in a batch manifest
+
+    The SWUs are built in parallel and share the work: each artifact is
+    hashed, and compressed, encrypted or converted to zck for a given
+    set of settings, only once. The options apply to all jobs, the
+    variables of a job config file are added to those of -c.
+
+    Args:
+        args (argparse.Namespace): Parsed arguments with the manifest
+    """
+    _prepare_create(args)
+    cache, digest_cache = _caches(args)
+    stats = Stats() if args.stats or args.trace else None
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    previous = _previous_swu(args)
+
+    with TemporaryDirectory(dir=args.workdir) as shared_dir, ThreadPoolExecutor(
+        max_workers=args.jobs
+    ) as pool:
+        shared = {
+            "memo": TransformMemo(shared_dir),
+            "pool": pool,
+            "scheduler": CoreScheduler(args.max_threads, args.max_memory),
+            "registry": ArtifactRegistry(
+                lambda path: digest_cache.digest(path, digest_file)
+            ),
+            "previous": previous,
+        }
+
+        def build(job: batch.BatchJob) -> None:
+            config = dict(args.config)
+            if job.config:
+                config.update(parse_config_file(job.config))
+            swu = _new_generator(
+                args,
+                job.sw_description,
+                job.output,
+                config,
+                job.artifactory + args.artifactory,
+                # signing commands are prepared per SWU
+                copy.deepcopy(args.sign),
+                cache,
+                digest_cache,
+                stats,
+                **shared,
+            )
+            swu.process()
+            swu.close()
+
+        batch.run_jobs(args.manifest, build, args.jobs)
+    if previous:
+        previous.close()
+    _save_stats(args, stats)
+
 
 def sign_swu(args: argparse.Namespace) -> None:
     swu = signer.SWUSigner(
@@ -307,9 +495,9 @@ def parse_args(args: List[str]) -> None:
     parser.add_argument(
         "-o",
         "--swu-file",
-        required=True,
+        required=False,
         type=Path,
-        help="SWU output file",
+        help="SWU output file, required for the create and sign commands",
     )
 
     parser.add_argument(
@@ -329,6 +517,119 @@ def parse_args(args: List[str]) -> None:
         help="set log level, default is WARNING",
     )
 
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        type=parse_jobs,
+        help="number of artifacts processed in parallel, 0 for one per CPU",
+    )
+
+    parser.add_argument(
+        "--max-threads",
+        default=0,
+        type=parse_jobs,
+        help="threads shared by all compressions, also passed to xz -T and zstd -T,\n"
+        "default and 0 for one per CPU",
+    )
+
+    parser.add_argument(
+        "--max-memory",
+        type=parse_size,
+        help="memory for all compressors together (K, M, G suffixes),\n"
+        "limits threads and parallel compressions",
+    )
+
+    parser.add_argument(
+        "--workdir",
+        type=Path,
+        help="directory for intermediate files, default is the system temp directory",
+    )
+
+    parser.add_argument(
+        "--temp-budget",
+        type=parse_size,
+        help="bytes the intermediate files may use (K, M, G suffixes), parallel\n"
+        "work waits and compressed artifacts are streamed beyond it",
+    )
+
+    parser.add_argument(
+        "--external-compressors",
+        action="store_true",
+        help="Compress with gzip, xz and zstd tools instead of in-process.\n"
+        "In-process zlib output is the one of gzip -9 -n without --rsyncable,\n"
+        "xz is always compressed by the tool if it can use several threads",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        help="directory to cache compressed, encrypted and zck artifacts",
+    )
+
+    parser.add_argument(
+        "--cache-max-size",
+        default=DEFAULT_MAX_SIZE,
+        type=parse_size,
+        help="maximum size of the cache (K, M, G suffixes), default is 10G",
+    )
+
+    parser.add_argument(
+        "--digest-cache",
+        type=Path,
+        help="file storing the sha256 of artifacts across runs,\n"
+        "default is digests.json in the cache directory",
+    )
+
+    parser.add_argument(
+        "--sha256-sidecars",
+        action="store_true",
+        help="take sha256 of artifacts from <artifact>.sha256 files if present",
+    )
+
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=textwrap.dedent(
+            """\
+            compress artifacts straight into the SWU instead of the work directory.
+            Unless -y is set, they are compressed twice to get their sha256 first."""
+        ),
+    )
+
+    parser.add_argument(
+        "--reuse-from",
+        type=Path,
+        help="previous SWU whose compressed or encrypted payloads are copied\n"
+        "if they were made from the same artifacts with the same settings",
+    )
+
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="check the artifacts and print what would be done with them,\n"
+        "with estimated sizes and times, without creating the SWU",
+    )
+
+    parser.add_argument(
+        "--preserve-format",
+        action="store_true",
+        help="write sw-description as in the template, changing only the fields\n"
+        "set by swugenerator instead of reformatting it",
+    )
+
+    parser.add_argument(
+        "--stats",
+        type=Path,
+        help="write timings and throughput of each build stage as JSON",
+    )
+
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        help="write the build stages as a Chrome trace (chrome://tracing)",
+    )
+
     parser.add_argument(
         "-g",
         "--engine",
@@ -356,6 +657,18 @@ def parse_args(args: List[str]) -> None:
         type=Path,
         help="SWU input file to be signed, required for the sign command",
     )
+    batch_subparser = subparsers.add_parser(
+        "batch", help="creates the SWU files listed in a manifest, sharing the work"
+    )
+    batch_subparser.set_defaults(func=batch_swu)
+    batch_subparser.add_argument(
+        "-m",
+        "--manifest",
+        required=True,
+        type=batch.load_manifest,
+        help="libconf file with the jobs: sw-description, output,\n"
+        "optional config and artifactory",
+    )
     args = parser.parse_args(args)
     if hasattr(args, 'sign') and args.sign:
         args.sign = parse_signing_option(args.sign, args.engine, args.keyform)
@@ -363,6 +676,16 @@ def parse_args(args: List[str]) -> None:
         parser.error(
             "the following arguments are required: -s/--sw-description"
         )
+    if args.func != batch_swu and not args.swu_file:
+        parser.error(
+            "the following arguments are required: -o/--swu-file"
+        )
+    if args.reuse_from:
+        outputs = [job.output for job in args.manifest] if args.func == batch_swu else []
+        if args.swu_file:
+            outputs.append(args.swu_file)
+        if args.reuse_from.resolve() in (output.resolve() for output in outputs):
+            parser.error("--reuse-from cannot be an output file")
 
     args.func(args)
 
@@ -0,0 +1,210 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# Execution plan of a build. Before any artifact is transformed, each of
+# them is looked up and the tools, keys and work directory space its
+# transformations need are checked, so that a build stops at once
+# instead of after compressing the artifacts before the faulty one.
+#
+# Sizes and times in the plan are estimates. They are measured by
+# compressing and encrypting a few samples of each artifact in-process,
+# artifacts taken from the cache or from a previous SWU are not known
+# before they are hashed and are counted as if they were processed.
+import math
+import time
+from typing import List, NamedTuple, Optional
+
+from swugenerator import encrypt
+from swugenerator.scheduler import BYTES_PER_THREAD
+
+# bytes read from an artifact to estimate its transformations
+SAMPLE_SIZE = 4 << 20
+# places of an artifact the samples are taken from
+SAMPLES = 4
+
+# exit code when an artifact is missing, as in errno EINVAL
+EXIT_NOT_FOUND = 22
+
+
+class PlanStep(NamedTuple):
+    """What is done with the artifact of an entry"""
+
+    filename: str
+    # path found in the artifactory, None if it is missing
+    path: Optional[str]
+    size: int
+    transforms: List[str]
+    # name of the payload in the SWU
+    output: str
+    # estimated size of the payload, None if unknown
+    estimated_size: Optional[int] = None
+    # estimated seconds for the transformations, None if unknown
+    estimated_time: Optional[float] = None
+
+
+def _human(nbytes):
+    if nbytes is None:
+        return "?"
+    for unit in ("", "K", "M", "G"):
+        if nbytes < 1024:
+            return f"{nbytes:.0f}{unit}" if not unit else f"{nbytes:.1f}{unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f}T"
+
+
+def _seconds(seconds):
+    return "?" if seconds is None else f"{seconds:.1f}s"
+
+
+class Plan:
+    """Steps of a build and the problems found while planning it"""
+
+    def __init__(self):
+        self.steps = []
+        # (message, exit code)
+        self.errors = []
+        self.warnings = []
+        # bytes needed in the work directory, its free space
+        self.temp_needed = 0
+        self.temp_free = None
+
+    def add(self, step):
+        self.steps.append(step)
+
+    def error(self, message, code=1):
+        if (message, code) not in self.errors:
+            self.errors.append((message, code))
+
+    def warning(self, message):
+        if message not in self.warnings:
+            self.warnings.append(message)
+
+    def exit_code(self):
+        """Exit code for the errors, a missing artifact wins over the others"""
+        codes = [code for _, code in self.errors]
+        return EXIT_NOT_FOUND if EXIT_NOT_FOUND in codes else max(codes, default=0)
+
+    def estimated_size(self):
+        sizes = [step.estimated_size for step in self.steps]
+        return None if None in sizes else sum(sizes)
+
+    def estimated_time(self):
+        times = [step.estimated_time for step in self.steps]
+        return None if None in times else sum(times)
+
+    def summary(self):
+        """Return the totals of the plan in one line"""
+        transformed = sum(1 for step in self.steps if step.transforms)
+        free = "" if self.temp_free is None else f", {_human(self.temp_free)} free"
+        return (
+            f"{len(self.steps)} artifacts, {transformed} transformed, "
+            f"{_human(sum(step.size for step in self.steps))} in total, "
+            f"work directory {_human(self.temp_needed)} needed{free}"
+        )
+
+    def format(self):
+        """Return the plan as a table, errors and warnings are not included"""
+        rows = [("Artifact", "Size", "Transforms", "Output", "Est. size", "Est. time")]
+        for step in self.steps:
+            rows.append(
+                (
+                    step.filename,
+                    _human(step.size) if step.path else "missing",
+                    ", ".join(step.transforms) or "-",
+                    step.output,
+                    _human(step.estimated_size),
+                    _seconds(step.estimated_time),
+                )
+            )
+        rows.append(
+            (
+                "Total",
+                _human(sum(step.size for step in self.steps)),
+                "",
+                "",
+                _human(self.estimated_size()),
+                _seconds(self.estimated_time()),
+            )
+        )
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = [
+            "  ".join(
+                col.rjust(width) if i in (1, 4, 5) else col.ljust(width)
+                for i, (col, width) in enumerate(zip(row, widths))
+            ).rstrip()
+            for row in rows
+        ]
+        free = "" if self.temp_free is None else f", {_human(self.temp_free)} free"
+        lines.append(f"Work directory: {_human(self.temp_needed)} needed{free}")
+        return "\n".join(lines) + "\n"
+
+
+def _samples(path, size):
+    """Yield up to SAMPLE_SIZE bytes of path, from SAMPLES places"""
+    with open(path, "rb") as f:
+        if size <= SAMPLE_SIZE:
+            yield f.read()
+            return
+        chunk = SAMPLE_SIZE // SAMPLES
+        for i in range(SAMPLES):
+            f.seek((size - chunk) * i // (SAMPLES - 1))
+            yield f.read(chunk)
+
+
+class Estimate:
+    """Size and time of the transformations of an artifact, from samples.
+
+    Each transformation is applied in turn to the samples, its output
+    is the input of the next one. The ratios measured on the samples
+    are then scaled to the size of the artifact. Size and time are None
+    once a transformation cannot be measured.
+    """
+
+    def __init__(self, path, size):
+        self.samples = list(_samples(path, size)) if size else []
+        self.sampled = sum(len(s) for s in self.samples)
+        self.size = size
+        self.seconds = 0.0
+
+    def _scale(self):
+        return self.size / self.sampled if self.sampled else 0
+
+    def unknown(self):
+        self.size = None
+        self.seconds = None
+
+    def compress(self, codec, max_threads=1):
+        """Compress the samples, with the threads the scheduler would grant"""
+        if self.size is None:
+            return
+        start = time.perf_counter()
+        output = []
+        for sample in self.samples:
+            compressor = codec.compressobj(len(sample), 1)
+            output.append(compressor.compress(sample) + compressor.flush())
+        elapsed = time.perf_counter() - start
+        threads = max(1, math.ceil(self.size / BYTES_PER_THREAD))
+        threads = min(threads, max_threads, codec.max_threads or threads)
+        scale = self._scale()
+        self.seconds += elapsed * scale / threads
+        self.samples = output
+        self.sampled = sum(len(o) for o in output)
+        self.size = round(self.sampled * scale)
+
+    def encrypt(self):
+        """Encrypt the samples, the key does not change the time"""
+        if self.size is None:
+            return
+        if encrypt.available():
+            start = time.perf_counter()
+            for sample in self.samples:
+                encryptor = encrypt.AESEncryptor("00" * 32, "00" * 16)
+                encryptor.update(sample)
+                encryptor.finalize()
+            self.seconds += (time.perf_counter() - start) * self._scale()
+        else:
+            # openssl runs as a separate tool
+            self.seconds = None
+        # PKCS#7 always adds padding
+        self.size = (self.size // 16 + 1) * 16
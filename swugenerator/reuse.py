@@ -0,0 +1,163 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# Payloads of a previous SWU that can be packed again unchanged. The
+# sw-description of the previous SWU tells how each payload was made
+# (compression, encryption and IV). Whether a payload was made from
+# the same source is checked by decrypting and decompressing it
+# in-process and comparing the sha256 of the result with the one of
+# the source, which is much cheaper than compressing it again.
+import json
+import logging
+import threading
+from concurrent.futures import Future
+
+import libconf
+
+from swugenerator import encrypt
+from swugenerator.compress import get_codec
+from swugenerator.digest import BUFSIZE, Digester
+from swugenerator.swdesc import is_json
+from swugenerator.swu_reader import SWUReader
+
+
+class PreviousSWU:
+    """Index of the entries of a previous SWU.
+
+    The payloads are read through mmap and copied into the new SWU
+    straight from the previous file.
+    """
+
+    def __init__(self, filename, aeskey=None, aesiv=None):
+        self.filename = filename
+        self.aeskey = aeskey
+        self.file = open(filename, "rb")
+        self.reader = SWUReader(self.file)
+        self._lock = threading.Lock()
+        self._pack_lock = threading.Lock()
+        # payload name -> Future of what _restore() returns
+        self._restored = {}
+        # payload name -> entry of the previous sw-description
+        self.entries = {}
+        entries = self.reader.entries()
+        if not entries or entries[0].name != "sw-description":
+            logging.warning("%s has no sw-description, nothing is reused", filename)
+            return
+        swdesc = self._read_swdescription(entries[0], aeskey, aesiv)
+        if swdesc is None:
+            logging.warning("Cannot read sw-description of %s, nothing is reused", filename)
+            return
+        self._find_entries(swdesc)
+
+    def close(self):
+        self.reader.close()
+        self.file.close()
+
+    def pack(self, cpiofile, entry):
+        """Copy entry with its header into the SWUFile cpiofile"""
+        # the copy may fall back to seek and read on the shared file
+        with self._pack_lock:
+            cpiofile.add_entry_from(
+                self.file, entry.header, entry.name, entry.data_offset, entry.size
+            )
+
+    def _read_swdescription(self, entry, aeskey, aesiv):
+        data = self.reader.read(entry)
+        for attempt in range(2):
+            try:
+                text = data.decode("utf-8")
+                return json.loads(text) if is_json(text) else libconf.loads(text)
+            except (UnicodeDecodeError, ValueError, libconf.ConfigParseError):
+                # sw-description may have been encrypted with -t
+                if attempt or not (aeskey and aesiv and encrypt.available()):
+                    return None
+                try:
+                    decryptor = encrypt.AESDecryptor(aeskey, aesiv)
+                    data = decryptor.update(data) + decryptor.finalize()
+                except ValueError:
+                    return None
+        return None
+
+    def _find_entries(self, value):
+        if isinstance(value, dict):
+            if isinstance(value.get("filename"), str):
+                self.entries.setdefault(value["filename"], value)
+            value = value.values()
+        elif not isinstance(value, (tuple, list)):
+            return
+        for item in value:
+            self._find_entries(item)
+
+    def find(self, name, source, compressed=None, iv=None):
+        """Return the entry holding name made from source as requested, with its digest.
+
+        Returns None if there is no such entry.
+
+        :type name: name of the payload in the SWU
+        :type source: Digest of the source artifact
+        :type compressed: compression algorithm, None if not compressed
+        :type iv: IV of the encryption, None if not encrypted
+        """
+        old = self.entries.get(name)
+        if old is None or name not in self.reader:
+            return None
+        if (old.get("compressed") or None) != compressed:
+            return None
+        if (old.get("encrypted") is True) != (iv is not None):
+            return None
+        if iv is not None and old.get("ivt") != iv:
+            return None
+        entry = self.reader[name]
+        with self._lock:
+            future = self._restored.get(name)
+            owner = future is None
+            if owner:
+                future = self._restored[name] = Future()
+        if owner:
+            future.set_result(self._restore(entry, compressed, iv))
+        restored = future.result()
+        if restored is None or restored[0] != (source.sha256, source.size):
+            return None
+        return entry, restored[1]
+
+    def _restore(self, entry, compressed, iv):
+        """Undo the transformations of the payload of entry.
+
+        Returns sha256 and size of the source, with the digest of the
+        payload, None if the payload cannot be restored.
+        """
+        if iv is not None and not (self.aeskey and encrypt.available()):
+            return None
+        codec = get_codec(compressed) if compressed else None
+        if compressed and codec is None:
+            return None
+
+        payload = Digester()
+        source = Digester()
+        decryptor = decompressor = None
+
+        def restored(data):
+            # PKCS#7 may leave nothing for the end, and xz refuses data
+            # once its stream is complete
+            if not data:
+                return
+            if decompressor:
+                data = decompressor.decompress(data)
+            source.update(data)
+
+        try:
+            decryptor = encrypt.AESDecryptor(self.aeskey, iv) if iv is not None else None
+            decompressor = codec.decompressobj() if codec else None
+            with self.reader.view(entry) as view:
+                for offset in range(0, len(view), BUFSIZE):
+                    data = view[offset : offset + BUFSIZE]
+                    payload.update(data)
+                    restored(decryptor.update(data) if decryptor else data)
+            if decryptor:
+                restored(decryptor.finalize())
+        except Exception as e:  # pylint: disable=W0703
+            logging.warning("Cannot restore %s from %s: %s", entry.name, self.filename, e)
+            return None
+        digest = source.digest()
+        return (digest.sha256, digest.size), payload.digest()
@@ -0,0 +1,86 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# Splits a global budget of threads across the compressions running
+# at the same time, so that parallel jobs and multithreaded
+# compressors together do not use more than --max-threads cores and,
+# if set, --max-memory bytes of compressor memory.
+import contextlib
+import math
+import os
+import threading
+
+# a compressor thread is worth it only for this much input
+BYTES_PER_THREAD = 32 << 20
+
+
+class CoreScheduler:
+    """Grants threads to compressions from a shared budget.
+
+    A compression asks for threads according to the size of its input,
+    capped by what the compressor can use. Large artifacts get a share
+    of the budget proportional to their size among the compressions in
+    flight, small ones get a single thread and run side by side. When
+    the whole budget is in use, a compression waits for a thread.
+
+    With a memory budget, the threads granted are also limited by the
+    memory each of them needs. A compression waits while others hold
+    the memory, it runs with one thread if it is alone.
+    """
+
+    def __init__(self, max_threads=None, max_memory=None):
+        self.max_threads = max(1, max_threads or os.cpu_count() or 1)
+        self.max_memory = max_memory
+        self._cond = threading.Condition()
+        self._used = 0
+        self._memory = 0
+        # input sizes of the compressions running or waiting
+        self._sizes = {}
+
+    def _memory_threads(self, memory_per_thread):
+        """Threads that fit in the memory budget, None if unlimited"""
+        if not self.max_memory or not memory_per_thread:
+            return None
+        return (self.max_memory - self._memory) // memory_per_thread
+
+    def _share(self, size, max_useful, memory_per_thread):
+        wanted = max(1, math.ceil(size / BYTES_PER_THREAD))
+        if max_useful:
+            wanted = min(wanted, max_useful)
+        # proportional share among the compressions running or waiting
+        total = sum(self._sizes.values())
+        if total > size:
+            wanted = min(wanted, max(1, round(self.max_threads * size / total)))
+        wanted = min(wanted, self.max_threads - self._used)
+        fit = self._memory_threads(memory_per_thread)
+        if fit is not None:
+            # alone it runs anyway, it cannot get more memory by waiting
+            wanted = max(1, min(wanted, fit)) if not self._used else min(wanted, fit)
+        return wanted
+
+    @contextlib.contextmanager
+    def threads(self, size, max_useful=None, memory_per_thread=0):
+        """Hold threads for the compression of size bytes in the with block.
+
+        Waits for at least one thread and yields the number granted.
+
+        :type size: bytes to be compressed
+        :type max_useful: the most threads the compressor can use, None if unlimited
+        :type memory_per_thread: estimated memory used by each thread
+        """
+        token = object()
+        with self._cond:
+            self._sizes[token] = size
+            while not (granted := self._share(size, max_useful, memory_per_thread)):
+                self._cond.wait()
+            self._used += granted
+            self._memory += granted * memory_per_thread
+        try:
+            yield granted
+        finally:
+            with self._cond:
+                self._used -= granted
+                self._memory -= granted * memory_per_thread
+                del self._sizes[token]
+                self._cond.notify_all()
@@ -5,7 +5,8 @@ import logging
 from tempfile import TemporaryDirectory
 from pathlib import Path
 
-from swugenerator.swu_file import SWUFile
+from swugenerator.swu_file import SWUFile, FormatException
+from swugenerator.swu_reader import SWUReader
 
 class SWUSigner:
     def __init__(self, in_file, out_file, crypt):
@@ -13,7 +14,6 @@ class SWUSigner:
         self.fout = open(out_file, "wb")
         self.cpio_out = SWUFile(self.fout)
         self.fin = open(in_file, "rb")
-        self.cpio_in = SWUFile(self.fin)
         self.temp = TemporaryDirectory()
 
     def close(self):
@@ -23,21 +23,32 @@ class SWUSigner:
         self.fout.close()
 
     def process(self):
-        # extract the swu file and get the file list
-        artifacts = self.cpio_in.extract(self.temp.name)
+        # Only the headers are read, payloads are copied unchanged
+        with SWUReader(self.fin) as reader:
+            entries = list(reader.entries())
+            if not entries:
+                raise FormatException("Empty SWU")
+            sw_desc = entries.pop(0)
+            sw_desc_in = Path(self.temp.name) / sw_desc.name
+            sw_desc_in.write_bytes(reader.read(sw_desc))
+
+        self._copy_entry(sw_desc)
 
         # call signing to generate the sig file
         if self.signtool:
-            sw_desc_in = Path(self.temp.name) / artifacts[0]
             sw_desc_out = sw_desc_in.with_suffix(".sig")
             self.signtool.prepare_cmd(sw_desc_in, sw_desc_out)
             self.signtool.sign()
-            if artifacts[0] + ".sig" not in artifacts:
-                artifacts.insert(1, artifacts[0] + ".sig")
-            else:
+            signature = sw_desc.name + ".sig"
+            if any(entry.name == signature for entry in entries):
                 logging.info("resigning a signed file")
+                entries = [entry for entry in entries if entry.name != signature]
+            self.cpio_out.addartifacttoswu(sw_desc_out)
 
-        for name in artifacts:
-            path = Path(self.temp.name) / name
-            self.cpio_out.addartifacttoswu(path)
+        for entry in entries:
+            self._copy_entry(entry)
 
+    def _copy_entry(self, entry):
+        self.cpio_out.add_entry_from(
+            self.fin, entry.header, entry.name, entry.data_offset, entry.size
+        )
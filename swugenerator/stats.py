@@ -0,0 +1,149 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# Timers and byte counters for the stages of a build. The collected
+# data is written as a JSON report (--stats) or as a trace in the
+# Chrome trace event format (--trace), which can be loaded in
+# chrome://tracing or Perfetto.
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+def dir_usage(path):
+    """Return the bytes used by the files below path"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def _throughput(nbytes, seconds):
+    if not nbytes or not seconds:
+        return None
+    return round(nbytes / seconds / 1e6, 2)
+
+
+class Stats:
+    """Collects the time spent in each stage, per artifact and per thread.
+
+    Stages can be nested: the time of a stage includes its children,
+    the self time does not. Stages running a subprocess are also
+    summed up separately.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._start = time.perf_counter()
+        self.events = []
+        self.stages = {}
+        self.artifacts = {}
+        self.counters = {}
+        self.subprocess_seconds = 0.0
+        self.peak_temp_bytes = 0
+
+    @contextlib.contextmanager
+    def stage(self, name, artifact=None, nbytes=0, external=False):
+        """Time the code in the with block as stage name.
+
+        :type artifact: filename of the artifact being processed, if any
+        :type nbytes: bytes processed by the stage, to compute throughput
+        :type external: True if the stage waits for an external tool
+        """
+        stack = self._local.__dict__.setdefault("stack", [])
+        # nested stages belong to the artifact of the enclosing one
+        if artifact is None and stack:
+            artifact = stack[-1][1]
+        frame = [0.0, artifact]
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1][0] += duration
+            self._record(name, artifact, nbytes, external, start, duration, frame[0])
+
+    def _record(self, name, artifact, nbytes, external, start, duration, children):
+        with self._lock:
+            stage = self.stages.setdefault(
+                name, {"count": 0, "seconds": 0.0, "self_seconds": 0.0, "bytes": 0}
+            )
+            stage["count"] += 1
+            stage["seconds"] += duration
+            stage["self_seconds"] += duration - children
+            stage["bytes"] += nbytes
+            if external:
+                self.subprocess_seconds += duration
+            if artifact is not None:
+                timings = self.artifacts.setdefault(artifact, {})
+                timings[name] = timings.get(name, 0.0) + duration
+                if nbytes:
+                    timings["bytes"] = max(timings.get("bytes", 0), nbytes)
+            args = {}
+            if artifact is not None:
+                args["artifact"] = artifact
+            if nbytes:
+                args["bytes"] = nbytes
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": "subprocess" if external else "swugenerator",
+                    "ph": "X",
+                    "ts": round((start - self._start) * 1e6),
+                    "dur": round(duration * 1e6),
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": args,
+                }
+            )
+
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def sample_temp(self, path):
+        """Update the peak usage of the work directory"""
+        usage = dir_usage(path)
+        with self._lock:
+            self.peak_temp_bytes = max(self.peak_temp_bytes, usage)
+
+    def report(self):
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = {
+                "count": stage["count"],
+                "seconds": round(stage["seconds"], 6),
+                "self_seconds": round(stage["self_seconds"], 6),
+                "bytes": stage["bytes"],
+                "mb_per_s": _throughput(stage["bytes"], stage["self_seconds"]),
+            }
+        return {
+            "wall_seconds": round(time.perf_counter() - self._start, 6),
+            "stages": stages,
+            "artifacts": {
+                name: {k: round(v, 6) if isinstance(v, float) else v for k, v in t.items()}
+                for name, t in self.artifacts.items()
+            },
+            "subprocess_seconds": round(self.subprocess_seconds, 6),
+            "peak_temp_bytes": self.peak_temp_bytes,
+            "counters": dict(self.counters),
+        }
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def save_trace(self, filename):
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,289 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# Rewrites sw-description in place. The rendered template is parsed
+# once, recording where each setting is in the text. The settings
+# changed by the generator (filename, sha256, ivt, properties) are then
+# spliced into the original text, which is kept as it is elsewhere:
+# comments, layout and embedded scripts are not touched.
+#
+# Parsing follows libconf, with the same tokens and the same values:
+# AttrDict for groups, tuple for lists and list for arrays.
+# Include directives are not supported.
+import io
+
+import libconf
+
+# settings of an entry updated by the generator
+FIELDS = ("filename", "sha256", "ivt", "properties")
+
+_SCALARS = ("string", "boolean", "integer", "float", "hex", "integer64", "hex64")
+
+
+class _Token:
+    __slots__ = ("type", "text", "start", "end", "value")
+
+    def __init__(self, type_, text, start, end, value):
+        self.type = type_
+        self.text = text
+        self.start = start
+        self.end = end
+        self.value = value
+
+
+class _Group:
+    """Position of a group in the text"""
+
+    __slots__ = ("start", "close", "settings", "original")
+
+    def __init__(self, start):
+        # offset of "{", 0 for the top level
+        self.start = start
+        # offset of "}", length of the text for the top level
+        self.close = None
+        # name -> (start of the name, start of the value, end of the value, end of the setting)
+        self.settings = {}
+        # values of the fields before they are changed
+        self.original = {}
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    length = len(text)
+    while pos < length:
+        m = libconf.SKIP_RE.match(text, pos)
+        if m:
+            pos = m.end()
+            continue
+        for cls, type_, regex in libconf.Tokenizer.token_map:
+            m = regex.match(text, pos)
+            if m:
+                value = None
+                if cls is not libconf.Token:
+                    value = cls(type_, m.group(0), None, 0, 0).value
+                tokens.append(_Token(type_, m.group(0), pos, m.end(), value))
+                pos = m.end()
+                break
+        else:
+            line = text.count("\n", 0, pos) + 1
+            raise libconf.ConfigParseError(
+                f"Couldn't load sw-description at line {line}: {text[pos:pos + 20]!r}"
+            )
+    return tokens
+
+
+class _Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+        # id of a group -> _Group
+        self.groups = {}
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def accept(self, *types):
+        token = self.peek()
+        if token is not None and token.type in types:
+            self.pos += 1
+            return token
+        return None
+
+    def expect(self, *types):
+        token = self.accept(*types)
+        if token is None:
+            found = self.peek()
+            where = f"{found.text!r} at offset {found.start}" if found else "end of input"
+            raise libconf.ConfigParseError(f"Unexpected {where}; expected: {types!r}")
+        return token
+
+    def parse(self):
+        result, group = self.settings(0)
+        if self.peek() is not None:
+            raise libconf.ConfigParseError(
+                f"Expected end of input but found {self.peek().text!r}"
+            )
+        group.close = len(self.text)
+        return result
+
+    def settings(self, start):
+        result = libconf.AttrDict()
+        group = _Group(start)
+        self.groups[id(result)] = group
+        while (name := self.accept("name")) is not None:
+            self.expect(":", "=")
+            value_start = self.peek().start if self.peek() else len(self.text)
+            value = self.value()
+            if value is None:
+                raise libconf.ConfigParseError(
+                    f"Expected a value for {name.text} at offset {name.start}"
+                )
+            value_end = self.tokens[self.pos - 1].end
+            end = value_end
+            if (sep := self.accept(";", ",")) is not None:
+                end = sep.end
+            result[name.text] = value
+            group.settings[name.text] = (name.start, value_start, value_end, end)
+        return result, group
+
+    def value(self):
+        token = self.peek()
+        if token is None:
+            return None
+        if token.type == "string":
+            values = []
+            while (t := self.accept("string")) is not None:
+                values.append(t.value)
+            return "".join(values)
+        if token.type in _SCALARS:
+            self.pos += 1
+            return token.value
+        if token.type == "{":
+            self.pos += 1
+            result, group = self.settings(token.start)
+            group.close = self.expect("}").start
+            return result
+        if token.type == "(":
+            self.pos += 1
+            result = tuple(self.values(self.value))
+            self.expect(")")
+            return result
+        if token.type == "[":
+            self.pos += 1
+            result = self.values(self.scalar)
+            self.expect("]")
+            return result
+        return None
+
+    def scalar(self):
+        token = self.peek()
+        if token is None or token.type not in _SCALARS:
+            return None
+        return self.value()
+
+    def values(self, parse):
+        result = []
+        while (v := parse()) is not None:
+            result.append(v)
+            if not self.accept(","):
+                break
+        return result
+
+
+def is_json(text):
+    """Return True if text is a JSON sw-description.
+
+    A libconf description starts with a setting, a JSON one with an object.
+    """
+    return text.lstrip().startswith("{")
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    return value
+
+
+def _walk(value):
+    """Yield the groups in value, lists included"""
+    if isinstance(value, dict):
+        yield value
+        value = value.values()
+    elif not isinstance(value, tuple):
+        return
+    for item in value:
+        yield from _walk(item)
+
+
+def _dump(name, value, indent):
+    out = io.StringIO()
+    libconf.dump_value(name, value, out, indent)
+    return out.getvalue().lstrip(" ")
+
+
+class SWDescription:
+    """sw-description whose entries are changed in place.
+
+    conf is the parsed description, its entries are changed as with
+    libconf.loads(). dumps() returns the original text with the changed
+    fields replaced or appended to their group.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        parser = _Parser(text)
+        self.conf = parser.parse()
+        self._groups = parser.groups
+        for conf in _walk(self.conf):
+            group = self._groups[id(conf)]
+            for field in FIELDS:
+                if field in group.settings:
+                    group.original[field] = _copy(conf[field])
+
+    def _line_prefix(self, offset):
+        return self.text[self.text.rfind("\n", 0, offset) + 1:offset]
+
+    def _append(self, group, settings):
+        """Return offset and text appending settings to group"""
+        if not group.settings:
+            text = " ".join(f"{_dump(name, value, 0)};" for name, value in settings)
+            return group.start + 1, f" {text} "
+        last = max(group.settings.values(), key=lambda s: s[3])
+        closing = self._line_prefix(group.close)
+        if closing.strip():
+            # the group ends on a line with other settings
+            sep = "" if last[3] > last[2] else ";"
+            text = "".join(f" {_dump(name, value, 0)};" for name, value in settings)
+            return last[3], sep + text
+        indent = self._line_prefix(last[0])
+        if indent.strip():
+            indent = closing + "    "
+        text = "".join(
+            f"{indent}{_dump(name, value, len(indent))};\n" for name, value in settings
+        )
+        return group.close - len(closing), text
+
+    def _patch(self, conf, group, names, originals, edits):
+        appended = []
+        for name in names:
+            value = conf[name]
+            if name not in group.settings:
+                appended.append((name, value))
+                continue
+            if originals.get(name) == value:
+                continue
+            name_start, value_start, value_end, _ = group.settings[name]
+            nested = self._groups.get(id(value))
+            if nested is not None:
+                # a group is updated setting by setting, to keep its layout
+                self._patch(value, nested, list(value), originals[name], edits)
+                continue
+            indent = self._line_prefix(name_start)
+            text = _dump(None, value, 0 if indent.strip() else len(indent))
+            edits.append((value_start, value_end, text))
+        if appended:
+            offset, text = self._append(group, appended)
+            edits.append((offset, offset, text))
+
+    def dumps(self, entries=None):
+        """Return the text with the changed fields of entries spliced in.
+
+        :type entries: groups of conf to be checked, all of them if None
+        """
+        edits = []
+        for entry in _walk(self.conf) if entries is None else entries:
+            group = self._groups[id(entry)]
+            names = [name for name in entry if name in FIELDS]
+            self._patch(entry, group, names, group.original, edits)
+        out = []
+        pos = 0
+        # sort is stable, settings appended at the same offset keep their order
+        for start, end, text in sorted(edits, key=lambda e: e[0]):
+            out.append(self.text[pos:start])
+            out.append(text)
+            pos = end
+        out.append(self.text[pos:])
+        return "".join(out)
@@ -5,9 +5,49 @@
 # This class manages to pack the SWU file and
 # extracts a SWU file with returning the list.
 # It has methods to add files to the archive.
+import io
 import os
 import stat
 
+from swugenerator.checksum import checksum_file
+from swugenerator.digest import Digest, Digester, get_buffer
+
+
+COPY_CHUNK = 65536
+# upper limit for a single copy_file_range / sendfile call
+KERNEL_COPY_MAX = 1 << 30
+
+
+def _copy_file_range(in_fd, out_fd, offset, count):
+    return os.copy_file_range(in_fd, out_fd, count, offset)
+
+
+def _sendfile(in_fd, out_fd, offset, count):
+    return os.sendfile(out_fd, in_fd, offset, count)
+
+
+def _kernel_copy(in_fd, out_fd, offset, count):
+    """Copy count bytes from in_fd at offset to the current offset of out_fd.
+
+    Returns the bytes copied, less than count if the kernel
+    cannot copy between these files or the input ends earlier.
+    """
+    copied = 0
+    methods = [_sendfile]
+    if hasattr(os, "copy_file_range"):
+        methods.insert(0, _copy_file_range)
+    for method in methods:
+        try:
+            while copied < count:
+                n = method(in_fd, out_fd, offset + copied, min(count - copied, KERNEL_COPY_MAX))
+                if not n:
+                    return copied
+                copied += n
+            return copied
+        except OSError:
+            continue
+    return copied
+
 
 class CPIOException(Exception):
     pass
@@ -18,6 +58,45 @@ class MagicException(Exception):
 class FormatException(Exception):
     pass
 
+class CPIOEntryWriter:
+    """File-like writer for an entry of unknown size, see SWUFile.open_entry"""
+
+    # offsets of c_filesize and c_check in the newc header
+    FILESIZE_OFFSET = 54
+    CHECK_OFFSET = 102
+
+    def __init__(self, swu, cpio_filename, header_offset):
+        self.swu = swu
+        self.cpio_filename = cpio_filename
+        self.header_offset = header_offset
+        self.digester = Digester()
+
+    def write(self, data):
+        self.digester.update(data)
+        self.swu._rawwrite(data)
+        self.swu.buffered_copied += len(data)
+        return len(data)
+
+    def close(self):
+        """Patch size and checksum into the header, return the digest of the data"""
+        digest = self.digester.digest()
+        if digest.size > 0xFFFFFFFF:
+            raise CPIOException(
+                "Too big file size for this CPIO format", self.cpio_filename
+            )
+        if not digest.size:
+            raise CPIOException("File is not a regular file", self.cpio_filename)
+        out = self.swu.file
+        end = out.tell()
+        out.seek(self.header_offset + self.FILESIZE_OFFSET)
+        out.write(f"{digest.size:08X}".encode("ascii"))
+        out.seek(self.header_offset + self.CHECK_OFFSET)
+        out.write(f"{digest.checksum:08X}".encode("ascii"))
+        out.seek(end)
+        self.swu.artifacts.append(self.cpio_filename)
+        return digest
+
+
 class SWUFile:
     def __init__(self, file):
         """
@@ -27,6 +106,9 @@ class SWUFile:
         self.file = file
         self.renumbered_inode_count = 0
         self.artifacts = []
+        # payload bytes copied by the kernel or through Python buffers
+        self.kernel_copied = 0
+        self.buffered_copied = 0
         # for reading
         self.header = None
 
@@ -43,19 +125,12 @@ class SWUFile:
             self._rawwrite(b"\x00" * offset)
 
     def cpiocrc(self, cpio_filename):
-        crc = 0
-        with open(cpio_filename, "rb") as rd:
-            chunk = rd.read(65536)
-            while chunk:
-                for b in chunk:
-                    crc += b
-                chunk = rd.read(65536)
-        crc = crc & 0xFFFFFFFF
-        return crc
-
-    def addartifacttoswu(self, cpio_filename):
+        return checksum_file(cpio_filename)
+
+    def addartifacttoswu(self, cpio_filename, digest=None):
         """
         :type cpio_filename: string
+        :type digest: Digest already computed for cpio_filename, if any
         """
 
         statres = os.stat(cpio_filename)
@@ -73,20 +148,82 @@ class SWUFile:
         if cpio_filename == b"TRAILER!!!":
             raise CPIOException("Attempt to pass reserved filename", cpio_filename)
 
-        self.write_header(cpio_filename)
+        if digest is not None and digest.size != size:
+            raise CPIOException("File was changed after digest", cpio_filename)
+
+        self.write_header(cpio_filename, digest)
 
         self._align()
         with open(cpio_filename, "rb") as xxx:
-            while size:
-                chunk = xxx.read(65536)
-                if not chunk:
-                    break
-                self._rawwrite(chunk)
-                size -= len(chunk)
-        if size:
-            raise CPIOException("File was changed while reading", cpio_filename)
+            if self.copy_range(xxx, 0, size) != size:
+                raise CPIOException("File was changed while reading", cpio_filename)
         self.artifacts.append(cpio_filename)
 
+    def add_entry_from(self, src, header, name, offset, size):
+        """Copy an entry of another newc archive without unpacking it.
+
+        Header fields and checksum are kept as they are, only the
+        inode is renumbered. The payload is size bytes of the open
+        file src starting at offset.
+        """
+        fields = [int(header[i : i + 8], 16) for i in range(6, 110, 8)]
+        fields[0] = self.next_renumbered_inode()
+        self._align()
+        self._rawwrite(self.encode_header(fields, name))
+        self._align()
+        if self.copy_range(src, offset, size) != size:
+            raise FormatException(f"Truncated entry {name}")
+        self.artifacts.append(name)
+
+    def copy_range(self, src, offset, size):
+        """Append size bytes of the open file src starting at offset.
+
+        The copy is done by the kernel when both sides are real files,
+        with copy_file_range (reflinks on XFS/btrfs) or sendfile,
+        otherwise it falls back to reading and writing in chunks.
+        Returns the number of bytes copied.
+        """
+        copied = 0
+        try:
+            in_fd = src.fileno()
+            out_fd = self.file.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            out_fd = None
+        if out_fd is not None:
+            self.file.flush()
+            copied = _kernel_copy(in_fd, out_fd, offset, size)
+            if copied:
+                # resync the buffered writer with the file offset
+                if self.file.seekable():
+                    self.file.seek(os.lseek(out_fd, 0, os.SEEK_CUR))
+                self.position += copied
+                self.kernel_copied += copied
+
+        src.seek(offset + copied)
+        while copied < size:
+            chunk = src.read(min(COPY_CHUNK, size - copied))
+            if not chunk:
+                break
+            self._rawwrite(chunk)
+            copied += len(chunk)
+            self.buffered_copied += len(chunk)
+        return copied
+
+    def open_entry(self, cpio_filename, statres):
+        """Start an entry whose data is streamed into the archive.
+
+        The header is written with size and checksum set to zero,
+        they are patched when the returned writer is closed.
+        The output file must be seekable.
+        """
+        if not self.file.seekable():
+            raise CPIOException("Streaming requires a seekable output", cpio_filename)
+        self._align()
+        header_offset = self.file.tell()
+        self.write_header(cpio_filename, Digest("", 0, 0), statres)
+        self._align()
+        return CPIOEntryWriter(self, cpio_filename, header_offset)
+
     def next_renumbered_inode(self):
         """Make renumbered inode to be safe on 64 bit file systems.
 
@@ -95,10 +232,14 @@ class SWUFile:
         self.renumbered_inode_count += 1
         return self.renumbered_inode_count
 
-    def write_header(self, cpio_filename):
+    def write_header(self, cpio_filename, digest=None, statres=None):
         if cpio_filename != "TRAILER!!!":
-            statres = os.stat(cpio_filename)
-            crc = self.cpiocrc(cpio_filename)
+            if statres is None:
+                statres = os.stat(cpio_filename)
+            if digest is not None and digest.checksum is not None:
+                crc = digest.checksum
+            else:
+                crc = self.cpiocrc(cpio_filename)
             base_filename = os.path.basename(cpio_filename)
             fields = [
                 self.next_renumbered_inode(),
@@ -124,16 +265,17 @@ class SWUFile:
             fields = [0, 0, 0, 0, 16, 0, 0, 0, 0, 0, 0, len(base_filename) + 1, 0]
 
         self._align()
-        self._rawwrite(b"070702")
+        self._rawwrite(self.encode_header(fields, base_filename))
+
+    @staticmethod
+    def encode_header(fields, base_filename):
+        """Return magic, fields and filename of a newc header as one buffer"""
         for i, value in enumerate(fields):
             # UNIX epoch overflow, negative timestamps and so on...
             if (value > 0xFFFFFFFF) or (value < 0):
                 raise CPIOException("STOP: value out of range", i, value)
-            s = f"{value:08X}"
-            self._rawwrite(bytes(s, "ascii"))
-
-        fn = bytes(base_filename, "ascii") + b"\x00"
-        self._rawwrite(fn)
+        header = "070702" + "".join(f"{value:08X}" for value in fields)
+        return bytes(header + base_filename, "ascii") + b"\x00"
 
     def add_trailer(self):
         try:
@@ -148,34 +290,61 @@ class SWUFile:
 
         self.position = 0
 
-    def _extract_file(self, dir, name):
+    def _skip(self, size):
+        if self.file.seekable():
+            self.file.seek(size, os.SEEK_CUR)
+            return
+        while size:
+            chunk = self.file.read(min(COPY_CHUNK, size))
+            if not chunk:
+                raise FormatException("Truncated SWU file")
+            size -= len(chunk)
+
+    def _copy_out(self, out, size, digester):
+        # Copy in fixed size chunks, memory does not grow with the payload
+        buf = get_buffer()
+        view = memoryview(buf)
+        while size:
+            n = self.file.readinto(view[: min(len(buf), size)])
+            if not n:
+                raise FormatException("Truncated SWU file")
+            digester.update(view[:n])
+            out.write(view[:n])
+            size -= n
+
+    def _extract_file(self, dir, name, skip=False):
         c_mode = int(self.header[14:22], 16)
         c_filesize = int(self.header[54:62], 16)
-        # Read file data
-        filedata = self.file.read(c_filesize)
         pad = (4 - c_filesize % 4) % 4
-        self.file.read(pad)
+        if skip:
+            self._skip(c_filesize + pad)
+            return
         # Compute output path
         path = os.path.join(dir, name)
         os.makedirs(os.path.dirname(path), exist_ok=True)
+        # the checksum is computed while data is written
+        digester = Digester(sha256=False)
         # check if its really a file
         if c_mode & 0o170000 != 0o040000:
             with open(path, "wb") as out:
-                out.write(filedata)
+                self._copy_out(out, c_filesize, digester)
             try:
                 # preserve mode
                 os.chmod(path, c_mode & 0o7777)
             except Exception:
                 pass
+        else:
+            self._skip(c_filesize)
+        self._skip(pad)
         # check CRC
-        outcrc = self.cpiocrc(path)
+        outcrc = digester.checksum
         incrc = int(self.header[102:110], 16)
         if outcrc !=  incrc:
             raise FormatException(
                 f"Wrong file crc {incrc} vs. {outcrc}"
             )
 
-    def _extract_next(self, dir):
+    def _extract_next(self, dir, select=None):
         # Read fixed-size header (110 bytes for "newc" format)
         self.header = self.file.read(110)
         if len(self.header) < 110:
@@ -199,16 +368,26 @@ class SWUFile:
         # Align to 4 bytes
         pad = (4 - (110 + c_namesize) % 4) % 4
         self.file.read(pad)
-        self.artifacts.append(name)
-        self._extract_file(dir, name)
+        if select is not None and not select(name):
+            self._extract_file(dir, name, skip=True)
+        else:
+            self.artifacts.append(name)
+            self._extract_file(dir, name)
 
 		# lets continue
         return True
 
-    def extract(self, dir):
-        # extract all files from the swu file
+    def extract(self, dir, select=None):
+        """Extract the files of the swu file into dir.
+
+        :type select: None to extract all files, a callable taking the
+                      name of a file or a collection of names to extract
+        :returns: the names of the extracted files
+        """
+        if select is not None and not callable(select):
+            select = set(select).__contains__
         next_file = True
         while next_file:
-            next_file = self._extract_next(dir)
+            next_file = self._extract_next(dir, select)
 
         return self.artifacts
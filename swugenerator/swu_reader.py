@@ -0,0 +1,166 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# Random access to the entries of a SWU file. Only the newc headers
+# are read to build the index, the payloads are skipped and can be
+# accessed later through mmap backed views or file-like objects.
+import io
+import mmap
+import os
+from typing import NamedTuple
+
+from swugenerator import checksum
+from swugenerator.swu_file import FormatException, MagicException
+
+HEADER_SIZE = 110
+
+
+class SWUEntry(NamedTuple):
+    name: str
+    header_offset: int
+    data_offset: int
+    size: int
+    mode: int
+    checksum: int
+    header: bytes
+
+
+class SWUEntryFile(io.RawIOBase):
+    """Read-only file object over the payload of an entry"""
+
+    def __init__(self, view):
+        super().__init__()
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self._view) - self._pos)
+        if n <= 0:
+            return 0
+        b[:n] = self._view[self._pos : self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._pos = offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+class SWUReader:
+    def __init__(self, file):
+        """
+        :type file: FileIO of bytes, opened for reading
+        """
+        self.file = file
+        self._entries = None
+        self._by_name = None
+        self._mmap = None
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _read_header(self, offset):
+        self.file.seek(offset)
+        header = self.file.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise FormatException("Unknown or unsupported header format. ")
+        c_magic = header[0:6]
+        if c_magic != b"070702":
+            raise MagicException(
+                f"Unknown or unsupported CPIO format. Our magic: {c_magic}"
+            )
+        c_namesize = int(header[94:102], 16)
+        name = self.file.read(c_namesize)[:-1].decode()
+        return header, name, c_namesize
+
+    def entries(self):
+        """Walk the headers and return the list of entries, without TRAILER!!!"""
+        if self._entries is not None:
+            return self._entries
+        entries = []
+        offset = 0
+        while True:
+            header, name, c_namesize = self._read_header(offset)
+            if name == "TRAILER!!!":
+                break
+            data_offset = offset + HEADER_SIZE + c_namesize
+            data_offset += -data_offset % 4
+            size = int(header[54:62], 16)
+            entries.append(
+                SWUEntry(
+                    name,
+                    offset,
+                    data_offset,
+                    size,
+                    int(header[14:22], 16),
+                    int(header[102:110], 16),
+                    header,
+                )
+            )
+            offset = data_offset + size
+            offset += -offset % 4
+        self._entries = entries
+        self._by_name = {entry.name: entry for entry in entries}
+        return entries
+
+    def __iter__(self):
+        return iter(self.entries())
+
+    def __contains__(self, name):
+        self.entries()
+        return name in self._by_name
+
+    def __getitem__(self, name):
+        self.entries()
+        return self._by_name[name]
+
+    def view(self, entry):
+        """Return a memoryview on the payload of entry, backed by mmap"""
+        if isinstance(entry, str):
+            entry = self[entry]
+        if self._mmap is None:
+            self._mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)[entry.data_offset : entry.data_offset + entry.size]
+
+    def open(self, entry):
+        """Return a file object to read the payload of entry"""
+        return io.BufferedReader(SWUEntryFile(self.view(entry)))
+
+    def read(self, entry):
+        with self.view(entry) as view:
+            return bytes(view)
+
+    def verify(self, entry):
+        """Check the payload of entry against the checksum in its header"""
+        if isinstance(entry, str):
+            entry = self[entry]
+        with self.view(entry) as view:
+            return checksum.get_backend()(view) & checksum.MASK == entry.checksum
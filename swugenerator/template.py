@@ -0,0 +1,206 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# sw-description templates are tokenized once and can be rendered
+# against many sets of variables. @@VARIABLE@@ placeholders are
+# replaced with the values from the configuration file, then
+# $function(parameter) calls are dispatched to a table of allowed
+# functions.
+import codecs
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+_PLACEHOLDER = re.compile(r"^(?P<before_placeholder>.+)@@(?P<variable_name>\w+)@@(?P<after_placeholder>.*)$")
+_LEGACY_PLACEHOLDER = re.compile(
+    r"^(?P<before_placeholder>.+)@@(?P<variable_name>\w+)@@(?P<after_placeholder>.+)$"
+)
+_CALL = re.compile(r"\$(?P<function_name>\w+)\(")
+
+_cache = {}
+
+
+class TemplateError(Exception):
+    pass
+
+
+class _Line:
+    """A line with placeholders: literals at even, variable names at odd positions"""
+
+    __slots__ = ("parts",)
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def render(self, confvars):
+        parts = list(self.parts)
+        for i in range(1, len(parts), 2):
+            parts[i] = str(_lookup(confvars, parts[i]))
+            if "@" in parts[i]:
+                # a value may contain placeholders itself
+                line = self.source()
+                body = line.rstrip("\n")
+                return _expand_legacy(body, confvars) + line[len(body) :]
+        return "".join(parts)
+
+    def source(self):
+        parts = list(self.parts)
+        for i in range(1, len(parts), 2):
+            parts[i] = f"@@{parts[i]}@@"
+        return "".join(parts)
+
+
+def _lookup(confvars, name):
+    try:
+        return confvars[name]
+    except KeyError as error:
+        raise TemplateError(f"Variable {name} is not defined") from error
+
+
+def _expand_legacy(line, confvars):
+    while m := _LEGACY_PLACEHOLDER.match(line):
+        line = (
+            m.group("before_placeholder")
+            + str(_lookup(confvars, m.group("variable_name")))
+            + m.group("after_placeholder")
+        )
+    return line
+
+
+def _compile_line(line):
+    """Split a line into literals and variable names.
+
+    A placeholder needs at least one character before and after it on
+    the line, and the rightmost one is taken first: the same rules as
+    the original regular expression expansion.
+    """
+    body = line.rstrip("\n")
+    newline = line[len(body) :]
+    m = _LEGACY_PLACEHOLDER.match(body)
+    if not m:
+        return line
+    parts = [m.group("after_placeholder") + newline, m.group("variable_name")]
+    before = m.group("before_placeholder")
+    while m := _PLACEHOLDER.match(before):
+        parts += [m.group("after_placeholder"), m.group("variable_name")]
+        before = m.group("before_placeholder")
+    parts.append(before)
+    parts.reverse()
+    return _Line(parts)
+
+
+def _find_calls(line):
+    """Yield (start, end, function name, parameter) of the calls in line"""
+    body_end = len(line.rstrip("\n"))
+    pos = 0
+    while m := _CALL.search(line, pos):
+        depth = 1
+        end = m.end()
+        while end < body_end and depth:
+            if line[end] == "(":
+                depth += 1
+            elif line[end] == ")":
+                depth -= 1
+            end += 1
+        pos = m.end()
+        # calls at the very start or end of a line are left alone
+        if depth or m.start() == 0 or end >= body_end or end - 1 == m.end():
+            continue
+        yield m.start(), end, m.group("function_name"), line[m.end() : end - 1]
+        pos = end
+
+
+def evaluate(texts, functions, jobs=1):
+    """Call each distinct $function(parameter) found in texts once.
+
+    Calls run in parallel with jobs > 1. Returns a table of functions
+    with the same names, answering from the results.
+    """
+    calls = {
+        (name, parm)
+        for text in texts
+        if "$" in text
+        for _, _, name, parm in _find_calls(text)
+    }
+    for name, _ in calls:
+        if name not in functions:
+            raise TemplateError(f"Unknown function {name}")
+    calls = sorted(calls)
+    if jobs > 1 and len(calls) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            values = list(pool.map(lambda call: functions[call[0]](call[1]), calls))
+    else:
+        values = [functions[name](parm) for name, parm in calls]
+    results = dict(zip(calls, values))
+    return {
+        name: (lambda parm, name=name: results[(name, parm)]) for name in functions
+    }
+
+
+def call_functions(line, functions):
+    """Replace the $function(parameter) calls in line with their result"""
+    out = []
+    pos = 0
+    for start, end, name, parm in _find_calls(line):
+        func = functions.get(name)
+        if func is None:
+            raise TemplateError(f"Unknown function {name}")
+        ret = func(parm)
+        if ret is None:
+            raise TemplateError(f"{name}({parm}) returned no value")
+        out += [line[pos:start], ret]
+        pos = end
+    if not out:
+        return line
+    out.append(line[pos:])
+    line = "".join(out)
+    return line if line.endswith("\n") else line + "\n"
+
+
+class Template:
+    """A sw-description template tokenized once"""
+
+    def __init__(self, lines):
+        self.items = []
+        static = []
+        for line in lines:
+            item = _compile_line(line)
+            if isinstance(item, str) and "$" not in item:
+                static.append(item)
+                continue
+            if static:
+                self.items.append("".join(static))
+                static = []
+            self.items.append(item)
+        if static:
+            self.items.append("".join(static))
+
+    @classmethod
+    def load(cls, filename):
+        """Return the compiled template of filename, cached while the file is unchanged"""
+        st = os.stat(filename)
+        key = (os.fspath(filename), st.st_size, st.st_mtime_ns)
+        template = _cache.get(key)
+        if template is None:
+            with codecs.open(filename, "r") as f:
+                template = cls(f.readlines())
+            _cache[key] = template
+        return template
+
+    def render_lines(self, confvars):
+        """Yield the text with variables expanded, split in static blocks and lines"""
+        for item in self.items:
+            yield item if isinstance(item, str) else item.render(confvars)
+
+    def render(self, confvars, functions, jobs=1):
+        """Return the template with variables expanded and functions called.
+
+        All function calls are evaluated first, each distinct call once
+        and in parallel with jobs > 1.
+        """
+        texts = list(self.render_lines(confvars))
+        functions = evaluate(texts, functions, jobs)
+        return "".join(
+            call_functions(text, functions) if "$" in text else text for text in texts
+        )
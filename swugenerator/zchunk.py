@@ -0,0 +1,71 @@
+# Copyright (C) 2026 Stefano Babic
+#
+# SPDX-License-Identifier: GPLv3
+#
+# Minimal reader for the lead of a zchunk file. A delta artifact in the
+# SWU is just the zchunk header: the lead followed by the preface, the
+# index and the signatures. Its length is read from the lead instead of
+# running zck_read_header.
+#
+# Lead layout:
+#   magic "\0ZCK1", checksum type (compint), header size (compint),
+#   header checksum (size depends on checksum type)
+# The header size counts the bytes after the lead.
+import os
+
+ZCK_MAGIC = b"\x00ZCK1"
+
+# checksum type -> digest size: sha1, sha256, sha512, sha512/128
+HASH_SIZES = {0: 20, 1: 32, 2: 64, 3: 16}
+
+# a compint of a 64 bit value needs at most 10 bytes
+COMPINT_MAX = 10
+
+
+class ZckFormatException(Exception):
+    pass
+
+
+def read_compint(f):
+    """Read a zchunk compressed integer from f.
+
+    Little endian groups of 7 bits, the high bit marks the last byte.
+    """
+    value = 0
+    for shift in range(0, 7 * COMPINT_MAX, 7):
+        byte = f.read(1)
+        if not byte:
+            raise ZckFormatException("Truncated zchunk lead")
+        value |= (byte[0] & 0x7F) << shift
+        if byte[0] & 0x80:
+            return value
+    raise ZckFormatException("Invalid compressed integer in zchunk lead")
+
+
+def header_length(f):
+    """Return the length of lead and header of the zchunk file f"""
+    magic = f.read(len(ZCK_MAGIC))
+    if magic != ZCK_MAGIC:
+        raise ZckFormatException(f"Not a zchunk file, magic: {magic}")
+    hash_type = read_compint(f)
+    if hash_type not in HASH_SIZES:
+        raise ZckFormatException(f"Unknown zchunk header checksum type {hash_type}")
+    header_size = read_compint(f)
+    return f.tell() + HASH_SIZES[hash_type] + header_size
+
+
+def extract_header(zckfile, dest):
+    """Cut the zchunk file zckfile to its header and move it to dest.
+
+    The data after the header is not needed, the file is truncated
+    in place instead of copying the header.
+    Returns the header length.
+    """
+    with open(zckfile, "rb") as f:
+        length = header_length(f)
+        f.seek(0, os.SEEK_END)
+        if f.tell() < length:
+            raise ZckFormatException(f"Truncated zchunk header in {zckfile}")
+    os.truncate(zckfile, length)
+    os.replace(zckfile, dest)
+    return length
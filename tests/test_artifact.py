@@ -0,0 +1,113 @@
+# pylint: disable=C0114,C0116,W0621
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from swugenerator.artifact import Artifact, ArtifactIndex, ArtifactRegistry, TransformMemo
+from swugenerator.digest import digest_file
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    first = tmp_path / "first"
+    second = tmp_path / "second"
+    for d in (first, second, second / "sub"):
+        d.mkdir()
+    (first / "rootfs.img").write_bytes(b"first")
+    (second / "rootfs.img").write_bytes(b"second")
+    (second / "kernel").write_bytes(b"kernel")
+    (second / "sub" / "dtb").write_bytes(b"dtb")
+    os.symlink(tmp_path / "missing", first / "kernel")
+    return [first, second, tmp_path / "nonexistent"]
+
+
+def test_first_directory_wins(dirs):
+    index = ArtifactIndex(dirs)
+    assert index.lookup("rootfs.img") == os.path.join(dirs[0], "rootfs.img")
+    assert index.resolved == {"rootfs.img": dirs[0]}
+
+
+def test_dangling_symlink_is_skipped(dirs):
+    index = ArtifactIndex(dirs)
+    assert index.lookup("kernel") == os.path.join(dirs[1], "kernel")
+
+
+def test_missing_file(dirs):
+    index = ArtifactIndex(dirs)
+    assert index.lookup("u-boot.bin") is None
+    assert not index.resolved
+
+
+def test_name_with_directory(dirs):
+    index = ArtifactIndex(dirs)
+    assert index.lookup("sub/dtb") == os.path.join(dirs[1], "sub/dtb")
+
+
+def test_directories_are_scanned_once(dirs, monkeypatch):
+    index = ArtifactIndex(dirs)
+    scanned = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda d: scanned.append(d) or scandir(d))
+    for _ in range(3):
+        index.lookup("rootfs.img")
+        index.lookup("kernel")
+    assert scanned == dirs
+
+
+def test_findfile_with_index_or_list(dirs):
+    from_index = Artifact("rootfs.img")
+    from_list = Artifact("rootfs.img")
+    assert from_index.findfile(ArtifactIndex(dirs))
+    assert from_list.findfile(dirs)
+    assert from_index.fullfilename == from_list.fullfilename
+    assert from_index.getsize() == 5
+    assert not Artifact("u-boot.bin").findfile(ArtifactIndex(dirs))
+
+
+def test_findfile_without_digest(dirs):
+    artifact = Artifact("rootfs.img", digest_func=pytest.fail)
+    assert artifact.findfile(ArtifactIndex(dirs), digest=False)
+    assert artifact.getsize() == 5
+
+
+def test_registry_computes_each_file_once(dirs):
+    calls = []
+
+    def compute(path):
+        calls.append(path)
+        return digest_file(path)
+
+    registry = ArtifactRegistry(compute)
+    path = os.path.join(dirs[0], "rootfs.img")
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        digests = list(pool.map(registry.digest, [path] * 8))
+    assert digests == [digest_file(path)] * 8
+    assert calls == [path]
+
+
+def test_memo_prepares_each_key_once(tmp_path):
+    prepared = []
+    started = threading.Barrier(4)
+
+    def get(key):
+        started.wait()
+        return memo.get(key, lambda: prepared.append(key) or Artifact(memo.path(key, "image")))
+
+    memo = TransformMemo(tmp_path)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(get, ["a", "a", "a", "b"]))
+    assert sorted(prepared) == ["a", "b"]
+    assert len({id(artifact) for artifact, _ in results[:3]}) == 1
+    assert sorted(shared for _, shared in results[:3]) == [False, True, True]
+    assert results[3][0].filename == str(tmp_path / "b" / "image")
+
+
+def test_memo_shares_errors(tmp_path):
+    memo = TransformMemo(tmp_path)
+    with pytest.raises(SystemExit):
+        memo.get("a", lambda: sys.exit(22))
+    with pytest.raises(SystemExit):
+        memo.get("a", pytest.fail)
@@ -0,0 +1,65 @@
+# pylint: disable=C0114,C0116,W0621
+from pathlib import Path
+
+import pytest
+
+from swugenerator.batch import BatchJob, InvalidManifest, load_manifest, run_jobs
+
+
+def write_manifest(tmp_path, text):
+    manifest = tmp_path / "manifest"
+    manifest.write_text(text)
+    return str(manifest)
+
+
+def test_paths_are_relative_to_manifest(tmp_path):
+    manifest = write_manifest(
+        tmp_path,
+        'jobs = ( { sw-description = "a/sw-description.in"; output = "out/a.swu";'
+        ' config = "a/config"; artifactory = [ "images", "/abs" ]; },'
+        ' { sw-description = "b.in"; output = "b.swu"; } );',
+    )
+    assert load_manifest(manifest) == [
+        BatchJob(
+            tmp_path / "a/sw-description.in",
+            tmp_path / "out/a.swu",
+            tmp_path / "a/config",
+            [tmp_path / "images", Path("/abs")],
+        ),
+        BatchJob(tmp_path / "b.in", tmp_path / "b.swu", None, []),
+    ]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "jobs = ();",
+        'jobs = ( { sw-description = "a.in"; } );',
+        'jobs = ( { output = "a.swu"; } );',
+        'jobs = ( { sw-description = "a.in"; output = "a.swu"; },'
+        ' { sw-description = "b.in"; output = "a.swu"; } );',
+        "jobs = ( ",
+    ],
+)
+def test_invalid_manifest(tmp_path, text):
+    with pytest.raises(InvalidManifest):
+        load_manifest(write_manifest(tmp_path, text))
+
+
+def test_missing_manifest(tmp_path):
+    with pytest.raises(InvalidManifest):
+        load_manifest(str(tmp_path / "missing"))
+
+
+def test_run_jobs_raises_first_error_after_all_jobs(tmp_path):
+    built = []
+
+    def build(job):
+        built.append(job.output)
+        if job.output.name != "ok.swu":
+            raise SystemExit(22)
+
+    jobs = [BatchJob(None, tmp_path / name, None, []) for name in ("bad.swu", "ok.swu")]
+    with pytest.raises(SystemExit):
+        run_jobs(jobs, build, 2)
+    assert sorted(built) == sorted(job.output for job in jobs)
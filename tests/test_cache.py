@@ -0,0 +1,97 @@
+# pylint: disable=C0114,C0116,W0621
+import os
+
+import pytest
+
+from swugenerator.cache import ArtifactCache, DigestCache
+from swugenerator.digest import Digest, digest_file
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ArtifactCache(tmp_path / "cache", max_size=100)
+
+
+@pytest.fixture
+def payload(tmp_path):
+    def make(name, size):
+        path = tmp_path / name
+        path.write_bytes(os.urandom(size))
+        return path
+
+    return make
+
+
+def test_key_depends_on_source_and_transforms():
+    key = ArtifactCache.key("aa", {"compressed": ["xz", "inprocess"]})
+    assert key == ArtifactCache.key("aa", {"compressed": ["xz", "inprocess"]})
+    assert key != ArtifactCache.key("bb", {"compressed": ["xz", "inprocess"]})
+    assert key != ArtifactCache.key("aa", {"compressed": ["zstd", "inprocess"]})
+
+
+def test_put_and_get_roundtrip(cache, payload, tmp_path):
+    src = payload("image.xz", 40)
+    cache.put("k1", src, {"filename": "image.xz"})
+    dest = tmp_path / "out.xz"
+    assert cache.get("k1", dest) == {"filename": "image.xz"}
+    assert dest.read_bytes() == src.read_bytes()
+
+
+def test_get_miss_returns_none(cache, tmp_path):
+    assert cache.get("missing", tmp_path / "out") is None
+    assert not (tmp_path / "out").exists()
+
+
+def test_least_recently_used_entry_is_evicted(cache, payload, tmp_path):
+    cache.put("k1", payload("a", 40), {})
+    cache.put("k2", payload("b", 40), {})
+    os.utime(cache._path("k2"), ns=(0, 0))
+    # k1 is used again, k2 is now the oldest one
+    assert cache.get("k1", tmp_path / "a.out") is not None
+    cache.put("k3", payload("c", 40), {})
+    assert cache.get("k2", tmp_path / "b.out") is None
+    assert cache.get("k1", tmp_path / "a2.out") is not None
+    assert cache.get("k3", tmp_path / "c.out") is not None
+
+
+def test_digest_cache_persists_across_runs(payload, tmp_path):
+    src = payload("rootfs.img", 1000)
+    calls = []
+
+    def compute(path):
+        calls.append(path)
+        return digest_file(path)
+
+    cache = DigestCache(tmp_path / "digests.json")
+    first = cache.digest(src, compute)
+    assert cache.digest(src, compute) == first
+    cache.save()
+    assert DigestCache(tmp_path / "digests.json").digest(src, compute) == first
+    assert len(calls) == 1
+
+
+def test_digest_cache_detects_changed_file(payload, tmp_path):
+    src = payload("rootfs.img", 1000)
+    cache = DigestCache(tmp_path / "digests.json")
+    cache.digest(src, digest_file)
+    src.write_bytes(b"changed")
+    assert cache.digest(src, digest_file) == digest_file(src)
+    cache.save()
+    assert len(DigestCache(tmp_path / "digests.json").entries) == 1
+
+
+def test_digest_cache_uses_sidecar(payload):
+    src = payload("rootfs.img", 1000)
+    sha256 = "ab" * 32
+    (src.parent / "rootfs.img.sha256").write_text(f"{sha256}  rootfs.img\n")
+    cache = DigestCache(sidecars=True)
+    assert cache.digest(src, pytest.fail) == Digest(sha256, None, 1000)
+    assert DigestCache().digest(src, digest_file) == digest_file(src)
+
+
+def test_digest_cache_ignores_stale_sidecar(payload):
+    src = payload("rootfs.img", 1000)
+    sidecar = src.parent / "rootfs.img.sha256"
+    sidecar.write_text("ab" * 32)
+    os.utime(sidecar, ns=(0, 0))
+    assert DigestCache(sidecars=True).digest(src, digest_file) == digest_file(src)
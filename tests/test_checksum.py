@@ -0,0 +1,63 @@
+# pylint: disable=C0114,C0116,W0621
+import os
+
+import pytest
+
+from swugenerator import checksum
+
+SAMPLES = [
+    b"",
+    b"\x00",
+    b"\xff",
+    b"\xff" * 255,
+    b"\xff" * 256,
+    b"\xff" * 257,
+    bytes(range(256)) * 17 + b"odd",
+    os.urandom(65536 + 3),
+]
+
+
+@pytest.mark.parametrize("name", sorted(checksum.BACKENDS))
+@pytest.mark.parametrize("data", SAMPLES)
+def test_backend_is_bit_identical_to_reference(name, data):
+    assert checksum.BACKENDS[name](data) == checksum.sum_reference(data)
+
+
+@pytest.mark.parametrize("name", sorted(checksum.BACKENDS))
+def test_backend_passes_self_check(name):
+    assert checksum.self_check(checksum.BACKENDS[name])
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(checksum.ChecksumBackendError):
+        checksum.set_backend("foo")
+
+
+def test_checksum_file_wraps_at_32_bits(tmp_path):
+    # 0xff repeated more than 2^32 / 255 times overflows the field
+    path = tmp_path / "ones.bin"
+    data = b"\xff" * (0x1010102 + 1)
+    path.write_bytes(data)
+    assert checksum.checksum_file(path) == (255 * len(data)) & checksum.MASK
+
+
+def test_threaded_checksum_matches_serial(tmp_path, monkeypatch):
+    path = tmp_path / "big.bin"
+    data = os.urandom(1024 * 1024 + 7)
+    path.write_bytes(data)
+    monkeypatch.setattr(checksum, "THREADED_MIN_SIZE", 1024)
+    monkeypatch.setattr(checksum, "THREADED_CHUNK", 100000)
+    assert checksum.checksum_file(path, threads=4) == sum(data) & checksum.MASK
+    assert checksum.checksum_file(path, threads=1) == sum(data) & checksum.MASK
+
+
+def test_stdlib_checksum_sums_ranges_in_processes(tmp_path, monkeypatch):
+    path = tmp_path / "big.bin"
+    data = os.urandom(1024 * 1024 + 7)
+    path.write_bytes(data)
+    monkeypatch.setattr(checksum, "THREADED_MIN_SIZE", 1024)
+    monkeypatch.setattr(checksum, "THREADED_CHUNK", 300000)
+    monkeypatch.setattr(checksum, "_backend", checksum.sum_stdlib)
+    # the stdlib backend holds the GIL, threads would not sum in parallel
+    monkeypatch.setattr(checksum, "ThreadPoolExecutor", None)
+    assert checksum.checksum_file(path, threads=4) == sum(data) & checksum.MASK
@@ -0,0 +1,67 @@
+# pylint: disable=C0114,C0116,W0621
+import gzip
+import hashlib
+import lzma
+import os
+
+import pytest
+
+from swugenerator import compress
+
+DATA = b"swupdate compressible payload " * 20000 + os.urandom(4096)
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "image.bin"
+    path.write_bytes(DATA)
+    return path
+
+
+def decompress(name, data):
+    if name == "zlib":
+        return gzip.decompress(data)
+    if name == "xz":
+        return lzma.decompress(data)
+    zstandard = pytest.importorskip("zstandard")
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+@pytest.mark.parametrize("name", sorted(compress.CODECS))
+def test_compress_file_roundtrip_and_digest(name, source, tmp_path):
+    codec = compress.get_codec(name)
+    if codec is None:
+        pytest.skip(f"{name} not available")
+    dst = tmp_path / ("image.bin." + name)
+    result = compress.compress_file(codec, source, dst)
+    data = dst.read_bytes()
+    assert decompress(name, data) == DATA
+    assert result.sha256 == hashlib.sha256(data).hexdigest()
+    assert result.checksum == sum(data) & 0xFFFFFFFF
+    assert result.size == len(data)
+
+
+@pytest.mark.parametrize("name", sorted(compress.CODECS))
+def test_decompressobj_restores_compressed_file(name, source, tmp_path):
+    codec = compress.get_codec(name)
+    if codec is None:
+        pytest.skip(f"{name} not available")
+    dst = tmp_path / ("image.bin." + name)
+    compress.compress_file(codec, source, dst)
+    data = dst.read_bytes()
+    decompressor = codec.decompressobj()
+    restored = b"".join(
+        decompressor.decompress(data[i : i + 4096]) for i in range(0, len(data), 4096)
+    )
+    assert restored == DATA
+
+
+def test_zlib_codec_writes_gzip_header_like_gzip_n(source, tmp_path):
+    dst = tmp_path / "image.bin.zlib"
+    compress.compress_file(compress.get_codec("zlib"), source, dst)
+    # magic, deflate, no flags, mtime 0, max compression, unix
+    assert dst.read_bytes()[:10] == bytes.fromhex("1f8b0800000000000203")
+
+
+def test_unknown_codec_is_not_available():
+    assert compress.get_codec("lz4") is None
@@ -59,3 +59,80 @@ def test_write_header_64bit_inode(next_artifact, monkeypatch):
     header = virtual_cpio.getvalue()
     inode0 = header[6:14]
     assert inode0 == b"00000001"
+
+
+def _pack(out, artifacts):
+    cpio = swu_file.SWUFile(out)
+    for artifact in artifacts:
+        cpio.addartifacttoswu(str(artifact))
+    cpio.add_trailer()
+
+
+@pytest.mark.parametrize("broken", [[], ["copy_file_range"], ["copy_file_range", "sendfile"]])
+def test_kernel_copy_matches_buffered_copy(next_artifact, tmp_path, monkeypatch, broken):
+    artifacts = [next_artifact(), next_artifact()]
+    virtual_cpio = io.BytesIO()
+    _pack(virtual_cpio, artifacts)
+
+    def fail(*_args):
+        raise OSError("not supported")
+
+    for name in broken:
+        monkeypatch.setattr(os, name, fail, raising=False)
+    with open(tmp_path / "out.swu", "wb") as out:
+        _pack(out, artifacts)
+    assert (tmp_path / "out.swu").read_bytes() == virtual_cpio.getvalue()
+
+
+def test_header_is_written_at_once(next_artifact):
+    writes = []
+
+    class RecordingFile(io.BytesIO):
+        def write(self, data):
+            writes.append(data)
+            return super().write(data)
+
+    virtual_swu_file = swu_file.SWUFile(RecordingFile())
+    virtual_swu_file.write_header(next_artifact())
+    assert len(writes) == 1
+    assert len(writes[0]) == 110 + len("artifact0.txt") + 1
+
+
+@pytest.fixture
+def packed_swu(tmp_path):
+    payloads = {"sw-description": b"software = {};\n", "rootfs.img": os.urandom(300000)}
+    swu = io.BytesIO()
+    cpio = swu_file.SWUFile(swu)
+    for name, data in payloads.items():
+        (tmp_path / name).write_bytes(data)
+        cpio.addartifacttoswu(str(tmp_path / name))
+    cpio.add_trailer()
+    swu.seek(0)
+    return swu, payloads
+
+
+def test_extract_in_chunks(packed_swu, tmp_path, monkeypatch):
+    swu, payloads = packed_swu
+    monkeypatch.setattr(swu_file, "get_buffer", lambda: bytearray(4096))
+    out = tmp_path / "out"
+    assert swu_file.SWUFile(swu).extract(out) == list(payloads)
+    for name, data in payloads.items():
+        assert (out / name).read_bytes() == data
+
+
+@pytest.mark.parametrize("select", [["sw-description"], lambda name: name == "sw-description"])
+def test_extract_selected_entries(packed_swu, tmp_path, select):
+    swu, _ = packed_swu
+    out = tmp_path / "out"
+    assert swu_file.SWUFile(swu).extract(out, select) == ["sw-description"]
+    assert not (out / "rootfs.img").exists()
+
+
+def test_extract_detects_wrong_checksum(packed_swu, tmp_path):
+    swu, _ = packed_swu
+    data = bytearray(swu.getvalue())
+    # corrupt the last byte of the rootfs payload
+    end = data.rfind(b"070702")
+    data[end - 1] ^= 0xFF
+    with pytest.raises(swu_file.FormatException):
+        swu_file.SWUFile(io.BytesIO(bytes(data))).extract(tmp_path / "out")
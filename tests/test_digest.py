@@ -0,0 +1,58 @@
+# pylint: disable=C0114,C0116,W0621
+import hashlib
+import io
+
+import pytest
+
+from swugenerator import digest, swu_file
+from swugenerator.artifact import Artifact
+
+
+@pytest.fixture
+def payload(tmp_path):
+    data = bytes(range(256)) * 5000 + b"tail"
+    path = tmp_path / "payload.bin"
+    path.write_bytes(data)
+    return path, data
+
+
+def test_digest_file_matches_separate_computations(payload):
+    path, data = payload
+    result = digest.digest_file(path, bufsize=4096)
+    assert result.sha256 == hashlib.sha256(data).hexdigest()
+    assert result.checksum == sum(data) & 0xFFFFFFFF
+    assert result.size == len(data)
+
+
+def test_digester_incremental_updates(payload):
+    _, data = payload
+    digester = digest.Digester()
+    for offset in range(0, len(data), 1000):
+        digester.update(data[offset : offset + 1000])
+    assert digester.digest() == digest.Digest(
+        hashlib.sha256(data).hexdigest(), sum(data) & 0xFFFFFFFF, len(data)
+    )
+
+
+def test_artifact_digest_is_computed_once(payload, monkeypatch):
+    path, _ = payload
+    artifact = Artifact(path.name)
+    assert artifact.findfile([path.parent])
+    calls = []
+    monkeypatch.setattr(
+        "swugenerator.artifact.digest_file",
+        lambda *args, **kwargs: calls.append(args),
+    )
+    artifact.getsha256()
+    artifact.digest()
+    assert not calls
+
+
+def test_write_header_uses_precomputed_checksum(payload, monkeypatch):
+    path, data = payload
+    result = digest.digest_file(path)
+    cpio = swu_file.SWUFile(io.BytesIO())
+    monkeypatch.setattr(cpio, "cpiocrc", lambda *_: pytest.fail("file reread"))
+    cpio.addartifacttoswu(path, result)
+    header = cpio.file.getvalue()
+    assert int(header[102:110], 16) == sum(data) & 0xFFFFFFFF
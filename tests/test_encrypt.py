@@ -0,0 +1,52 @@
+# pylint: disable=C0114,C0116,W0621
+import hashlib
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from swugenerator import encrypt
+
+KEY = "390ad54490a4a5f53722291023c19e08ffb5c4677a59e958c96ffa6e641df040"
+IV = "d5d601bacfe13100b149177318ebc7a4"
+
+pytestmark = pytest.mark.skipif(not encrypt.available(), reason="cryptography not installed")
+
+
+@pytest.mark.skipif(not shutil.which("openssl"), reason="openssl not installed")
+@pytest.mark.parametrize("size", [0, 1, 15, 16, 17, 1024 * 1024 + 3])
+def test_same_ciphertext_as_openssl(tmp_path, size):
+    src = tmp_path / "plain"
+    src.write_bytes(os.urandom(size))
+    expected = tmp_path / "openssl.enc"
+    subprocess.run(
+        ["openssl", "enc", "-aes-256-cbc", "-in", src, "-out", expected,
+         "-K", KEY, "-iv", IV, "-nosalt"],
+        check=True,
+    )
+    dst = tmp_path / "plain.enc"
+    result = encrypt.encrypt_file(src, dst, KEY, IV)
+    data = dst.read_bytes()
+    assert data == expected.read_bytes()
+    assert result.sha256 == hashlib.sha256(data).hexdigest()
+    assert result.checksum == sum(data) & 0xFFFFFFFF
+    assert result.size == len(data) == (size // 16 + 1) * 16
+
+
+@pytest.mark.parametrize("size", [0, 15, 16, 100003])
+def test_decryptor_restores_encrypted_file(tmp_path, size):
+    plain = os.urandom(size)
+    src = tmp_path / "plain"
+    src.write_bytes(plain)
+    dst = tmp_path / "plain.enc"
+    encrypt.encrypt_file(src, dst, KEY, IV)
+    data = dst.read_bytes()
+    decryptor = encrypt.AESDecryptor(KEY, IV)
+    restored = b"".join(decryptor.update(data[i : i + 1000]) for i in range(0, len(data), 1000))
+    assert restored + decryptor.finalize() == plain
+
+
+def test_invalid_key_is_rejected():
+    with pytest.raises(ValueError):
+        encrypt.AESEncryptor(KEY[:32], IV)
@@ -0,0 +1,61 @@
+# pylint: disable=C0114,C0116
+import shutil
+import threading
+from collections import namedtuple
+
+import pytest
+
+from swugenerator.governor import NoSpaceException, TempBudget, check_free_space
+
+
+def test_unlimited_budget():
+    budget = TempBudget()
+    assert budget.reserve(1 << 40)
+
+
+def test_reservation_beyond_budget_is_refused_when_alone():
+    budget = TempBudget(100)
+    assert budget.reserve(60)
+    budget.release(60)
+    assert not budget.reserve(101)
+
+
+def test_tracked_files_count(tmp_path):
+    budget = TempBudget(100)
+    path = tmp_path / "image.xz"
+    path.write_bytes(b"x" * 80)
+    budget.track(path)
+    assert not budget.reserve(30)
+    budget.remove(path)
+    assert not path.exists()
+    assert budget.reserve(30)
+
+
+def test_reservation_waits_for_running_stages():
+    budget = TempBudget(100)
+    assert budget.reserve(70)
+    granted = []
+    waiter = threading.Thread(target=lambda: granted.append(budget.reserve(50)))
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive()
+    budget.release(70)
+    waiter.join()
+    assert granted == [True]
+
+
+def test_check_free_space(tmp_path, monkeypatch):
+    usage = namedtuple("usage", "total used free")
+    monkeypatch.setattr(shutil, "disk_usage", lambda path: usage(0, 0, 100 << 20))
+    check_free_space(tmp_path, 10 << 20)
+    with pytest.raises(NoSpaceException):
+        check_free_space(tmp_path, 100 << 20)
+
+
+def test_free_space_margin_scales_with_small_files(tmp_path, monkeypatch):
+    usage = namedtuple("usage", "total used free")
+    monkeypatch.setattr(shutil, "disk_usage", lambda path: usage(0, 0, 40 << 20))
+    check_free_space(tmp_path, 0)
+    check_free_space(tmp_path, 4 << 20)
+    with pytest.raises(NoSpaceException, match="margin of 22020096 bytes"):
+        check_free_space(tmp_path, 21 << 20)
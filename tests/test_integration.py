@@ -1,12 +1,16 @@
 # pylint: disable=C0114,C0116,W0621
 """This file hosts integration tests to ensure tool creates valid SWUs"""
+import json
+import os
 from pathlib import Path
 import pytest
 import shutil
+import sys
 
 import libarchive
+import libconf
 
-from swugenerator import main
+from swugenerator import cache, generator, main, signer, swu_file, swu_reader
 
 VALID_KEY = "390ad54490a4a5f53722291023c19e08ffb5c4677a59e958c96ffa6e641df040"
 VALID_IV = "d5d601bacfe13100b149177318ebc7a4"
@@ -277,3 +281,639 @@ def test_with_encryption_flag_creates_encrypted_and_sign_swu(
     main.parse_args(command_args)
 
     assert validate_swu(output_directory / signed_output_file, encrypted=True)
+
+
+def test_parallel_jobs_create_same_swu_as_serial(
+    artifactory, sw_description_template, config_file, output_directory, monkeypatch
+):
+    # digest all artifacts in worker processes as well
+    monkeypatch.setattr(generator, "PROCESS_DIGEST_MIN_SIZE", 0)
+    outputs = []
+    for jobs in ("1", "4"):
+        output_file = output_directory / f"output-{jobs}.swu"
+        command_args = [
+            "-s",
+            str(sw_description_template),
+            "-a",
+            str(artifactory),
+            "-c",
+            str(config_file),
+            "-j",
+            jobs,
+            "-o",
+            str(output_file.resolve()),
+            "create",
+        ]
+        main.parse_args(command_args)
+        outputs.append(output_file.read_bytes())
+    assert outputs[0] == outputs[1]
+
+
+def test_cached_artifacts_create_same_swu(
+    artifactory, sw_description_template, config_file, output_directory, tmp_path, monkeypatch
+):
+    outputs = []
+    for run in range(2):
+        output_file = output_directory / f"output-{run}.swu"
+        command_args = [
+            "-s",
+            str(sw_description_template),
+            "-a",
+            str(artifactory),
+            "-c",
+            str(config_file),
+            "--cache-dir",
+            str(tmp_path / "cache"),
+            "-o",
+            str(output_file.resolve()),
+            "create",
+        ]
+        main.parse_args(command_args)
+        outputs.append(output_file.read_bytes())
+        # second run must not compress again
+        monkeypatch.setattr(generator.SWUGenerator, "process_compressed_entry", None)
+    assert outputs[0] == outputs[1]
+
+
+@pytest.mark.parametrize("extra_args", [[], ["-y"]])
+def test_stream_creates_same_swu_as_staged(
+    artifactory, sw_description_template, config_file, output_directory, monkeypatch, extra_args
+):
+    outputs = []
+    for stream_args in ([], ["--stream"]):
+        output_file = output_directory / f"output{len(stream_args)}.swu"
+        command_args = [
+            "-s",
+            str(sw_description_template),
+            "-a",
+            str(artifactory),
+            "-c",
+            str(config_file),
+            "-o",
+            str(output_file.resolve()),
+            *extra_args,
+            *stream_args,
+            "create",
+        ]
+        main.parse_args(command_args)
+        outputs.append(output_file.read_bytes())
+        # streamed artifacts are never staged
+        monkeypatch.setattr(generator, "compress_file", None)
+    assert outputs[0] == outputs[1]
+
+
+def test_resigning_signed_swu_only_replaces_signature(
+    artifactory, sw_description_template, config_file, signing_key, output_directory, monkeypatch
+):
+    signed_output = output_directory / "signed_output.swu"
+    command_args = [
+        "-s",
+        str(sw_description_template),
+        "-a",
+        str(artifactory),
+        "-c",
+        str(config_file),
+        "-k",
+        f"RSA,{signing_key}",
+        "-o",
+        str(signed_output.resolve()),
+        "create",
+    ]
+    main.parse_args(command_args)
+    # nothing but sw-description may be unpacked
+    monkeypatch.setattr(swu_file.SWUFile, "extract", None)
+    resigned_output = output_directory / "resigned_output.swu"
+    command_args = [
+        "-o",
+        str(resigned_output.resolve()),
+        "-k",
+        f"RSA,{signing_key}",
+        "sign",
+        "-i",
+        str(signed_output.resolve()),
+    ]
+    main.parse_args(command_args)
+    assert resigned_output.read_bytes() == signed_output.read_bytes()
+
+
+def test_stats_and_trace_reports(
+    artifactory, sw_description_template, config_file, output_directory
+):
+    output_file = output_directory / "output.swu"
+    stats_file = output_directory / "stats.json"
+    trace_file = output_directory / "trace.json"
+    command_args = [
+        "-s",
+        str(sw_description_template),
+        "-a",
+        str(artifactory),
+        "-c",
+        str(config_file),
+        "--stats",
+        str(stats_file),
+        "--trace",
+        str(trace_file),
+        "-o",
+        str(output_file.resolve()),
+        "create",
+    ]
+    main.parse_args(command_args)
+    report = json.loads(stats_file.read_text())
+    for stage in ("template", "parse", "find", "hash", "compress", "pack"):
+        assert report["stages"][stage]["count"] > 0
+    assert set(report["artifacts"]) >= set(UPDATE_FILES)
+    assert report["peak_temp_bytes"] > 0
+    trace = json.loads(trace_file.read_text())
+    assert {event["name"] for event in trace["traceEvents"]} >= {"prepare", "pack"}
+
+
+FAKE_ZCK = """#!{python}
+import sys
+args = sys.argv[1:]
+out = args[args.index("--output") + 1]
+with open(args[-1], "rb") as src, open(out, "wb") as zck:
+    # lead: magic, sha256 header checksum, 64 bytes header
+    zck.write(b"\\x00ZCK1" + bytes([0x81, 64 | 0x80]) + b"h" * 32 + b"H" * 64)
+    zck.write(src.read())
+"""
+
+
+def test_delta_entry_writes_only_into_work_dir(
+    artifactory, config_file, output_directory, tmp_path, monkeypatch
+):
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    zck = bindir / "zck"
+    zck.write_text(FAKE_ZCK.format(python=sys.executable))
+    zck.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+    template = tmp_path / "sw-description.in"
+    template.write_text(
+        'software =\n{\n    version = "@@UPDATE_VERSION@@";\n'
+        '    images: ( { filename = "rootfs.ubifs"; type = "delta"; } );\n}\n'
+    )
+    before = sorted(os.listdir(artifactory))
+    output_file = output_directory / "delta.swu"
+    command_args = [
+        "-s",
+        str(template),
+        "-a",
+        str(artifactory),
+        "-c",
+        str(config_file),
+        "-o",
+        str(output_file.resolve()),
+        "create",
+    ]
+    main.parse_args(command_args)
+    assert sorted(os.listdir(artifactory)) == before
+    with open(output_file, "rb") as swu, swu_reader.SWUReader(swu) as reader:
+        header = reader.read("rootfs.ubifs")
+    assert header == b"\x00ZCK1\x81\xc0" + b"h" * 32 + b"H" * 64
+
+
+def test_temp_budget_creates_same_swu(
+    artifactory, sw_description_template, config_file, output_directory, tmp_path
+):
+    outputs = []
+    for budget_args in ([], ["--workdir", str(tmp_path / "work"), "--temp-budget", "1"]):
+        output_file = output_directory / f"output{len(budget_args)}.swu"
+        command_args = [
+            "-s",
+            str(sw_description_template),
+            "-a",
+            str(artifactory),
+            "-c",
+            str(config_file),
+            "-j",
+            "2",
+            "-o",
+            str(output_file.resolve()),
+            *budget_args,
+            "create",
+        ]
+        main.parse_args(command_args)
+        outputs.append(output_file.read_bytes())
+    assert outputs[0] == outputs[1]
+    assert not list((tmp_path / "work").iterdir())
+
+
+@pytest.mark.parametrize("jobs", ["1", "4"])
+def test_template_functions_hash_each_artifact_once(
+    artifactory, config_file, output_directory, tmp_path, monkeypatch, jobs
+):
+    template = tmp_path / "sw-description.in"
+    template.write_text(
+        'software =\n{\n    version = "@@UPDATE_VERSION@@";\n'
+        '    sha = [ "$swupdate_get_sha256(uImage.bin)", "$swupdate_get_sha256(uImage.bin)" ];\n'
+        '    size = "$swupdate_get_size(rootfs.ubifs)";\n'
+        '    images: ( { filename = "uImage.bin"; }, { filename = "rootfs.ubifs"; } );\n}\n'
+    )
+    hashed = []
+    digest_file = generator.digest_file
+
+    def counting_digest_file(path):
+        hashed.append(os.path.basename(path))
+        return digest_file(path)
+
+    monkeypatch.setattr(generator, "digest_file", counting_digest_file)
+    command_args = [
+        "-s",
+        str(template),
+        "-a",
+        str(artifactory),
+        "-c",
+        str(config_file),
+        "-j",
+        jobs,
+        "-o",
+        str((output_directory / "output.swu").resolve()),
+        "create",
+    ]
+    main.parse_args(command_args)
+    assert hashed.count("uImage.bin") == 1
+    assert hashed.count("rootfs.ubifs") == 1
+
+
+def test_preserve_format_keeps_template_layout(
+    artifactory, sw_description_template, config_file, output_directory
+):
+    descriptions = []
+    for extra_args in ([], ["--preserve-format"]):
+        output_file = output_directory / f"output{len(extra_args)}.swu"
+        command_args = [
+            "-s",
+            str(sw_description_template),
+            "-a",
+            str(artifactory),
+            "-c",
+            str(config_file),
+            "-o",
+            str(output_file.resolve()),
+            *extra_args,
+            "create",
+        ]
+        main.parse_args(command_args)
+        with open(output_file, "rb") as swu, swu_reader.SWUReader(swu) as reader:
+            descriptions.append(reader.read("sw-description").decode("utf-8"))
+    assert libconf.loads(descriptions[0]) == libconf.loads(descriptions[1])
+    # comments of the template are still there
+    template = sw_description_template.read_text()
+    assert "/*" not in descriptions[0]
+    assert descriptions[1].count("/*") == template.count("/*")
+
+
+def _as_json(value):
+    if isinstance(value, dict):
+        return {k: _as_json(v) for k, v in value.items()}
+    if isinstance(value, (tuple, list)):
+        return [_as_json(v) for v in value]
+    return value
+
+
+def test_json_swdescription_matches_libconf(
+    artifactory, config_file, output_directory, encryption_key, tmp_path
+):
+    images = [
+        {"filename": "rootfs.ubifs", "volume": "rootfs"},
+        {"filename": "sdcard.ext3.gz", "compressed": "zlib", "encrypted": True},
+        {"filename": "uImage.bin", "volume": "kernel"},
+    ]
+    templates = {
+        "libconf": 'software =\n{\n    version = "@@UPDATE_VERSION@@";\n    images: (\n'
+        '        { filename = "rootfs.ubifs"; volume = "rootfs"; },\n'
+        '        { filename = "sdcard.ext3.gz"; compressed = "zlib"; encrypted = true; },\n'
+        '        { filename = "uImage.bin"; volume = "kernel"; }\n    );\n};\n',
+        "json": json.dumps(
+            {"software": {"version": "@@UPDATE_VERSION@@", "images": images}}, indent=4
+        ),
+    }
+    swus = {}
+    for fmt, text in templates.items():
+        template = tmp_path / f"sw-description.{fmt}"
+        template.write_text(text)
+        output_file = output_directory / f"{fmt}.swu"
+        command_args = [
+            "-s",
+            str(template),
+            "-a",
+            str(artifactory),
+            "-c",
+            str(config_file),
+            "-K",
+            str(encryption_key),
+            "-x",
+            "-o",
+            str(output_file.resolve()),
+            "create",
+        ]
+        main.parse_args(command_args)
+        with open(output_file, "rb") as swu, swu_reader.SWUReader(swu) as reader:
+            swus[fmt] = {entry.name: reader.read(entry) for entry in reader}
+
+    swdesc = swus["json"].pop("sw-description").decode("utf-8")
+    expected = swus["libconf"].pop("sw-description").decode("utf-8")
+    assert json.loads(swdesc) == _as_json(libconf.loads(expected))
+    assert swus["json"] == swus["libconf"]
+
+
+def test_batch_shares_work_between_swus(
+    artifactory, sw_description_template, encrypted_sw_description_template,
+    config_file, encryption_key, output_directory, tmp_path, monkeypatch
+):
+    common_args = ["-a", str(artifactory), "-c", str(config_file), "-K", str(encryption_key), "-x"]
+    templates = {
+        "plain": sw_description_template,
+        "enc": encrypted_sw_description_template,
+    }
+    expected = {}
+    for name, template in templates.items():
+        output_file = output_directory / f"{name}-single.swu"
+        main.parse_args(
+            [*common_args, "-s", str(template), "-o", str(output_file), "create"]
+        )
+        expected[name] = output_file.read_bytes()
+
+    manifest = tmp_path / "manifest"
+    manifest.write_text(
+        "jobs = (\n"
+        + ",\n".join(
+            f'{{ sw-description = "{template}"; output = "{output_directory}/{name}-{i}.swu"; }}'
+            for i in range(2)
+            for name, template in templates.items()
+        )
+        + "\n);\n"
+    )
+    compressed = []
+    compress_file = generator.compress_file
+
+    def counting_compress_file(codec, src, dest, threads=0):
+        compressed.append(os.path.basename(src))
+        return compress_file(codec, src, dest, threads)
+
+    hashed = []
+    digest = cache.DigestCache.digest
+
+    def counting_digest(digests, path, compute):
+        hashed.append(path)
+        return digest(digests, path, compute)
+
+    monkeypatch.setattr(generator, "compress_file", counting_compress_file)
+    monkeypatch.setattr(cache.DigestCache, "digest", counting_digest)
+    main.parse_args([*common_args, "-j", "4", "batch", "-m", str(manifest)])
+    for i in range(2):
+        for name in templates:
+            assert (output_directory / f"{name}-{i}.swu").read_bytes() == expected[name]
+    # once for each template, one of them encrypts it as well
+    assert compressed == ["sdcard.ext3.gz"] * 2
+    # shared payloads keep their digest when they are moved out of the work directory
+    assert all(Path(path).parent == artifactory for path in hashed)
+
+
+def test_reuse_from_copies_unchanged_payloads(
+    artifactory, encrypted_sw_description_template, config_file, encryption_key,
+    output_directory, monkeypatch
+):
+    def create(output_file, *extra_args):
+        main.parse_args(
+            [
+                "-s",
+                str(encrypted_sw_description_template),
+                "-a",
+                str(artifactory),
+                "-c",
+                str(config_file),
+                "-K",
+                str(encryption_key),
+                *extra_args,
+                "-o",
+                str(output_file),
+                "create",
+            ]
+        )
+        return output_file.read_bytes()
+
+    previous = output_directory / "previous.swu"
+    expected = create(previous, "-x")
+
+    compressed = []
+    encrypted = []
+    compress_file = generator.compress_file
+    encrypt = generator.Artifact.encrypt
+
+    def counting_compress_file(codec, src, dest, threads=0):
+        compressed.append(os.path.basename(src))
+        return compress_file(codec, src, dest, threads)
+
+    def counting_encrypt(artifact, *args):
+        encrypted.append(artifact.filename)
+        return encrypt(artifact, *args)
+
+    monkeypatch.setattr(generator, "compress_file", counting_compress_file)
+    monkeypatch.setattr(generator.Artifact, "encrypt", counting_encrypt)
+
+    reused = create(output_directory / "reused.swu", "-x", "--reuse-from", str(previous))
+    assert reused == expected
+    assert not compressed
+    assert not encrypted
+
+    # a generated IV is never reused
+    encrypted.clear()
+    create(output_directory / "new-iv.swu", "--reuse-from", str(previous))
+    assert compressed == ["sdcard.ext3.gz"]
+    assert encrypted
+
+    # a changed artifact is processed again
+    compressed.clear()
+    with (artifactory / "sdcard.ext3.gz").open("a") as file_fd:
+        file_fd.write("CHANGED\n")
+    create(output_directory / "changed.swu", "-x", "--reuse-from", str(previous))
+    assert compressed == ["sdcard.ext3.gz"]
+
+
+def test_reuse_from_cannot_be_a_batch_output(
+    artifactory, sw_description_template, output_directory, tmp_path
+):
+    previous = output_directory / "previous.swu"
+    previous.write_bytes(b"previous build")
+    manifest = tmp_path / "manifest"
+    manifest.write_text(
+        f'jobs = ( {{ sw-description = "{sw_description_template}"; output = "{previous}"; }} );\n'
+    )
+    with pytest.raises(SystemExit):
+        main.parse_args(
+            ["-a", str(artifactory), "--reuse-from", str(previous), "batch", "-m", str(manifest)]
+        )
+    assert previous.read_bytes() == b"previous build"
+
+
+def test_reuse_from_cannot_be_the_output(
+    artifactory, sw_description_template, output_directory
+):
+    output_file = output_directory / "output.swu"
+    with pytest.raises(SystemExit):
+        main.parse_args(
+            [
+                "-s",
+                str(sw_description_template),
+                "-a",
+                str(artifactory),
+                "--reuse-from",
+                str(output_file),
+                "-o",
+                str(output_file),
+                "create",
+            ]
+        )
+
+
+def test_dry_run_prints_plan_without_creating_swu(
+    artifactory, sw_description_template, config_file, output_directory, monkeypatch, capsys
+):
+    monkeypatch.setattr(generator, "compress_file", None)
+    output_file = output_directory / "output.swu"
+    main.parse_args(
+        [
+            "-s",
+            str(sw_description_template),
+            "-a",
+            str(artifactory),
+            "-c",
+            str(config_file),
+            "--dry-run",
+            "-o",
+            str(output_file),
+            "create",
+        ]
+    )
+    assert not output_file.exists()
+    plan = capsys.readouterr().out
+    for filename in UPDATE_FILES:
+        assert filename in plan
+    assert "sdcard.ext3.gz.zlib" in plan
+
+
+@pytest.mark.parametrize("missing,code", [("artifact", 22), ("key", 1)])
+def test_plan_fails_before_processing_artifacts(
+    artifactory, encrypted_sw_description_template, config_file, encryption_key,
+    output_directory, monkeypatch, missing, code
+):
+    processed = []
+    monkeypatch.setattr(generator.SWUGenerator, "prepare_artifact", processed.append)
+    args = ["-s", str(encrypted_sw_description_template), "-a", str(artifactory), "-c", str(config_file)]
+    if missing == "artifact":
+        (artifactory / "display_info").unlink()
+        args += ["-K", str(encryption_key)]
+    with pytest.raises(SystemExit) as e:
+        main.parse_args([*args, "-o", str(output_directory / "output.swu"), "create"])
+    assert e.value.code == code
+    assert not processed
+
+
+@pytest.mark.parametrize("version,threads", [((5, 2, 5), False), ((5, 4, 1), True), (None, False)])
+def test_external_xz_threads_depend_on_version(monkeypatch, version, threads):
+    monkeypatch.setattr(generator, "xz_version", lambda: version)
+    cmd = generator.compressor_command("xz")
+    assert ("-T+{threads}" in cmd) == threads
+    assert cmd[:4] == ["xz", "-f", "-k", "-c"]
+
+
+@pytest.mark.parametrize("extra_args", [[], ["-n"]])
+def test_full_work_directory_streams_instead_of_failing(
+    artifactory, sw_description_template, config_file, output_directory, monkeypatch, extra_args
+):
+    def create(output_file):
+        main.parse_args(
+            [
+                "-s",
+                str(sw_description_template),
+                "-a",
+                str(artifactory),
+                "-c",
+                str(config_file),
+                *extra_args,
+                "-o",
+                str(output_file),
+                "create",
+            ]
+        )
+        return output_file.read_bytes()
+
+    expected = create(output_directory / "expected.swu")
+
+    def no_space(directory, nbytes):
+        if nbytes:
+            raise generator.NoSpaceException(f"{nbytes} bytes needed in {directory}")
+
+    monkeypatch.setattr(generator, "check_free_space", no_space)
+    assert create(output_directory / "full.swu") == expected
+
+
+@pytest.mark.parametrize("threaded,external", [(True, True), (False, False)])
+def test_xz_tool_preferred_when_it_shares_threads(
+    artifactory, sw_description_template, output_directory, monkeypatch, threaded, external
+):
+    monkeypatch.setattr(generator, "threaded_xz", lambda: threaded)
+    swu = generator.SWUGenerator(
+        sw_description_template, output_directory / "out.swu", {}, [artifactory], None, None, None
+    )
+    assert (swu._codec("xz") is None) == external
+    assert swu._codec("zlib") is not None
+    swu.close()
+
+
+def test_resigning_drops_signature_anywhere_in_swu(tmp_path):
+    unsigned = tmp_path / "unsigned.swu"
+    for name, data in (("sw-description", b"software = {};\n"), ("image", b"payload"),
+                       ("sw-description.sig", b"stale signature")):
+        (tmp_path / name).write_bytes(data)
+    with open(unsigned, "wb") as f:
+        swu = swu_file.SWUFile(f)
+        for name in ("sw-description", "image", "sw-description.sig"):
+            swu.addartifacttoswu(str(tmp_path / name))
+        swu.add_trailer()
+
+    class Signer:
+        def prepare_cmd(self, sw_desc_in, sw_desc_out):
+            self.out = sw_desc_out
+
+        def sign(self):
+            Path(self.out).write_bytes(b"new signature")
+
+    resigned = tmp_path / "resigned.swu"
+    swu_signer = signer.SWUSigner(unsigned, resigned, Signer())
+    swu_signer.process()
+    swu_signer.close()
+    with open(resigned, "rb") as f, swu_reader.SWUReader(f) as reader:
+        contents = [(entry.name, reader.read(entry)) for entry in reader]
+    assert [name for name, _ in contents] == ["sw-description", "sw-description.sig", "image"]
+    assert contents[1][1] == b"new signature"
+
+
+def test_transformed_source_is_not_hashed_without_cache(
+    artifactory, sw_description_template, config_file, output_directory, monkeypatch
+):
+    hashed = []
+    compute_digest = generator.SWUGenerator._compute_digest
+
+    def counting_compute_digest(swu, path):
+        hashed.append(os.path.basename(path))
+        return compute_digest(swu, path)
+
+    monkeypatch.setattr(generator.SWUGenerator, "_compute_digest", counting_compute_digest)
+    main.parse_args(
+        [
+            "-s",
+            str(sw_description_template),
+            "-a",
+            str(artifactory),
+            "-c",
+            str(config_file),
+            "-o",
+            str(output_directory / "output.swu"),
+            "create",
+        ]
+    )
+    # the compressed output is hashed while it is written
+    assert "sdcard.ext3.gz" not in hashed
+    assert "rootfs.ubifs" in hashed
@@ -246,6 +246,8 @@ VALID_COMMANDS = [
             "test.cfg",
             "-l",
             "DEBUG",
+            "-j",
+            "4",
             "create",
         ]
     ),
@@ -269,6 +271,10 @@ VALID_COMMANDS = [
             "test.cfg",
             "--loglevel",
             "DEBUG",
+            "--jobs",
+            "0",
+            "--max-threads",
+            "2",
             "create",
         ]
     ),
@@ -300,6 +306,9 @@ INVALID_COMMANDS = [
     (["-i", "in.swu", "-o", "test.swu", "sign"]),
     (["-o", "test.swu", "create"]),
     (["-o", "sign", "-i", "in.swu"]),
+    (["-j", "-1", "-s", "sw-description", "-o", "test.swu", "create"]),
+    (["-j", "foo", "-s", "sw-description", "-o", "test.swu", "create"]),
+    (["--max-threads", "-2", "-s", "sw-description", "-o", "test.swu", "create"]),
 ]
 
 
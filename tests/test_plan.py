@@ -0,0 +1,73 @@
+# pylint: disable=C0114,C0116,W0621
+import os
+
+import pytest
+
+from swugenerator import compress, plan
+
+DATA = b"swupdate compressible payload " * 400000
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "image.bin"
+    path.write_bytes(DATA)
+    return path
+
+
+def test_estimate_compression_from_samples(source, tmp_path):
+    codec = compress.get_codec("zlib")
+    estimate = plan.Estimate(source, len(DATA))
+    assert estimate.sampled == plan.SAMPLE_SIZE
+    estimate.compress(codec)
+    actual = compress.compress_file(codec, source, tmp_path / "image.bin.zlib").size
+    assert estimate.size == pytest.approx(actual, rel=0.5)
+    assert estimate.seconds > 0
+
+
+def test_estimate_encryption_adds_padding(tmp_path):
+    path = tmp_path / "small"
+    path.write_bytes(os.urandom(100))
+    estimate = plan.Estimate(path, 100)
+    estimate.encrypt()
+    assert estimate.size == 112
+
+
+def test_unknown_estimate_stays_unknown(source):
+    estimate = plan.Estimate(source, len(DATA))
+    estimate.unknown()
+    estimate.compress(compress.get_codec("zlib"))
+    estimate.encrypt()
+    assert estimate.size is None and estimate.seconds is None
+
+
+def test_missing_artifact_wins_exit_code():
+    p = plan.Plan()
+    assert p.exit_code() == 0
+    p.error("no key")
+    p.error("no key")
+    p.error("Artifact a not found", plan.EXIT_NOT_FOUND)
+    assert len(p.errors) == 2
+    assert p.exit_code() == plan.EXIT_NOT_FOUND
+
+
+def test_format_lists_steps_and_totals():
+    p = plan.Plan()
+    p.add(plan.PlanStep("rootfs", "/a/rootfs", 2048, ["xz"], "rootfs.xz", 1024, 1.5))
+    p.add(plan.PlanStep("kernel", None, 0, [], "kernel"))
+    lines = p.format().splitlines()
+    assert lines[0].split() == ["Artifact", "Size", "Transforms", "Output", "Est.", "size", "Est.", "time"]
+    assert lines[1].split() == ["rootfs", "2.0K", "xz", "rootfs.xz", "1.0K", "1.5s"]
+    assert lines[2].split() == ["kernel", "missing", "-", "kernel", "?", "?"]
+    assert lines[3].split() == ["Total", "2.0K", "?", "?"]
+
+
+def test_summary_gives_totals_and_work_directory():
+    p = plan.Plan()
+    p.add(plan.PlanStep("rootfs", "/a/rootfs", 2048, ["xz"], "rootfs.xz"))
+    p.add(plan.PlanStep("kernel", "/a/kernel", 1024, [], "kernel"))
+    p.temp_needed = 2048
+    p.temp_free = 1 << 30
+    assert p.summary() == (
+        "2 artifacts, 1 transformed, 3.0K in total, work directory 2.0K needed, 1.0G free"
+    )
@@ -0,0 +1,53 @@
+# pylint: disable=C0114,C0116,W0621
+import os
+
+import pytest
+
+from swugenerator import compress, encrypt
+from swugenerator.digest import digest_file
+from swugenerator.reuse import PreviousSWU
+from swugenerator.swu_file import SWUFile
+
+KEY = "390ad54490a4a5f53722291023c19e08ffb5c4677a59e958c96ffa6e641df040"
+IV = "d5d601bacfe13100b149177318ebc7a4"
+
+pytestmark = pytest.mark.skipif(not encrypt.available(), reason="cryptography not installed")
+
+
+def _xz_source(tmp_path, aligned):
+    """Write a source whose xz output length is a multiple of 16 or not"""
+    codec = compress.get_codec("xz")
+    src = tmp_path / "image"
+    for size in range(4096, 8192):
+        data = os.urandom(size)
+        compressor = codec.compressobj()
+        payload = compressor.compress(data) + compressor.flush()
+        if (len(payload) % 16 == 0) == aligned:
+            src.write_bytes(data)
+            return src, payload
+    raise AssertionError("no suitable payload")
+
+
+@pytest.mark.parametrize("aligned", [True, False])
+def test_encrypted_xz_payload_is_restored(tmp_path, caplog, aligned):
+    src, payload = _xz_source(tmp_path, aligned)
+    encryptor = encrypt.AESEncryptor(KEY, IV)
+    (tmp_path / "image.xz.enc").write_bytes(encryptor.update(payload) + encryptor.finalize())
+    (tmp_path / "sw-description").write_text(
+        "software = { images = ( { filename = \"image.xz.enc\"; compressed = \"xz\";"
+        f" encrypted = true; ivt = \"{IV}\"; }} ); }};\n"
+    )
+    previous = tmp_path / "previous.swu"
+    with open(previous, "wb") as f:
+        swu = SWUFile(f)
+        swu.addartifacttoswu(str(tmp_path / "sw-description"))
+        swu.addartifacttoswu(str(tmp_path / "image.xz.enc"))
+        swu.add_trailer()
+
+    reuse = PreviousSWU(previous, KEY, IV)
+    try:
+        found = reuse.find("image.xz.enc", digest_file(src), "xz", IV)
+    finally:
+        reuse.close()
+    assert found is not None
+    assert not caplog.records
@@ -0,0 +1,66 @@
+# pylint: disable=C0114,C0116
+import threading
+
+from swugenerator.scheduler import BYTES_PER_THREAD, CoreScheduler
+
+
+def test_small_artifact_gets_one_thread():
+    scheduler = CoreScheduler(8)
+    with scheduler.threads(1024) as threads:
+        assert threads == 1
+
+
+def test_large_artifact_gets_more_threads():
+    scheduler = CoreScheduler(8)
+    with scheduler.threads(4 * BYTES_PER_THREAD) as threads:
+        assert threads == 4
+    with scheduler.threads(100 * BYTES_PER_THREAD) as threads:
+        assert threads == 8
+
+
+def test_threads_are_capped_by_compressor():
+    scheduler = CoreScheduler(8)
+    with scheduler.threads(100 * BYTES_PER_THREAD, max_useful=1) as threads:
+        assert threads == 1
+
+
+def test_budget_is_shared_by_size():
+    scheduler = CoreScheduler(8)
+    with scheduler.threads(BYTES_PER_THREAD) as small:
+        with scheduler.threads(100 * BYTES_PER_THREAD) as large:
+            assert small == 1
+            assert large == 7
+
+
+def test_budget_is_never_exceeded():
+    scheduler = CoreScheduler(3)
+    lock = threading.Lock()
+    in_use = [0, 0]
+
+    def compress():
+        with scheduler.threads(10 * BYTES_PER_THREAD) as threads:
+            with lock:
+                in_use[0] += threads
+                in_use[1] = max(in_use[1], in_use[0])
+            with lock:
+                in_use[0] -= threads
+
+    workers = [threading.Thread(target=compress) for _ in range(16)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert in_use[1] <= 3
+    assert scheduler._used == 0
+
+
+def test_memory_limits_threads():
+    scheduler = CoreScheduler(8, max_memory=100)
+    with scheduler.threads(100 * BYTES_PER_THREAD, memory_per_thread=30) as threads:
+        assert threads == 3
+
+
+def test_compression_alone_runs_beyond_memory():
+    scheduler = CoreScheduler(8, max_memory=100)
+    with scheduler.threads(BYTES_PER_THREAD, memory_per_thread=300) as threads:
+        assert threads == 1
@@ -0,0 +1,63 @@
+# pylint: disable=C0114,C0116
+import json
+import threading
+
+from swugenerator.stats import Stats, dir_usage
+
+
+def test_nested_stages_have_self_time():
+    stats = Stats()
+    with stats.stage("prepare", "rootfs.img"):
+        with stats.stage("compress", nbytes=1000):
+            pass
+    report = stats.report()
+    prepare = report["stages"]["prepare"]
+    compress = report["stages"]["compress"]
+    assert prepare["seconds"] >= compress["seconds"]
+    assert prepare["self_seconds"] <= prepare["seconds"] - compress["seconds"] + 1e-6
+    assert compress["bytes"] == 1000
+    # nested stages are accounted to the artifact of the outer one
+    assert set(report["artifacts"]["rootfs.img"]) == {"prepare", "compress", "bytes"}
+
+
+def test_subprocess_time():
+    stats = Stats()
+    with stats.stage("sign", external=True):
+        pass
+    with stats.stage("hash"):
+        pass
+    assert stats.subprocess_seconds == stats.stages["sign"]["seconds"]
+
+
+def test_stages_from_threads():
+    stats = Stats()
+
+    def work(name):
+        with stats.stage("prepare", name):
+            with stats.stage("hash", nbytes=10):
+                pass
+
+    threads = [threading.Thread(target=work, args=(str(i),)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stats.stages["hash"]["count"] == 4
+    assert set(stats.artifacts) == {"0", "1", "2", "3"}
+
+
+def test_peak_temp_and_files(tmp_path):
+    work = tmp_path / "work"
+    (work / "sub").mkdir(parents=True)
+    (work / "a").write_bytes(b"x" * 100)
+    (work / "sub" / "b").write_bytes(b"x" * 50)
+    assert dir_usage(work) == 150
+    stats = Stats()
+    stats.sample_temp(work)
+    (work / "a").unlink()
+    stats.sample_temp(work)
+    assert stats.peak_temp_bytes == 150
+    stats.save(tmp_path / "stats.json")
+    stats.save_trace(tmp_path / "trace.json")
+    assert json.loads((tmp_path / "stats.json").read_text())["peak_temp_bytes"] == 150
+    assert json.loads((tmp_path / "trace.json").read_text())["traceEvents"] == []
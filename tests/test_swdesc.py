@@ -0,0 +1,95 @@
+# pylint: disable=C0114,C0116,W0621
+from pathlib import Path
+
+import libconf
+import pytest
+
+from swugenerator.swdesc import SWDescription, is_json
+
+INPUTS = Path(__file__).parent / "test_data/integration_input"
+
+TEMPLATE = """\
+software = {
+    version = "1.0"; // not changed
+    images: (
+        {
+            filename = "rootfs.img"; # kept
+            compressed = "zlib";
+            properties = { mount = "/"; };
+        },
+        { filename = "boot.img"; sha256 = "old"; }
+    );
+    scripts: (
+        {
+            filename = "update.lua";
+            type = "lua";
+            data = "line1\\n\\tline2"
+                   "line3";
+        }
+    );
+};
+"""
+
+
+@pytest.mark.parametrize("name", ["sw-description", "sw-description.in", "enc-sw-description.in"])
+def test_parses_as_libconf(name):
+    text = (INPUTS / name).read_text()
+    desc = SWDescription(text)
+    assert desc.conf == libconf.loads(text)
+    assert desc.dumps() == text
+
+
+def test_values_and_types():
+    text = 'a = 0x10L; b = -3; c = 1.5e2; d = TRUE; e = ( 1, { f = [ "x", "y" ]; } ); g = "a" "b";'
+    desc = SWDescription(text)
+    assert desc.conf == libconf.loads(text)
+    assert isinstance(desc.conf.e, tuple)
+    assert isinstance(desc.conf.e[1], libconf.AttrDict)
+    assert isinstance(desc.conf.e[1].f, list)
+
+
+def test_unchanged_text_is_kept():
+    desc = SWDescription(TEMPLATE)
+    assert desc.dumps() == TEMPLATE
+
+
+def test_fields_are_spliced_in():
+    desc = SWDescription(TEMPLATE)
+    rootfs, boot = desc.conf.software.images
+    rootfs["filename"] = "rootfs.img.zlib"
+    rootfs["sha256"] = "1234"
+    rootfs["properties"]["decompressed-size"] = "42"
+    boot["sha256"] = "new"
+    script = desc.conf.software.scripts[0]
+    script["sha256"] = "5678"
+    out = desc.dumps([rootfs, boot, script])
+    assert libconf.loads(out) == desc.conf
+    assert '            filename = "rootfs.img.zlib"; # kept\n' in out
+    assert 'properties = { mount = "/"; decompressed-size = "42"; };' in out
+    assert '            sha256 = "1234";\n        },' in out
+    assert '{ filename = "boot.img"; sha256 = "new"; }' in out
+    assert '"line3";\n            sha256 = "5678";\n        }' in out
+    assert 'data = "line1\\n\\tline2"\n' in out
+    assert "// not changed" in out
+
+
+def test_new_group_is_appended():
+    desc = SWDescription('images: ( { filename = "a"; encrypted = true } );')
+    entry = desc.conf.images[0]
+    entry["ivt"] = "00"
+    entry["properties"] = {"decrypted-size": "16"}
+    out = desc.dumps([entry])
+    assert libconf.loads(out) == desc.conf
+
+
+def test_syntax_error():
+    with pytest.raises(libconf.ConfigParseError):
+        SWDescription('software = { version = "1.0"; ')
+    with pytest.raises(libconf.ConfigParseError):
+        SWDescription("software = { version = @; }")
+
+
+def test_is_json():
+    assert is_json('\n  { "software": { "version": "1.0" } }')
+    assert not is_json('software = { version = "1.0"; };')
+    assert not is_json('# comment\nsoftware = { version = "1.0"; };')
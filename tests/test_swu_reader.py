@@ -0,0 +1,44 @@
+# pylint: disable=C0114,C0116,W0621
+import pytest
+
+from swugenerator import swu_file
+from swugenerator.swu_reader import SWUReader
+
+PAYLOADS = {"sw-description": b"software = {};\n", "rootfs.img": b"x" * 4097, "a": b"abc"}
+
+
+@pytest.fixture
+def swu(tmp_path):
+    path = tmp_path / "test.swu"
+    with open(path, "wb") as out:
+        cpio = swu_file.SWUFile(out)
+        for name, data in PAYLOADS.items():
+            artifact = tmp_path / name
+            artifact.write_bytes(data)
+            cpio.addartifacttoswu(str(artifact))
+        cpio.add_trailer()
+    with open(path, "rb") as f:
+        with SWUReader(f) as reader:
+            yield reader
+
+
+def test_index_lists_entries_in_order(swu):
+    assert [entry.name for entry in swu] == list(PAYLOADS)
+    for entry in swu:
+        assert entry.size == len(PAYLOADS[entry.name])
+        assert entry.data_offset % 4 == 0
+
+
+def test_random_access_to_payloads(swu):
+    assert swu.read("rootfs.img") == PAYLOADS["rootfs.img"]
+    with swu.open(swu["a"]) as entry:
+        assert entry.read(1) == b"a"
+        entry.seek(0)
+        assert entry.read() == b"abc"
+    assert "missing" not in swu
+
+
+def test_verify_checks_payload_against_header(swu):
+    assert all(swu.verify(entry) for entry in swu)
+    entry = swu["a"]
+    assert not swu.verify(entry._replace(checksum=entry.checksum + 1))
@@ -0,0 +1,95 @@
+# pylint: disable=C0114,C0116
+import pytest
+
+from swugenerator.template import Template, TemplateError
+
+LINES = [
+    "software = {\n",
+    '    version = "@@VERSION@@";\n',
+    '    name = "@@NAME@@-@@VERSION@@.img";\n',
+    '    sha256 = "$swupdate_get_sha256(@@NAME@@.img)";\n',
+    "};\n",
+]
+
+
+def functions(calls=None):
+    def sha256(parm):
+        if calls is not None:
+            calls.append(parm)
+        return f"sha({parm})"
+
+    return {"swupdate_get_sha256": sha256, "swupdate_get_size": lambda parm: "42"}
+
+
+def test_render_many_configurations():
+    template = Template(LINES)
+    first = template.render({"VERSION": "1.0", "NAME": "rootfs"}, functions())
+    second = template.render({"VERSION": "2.0", "NAME": "boot"}, functions())
+    assert first == (
+        "software = {\n"
+        '    version = "1.0";\n'
+        '    name = "rootfs-1.0.img";\n'
+        '    sha256 = "sha(rootfs.img)";\n'
+        "};\n"
+    )
+    assert 'name = "boot-2.0.img";' in second
+
+
+def test_static_lines_are_merged():
+    template = Template(LINES)
+    assert template.items[0] == "software = {\n"
+    assert template.items[-1] == "};\n"
+    assert len(template.items) == 5
+
+
+def test_placeholders_at_line_boundaries_are_kept():
+    template = Template(["@@A@@ x\n", "x @@A@@\n", "x@@A@@@@A@@x\n"])
+    assert template.render({"A": "a"}, {}) == "@@A@@ x\nx @@A@@\nxaax\n"
+
+
+def test_value_with_placeholder_is_expanded():
+    template = Template(['v = "@@A@@";\n'])
+    assert template.render({"A": "@@B@@-", "B": "b"}, {}) == 'v = "b-";\n'
+
+
+def test_missing_variable():
+    with pytest.raises(TemplateError, match="Variable VERSION is not defined"):
+        Template(LINES).render({"NAME": "rootfs"}, functions())
+
+
+def test_several_functions_on_one_line():
+    line = 'x = ["$swupdate_get_sha256(a)", "$swupdate_get_size(b(1))"];\n'
+    calls = []
+    assert (
+        Template([line]).render({}, functions(calls))
+        == 'x = ["sha(a)", "42"];\n'
+    )
+    assert calls == ["a"]
+
+
+def test_unknown_function_is_not_evaluated():
+    with pytest.raises(TemplateError, match="Unknown function __import__"):
+        Template(['x = "$__import__(os)";\n']).render({}, functions())
+
+
+def test_load_caches_compiled_template(tmp_path):
+    path = tmp_path / "sw-description.in"
+    path.write_text("".join(LINES))
+    assert Template.load(path) is Template.load(path)
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_each_call_is_evaluated_once(jobs):
+    lines = [f'x{i} = "$swupdate_get_sha256(image{i % 3})";\n' for i in range(9)]
+    calls = []
+    out = Template(lines).render({}, functions(calls), jobs)
+    assert sorted(calls) == ["image0", "image1", "image2"]
+    assert 'x4 = "sha(image1)";' in out
+
+
+def test_unknown_function_is_reported_before_any_call():
+    calls = []
+    lines = ['a = "$swupdate_get_sha256(a)";\n', 'b = "$nope(b)";\n']
+    with pytest.raises(TemplateError, match="Unknown function nope"):
+        Template(lines).render({}, functions(calls), 4)
+    assert not calls
@@ -0,0 +1,67 @@
+# pylint: disable=C0114,C0116
+import io
+
+import pytest
+
+from swugenerator.zchunk import (
+    ZCK_MAGIC,
+    ZckFormatException,
+    extract_header,
+    header_length,
+    read_compint,
+)
+
+
+def compint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F)
+        value >>= 7
+    out.append(value | 0x80)
+    return bytes(out)
+
+
+def zck_file(header_size, hash_type=1, hash_size=32, data=b"chunks" * 100):
+    lead = ZCK_MAGIC + compint(hash_type) + compint(header_size) + b"h" * hash_size
+    return lead + b"H" * header_size + data, len(lead) + header_size
+
+
+@pytest.mark.parametrize("value", [0, 1, 127, 128, 300, 1 << 40])
+def test_compint(value):
+    assert read_compint(io.BytesIO(compint(value))) == value
+
+
+def test_compint_truncated():
+    with pytest.raises(ZckFormatException):
+        read_compint(io.BytesIO(b"\x2c"))
+
+
+@pytest.mark.parametrize("hash_type,hash_size", [(0, 20), (1, 32), (2, 64), (3, 16)])
+def test_header_length(hash_type, hash_size):
+    data, length = zck_file(300, hash_type, hash_size)
+    assert header_length(io.BytesIO(data)) == length
+
+
+def test_not_zchunk():
+    with pytest.raises(ZckFormatException, match="Not a zchunk file"):
+        header_length(io.BytesIO(b"\x00ZCK2" + b"\x81" * 40))
+    with pytest.raises(ZckFormatException, match="checksum type"):
+        header_length(io.BytesIO(ZCK_MAGIC + compint(9) + compint(1)))
+
+
+def test_extract_header(tmp_path):
+    data, length = zck_file(1000)
+    zck = tmp_path / "image.zck"
+    zck.write_bytes(data)
+    dest = tmp_path / "image"
+    assert extract_header(zck, dest) == length
+    assert dest.read_bytes() == data[:length]
+    assert not zck.exists()
+
+
+def test_extract_truncated_header(tmp_path):
+    data, length = zck_file(1000, data=b"")
+    zck = tmp_path / "image.zck"
+    zck.write_bytes(data[: length - 1])
+    with pytest.raises(ZckFormatException, match="Truncated"):
+        extract_header(zck, tmp_path / "image")